@@ -0,0 +1,112 @@
+# admission.py
+# Admission control for per-frame work: at most `slots` frames are processed
+# at once, at most `max_queue` wait behind them, and each session holds at
+# most one place in the queue. A newer frame from a session takes over the
+# queued place of its older one (the old request is told it was superseded),
+# so sessions are served round-robin and nobody waits on a stale frame.
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+ADMITTED = "admitted"
+SUPERSEDED = "superseded"
+EXPIRED = "expired"
+
+
+def worker_limits(env=os.environ):
+    """(slots, max_queue) for one worker process.
+
+    ANALYZE_CONCURRENCY (default: CPU count) and ANALYZE_QUEUE_MAX are budgets
+    for the whole node; each of the WEB_CONCURRENCY workers gets its share, so
+    the workers together never run more frames than there are CPUs.
+    """
+    workers = max(1, int(env.get("WEB_CONCURRENCY", "1")))
+    slots = int(env.get("ANALYZE_CONCURRENCY", str(os.cpu_count() or 2)))
+    queue = int(env.get("ANALYZE_QUEUE_MAX", "64"))
+    return max(1, slots // workers), max(0, math.ceil(queue / workers))
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("frame queue full")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("state",)
+
+    def __init__(self):
+        self.state = None
+
+
+class FrameGate:
+    """Bounded, per-session-fair admission for a CPU-bound handler."""
+
+    def __init__(self, slots, max_queue, max_wait):
+        self.slots = max(1, int(slots))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queue = OrderedDict()  # session key -> waiting _Ticket
+        self._active = 0
+
+    def depth(self):
+        return len(self._queue)
+
+    def full(self):
+        """True when a frame from a new session would be rejected"""
+        return self._active >= self.slots and len(self._queue) >= self.max_queue
+
+    def load(self):
+        """(processing + waiting) / slots; above 1.0 frames are queueing"""
+        return (self._active + len(self._queue)) / self.slots
+
+    def retry_after(self, seconds_per_frame):
+        """Whole seconds until the current queue is expected to drain (at least 1)"""
+        backlog = (self._active + len(self._queue)) / self.slots
+        return max(1, math.ceil(backlog * seconds_per_frame))
+
+    def acquire(self, key, retry_after=1):
+        """Wait for a processing slot; returns ADMITTED, SUPERSEDED or EXPIRED, raises QueueFull"""
+        ticket = _Ticket()
+        with self._cond:
+            if not self._queue and self._active < self.slots:
+                self._active += 1
+                return ADMITTED
+            old = self._queue.get(key)
+            if old is not None:
+                # keep the session's place in line, hand it to the newer frame
+                old.state = SUPERSEDED
+                self._queue[key] = ticket
+                self._cond.notify_all()
+            elif len(self._queue) >= self.max_queue:
+                raise QueueFull(retry_after)
+            else:
+                self._queue[key] = ticket
+
+            deadline = time.monotonic() + self.max_wait
+            while ticket.state is None:
+                if self._active < self.slots and next(iter(self._queue)) == key:
+                    del self._queue[key]
+                    self._active += 1
+                    ticket.state = ADMITTED
+                    if self._queue and self._active < self.slots:
+                        # several slots freed at once: the new head may have
+                        # checked before we left the queue and gone back to sleep
+                        self._cond.notify_all()
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    del self._queue[key]
+                    ticket.state = EXPIRED
+                    self._cond.notify_all()
+                    break
+                self._cond.wait(remaining)
+            return ticket.state
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
@@ -0,0 +1,209 @@
+# bench/detect.py
+# Micro-benchmarks for the frame analysis hot path in next.py:
+# b64_to_image, every detector backend (YuNet / Caffe / Haar), the
+# detect_faces_stable fallback chain (full frame and ROI-tracked),
+# estimate_head_pose_simple and the batched PnP head_pose_from_landmarks,
+# across the frame resolutions and face counts in bench/fixtures.
+#
+# Reports ns/op, Python-heap allocations per op (tracemalloc) and the
+# process peak RSS after each case. Runs fully offline.
+#
+#   python bench/detect.py                      # all cases, table output
+#   python bench/detect.py --json out.json      # machine-readable
+#   python bench/detect.py --rebuild-fixtures   # regenerate bench/fixtures
+import argparse
+import base64
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+BENCH_DIR = Path(__file__).parent
+FIXTURE_DIR = BENCH_DIR / "fixtures"
+MANIFEST = FIXTURE_DIR / "manifest.json"
+
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+FACE_COUNTS = [0, 1, 2, 4]
+
+
+# ----------------- FIXTURES -----------------
+def build_fixtures(out_dir=FIXTURE_DIR):
+    """Write synthetic frames plus a manifest with ground-truth boxes and landmarks"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for (w, h) in RESOLUTIONS:
+        for n in FACE_COUNTS:
+            img = Image.linear_gradient("L").resize((w, h)).convert("RGB")
+            draw = ImageDraw.Draw(img)
+            faces = []
+            size = h // 3 if n <= 1 else min(h // 3, w // (n + 1))
+            for i in range(n):
+                cx = w * (i + 1) // (n + 1)
+                cy = h // 2
+                faces.append(_draw_face(draw, cx, cy, size))
+            img = img.filter(ImageFilter.GaussianBlur(1))
+            name = f"{w}x{h}_{n}faces.jpg"
+            img.save(out_dir / name, format="JPEG", quality=70)
+            manifest.append({"file": name, "width": w, "height": h, "faces": faces})
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+def _draw_face(draw, cx, cy, size):
+    half_w = size * 2 // 5
+    half_h = size // 2
+    draw.ellipse((cx - half_w, cy - half_h, cx + half_w, cy + half_h), fill=(214, 176, 150))
+    eye_y = cy - size // 8
+    eye_dx = size // 6
+    eye_r = max(2, size // 20)
+    for ex in (cx - eye_dx, cx + eye_dx):
+        draw.ellipse((ex - eye_r, eye_y - eye_r, ex + eye_r, eye_y + eye_r), fill=(30, 25, 25))
+    nose = (cx, cy + size // 20)
+    draw.polygon([(cx, cy - size // 20), (cx - size // 25, nose[1]), (cx + size // 25, nose[1])], fill=(180, 130, 110))
+    mouth_y = cy + size // 5
+    draw.line((cx - size // 8, mouth_y, cx + size // 8, mouth_y), fill=(120, 40, 40), width=max(1, size // 40))
+    # YuNet landmark order: right eye, left eye, nose tip, right mouth corner, left mouth corner
+    landmarks = [[cx - eye_dx, eye_y], [cx + eye_dx, eye_y], list(nose),
+                 [cx - size // 8, mouth_y], [cx + size // 8, mouth_y]]
+    return {"box": [cx - half_w, cy - half_h, 2 * half_w, 2 * half_h], "landmarks": landmarks}
+
+
+def load_fixtures():
+    if not MANIFEST.exists():
+        return build_fixtures()
+    return json.loads(MANIFEST.read_text())
+
+
+# ----------------- TIMING -----------------
+def bench(fn, min_time, max_iters):
+    """Time fn() and return ns/op, Python allocations/op and peak RSS"""
+    fn()  # warm-up (lazy model init, caches)
+
+    iters = 0
+    start = time.perf_counter_ns()
+    deadline = start + int(min_time * 1e9)
+    while True:
+        fn()
+        iters += 1
+        now = time.perf_counter_ns()
+        if now >= deadline or iters >= max_iters:
+            break
+    ns_per_op = (now - start) / iters
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    fn()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    alloc_blocks = sum(max(0, s.count_diff) for s in stats)
+
+    return {
+        "iterations": iters,
+        "ns_per_op": round(ns_per_op, 1),
+        "alloc_peak_bytes": peak,
+        "alloc_blocks": alloc_blocks,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# ----------------- CASES -----------------
+def load_backends(nx):
+    """Instantiate every detector backend available offline, independent of init_detectors()"""
+    import cv2
+    backends = {}
+    if nx.YUNET_PATH.exists():
+        backends["yunet"] = (nx.detect_with_yunet,
+                             cv2.FaceDetectorYN.create(str(nx.YUNET_PATH), "", (0, 0), 0.9, 0.3, 5000))
+    if nx.CAFFE_PROTO.exists() and nx.CAFFE_MODEL.exists():
+        backends["caffe"] = (nx.detect_with_caffe,
+                             cv2.dnn.readNetFromCaffe(str(nx.CAFFE_PROTO), str(nx.CAFFE_MODEL)))
+    backends["haar"] = (nx.detect_with_haar,
+                        cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml"))
+    return backends
+
+
+def run(args):
+    sys.path.insert(0, str(BENCH_DIR.parent))
+    # keep the warm-up thread from loading models and running inference alongside the timings
+    os.environ["WARMUP_ON_START"] = "0"
+    import next as nx
+
+    fixtures = load_fixtures()
+    backends = load_backends(nx)
+    selected = set(args.only.split(",")) if args.only else None
+    results = []
+
+    def record(op, fx, fn, **extra):
+        if selected and op.split(":")[0] not in selected:
+            return
+        r = bench(fn, args.min_time, args.max_iters)
+        r.update({"op": op, "fixture": fx["file"], "resolution": f"{fx['width']}x{fx['height']}",
+                  "faces": len(fx["faces"])})
+        r.update(extra)
+        results.append(r)
+        if not args.quiet:
+            print(f"{op:<26} {r['resolution']:>9} faces={r['faces']} "
+                  f"{r['ns_per_op']:>14,.0f} ns/op  {r['alloc_peak_bytes']:>10,} B  "
+                  f"rss={r['peak_rss_kb']:,} KB" + (f"  detected={extra['detected']}" if "detected" in extra else ""))
+
+    for fx in fixtures:
+        raw = (FIXTURE_DIR / fx["file"]).read_bytes()
+        data_url = "data:image/jpeg;base64," + base64.b64encode(raw).decode("ascii")
+        frame = nx.b64_to_image(data_url)
+
+        record("b64_to_image", fx, lambda: nx.b64_to_image(data_url))
+
+        for name, (detect, model) in backends.items():
+            detected = len(detect(model, frame))
+            record(f"detect:{name}", fx, lambda d=detect, m=model: d(m, frame), detected=detected)
+
+        detected = len(nx.detect_faces_stable(frame))
+        record("detect_faces_stable", fx, lambda: nx.detect_faces_stable(frame), detected=detected)
+
+        if len(fx["faces"]) == 1:
+            # steady state of a tracked session: crops, plus a full frame every ROI_FULL_EVERY
+            nx.roi_forget("bench")
+            detected = len(nx.detect_faces_stable(frame, roi_key="bench"))
+            record("detect_faces_stable:roi", fx, lambda: nx.detect_faces_stable(frame, roi_key="bench"),
+                   detected=detected)
+
+        if fx["faces"]:
+            faces = [(tuple(f["box"]), f["landmarks"]) for f in fx["faces"]]
+            record("estimate_head_pose_simple", fx,
+                   lambda: [nx.estimate_head_pose_simple(lm, box) for box, lm in faces])
+            landmarks = [f["landmarks"] for f in fx["faces"]]
+            record("head_pose_from_landmarks", fx, lambda: nx.head_pose_from_landmarks(landmarks))
+
+    return {"backends": sorted(backends), "min_time_s": args.min_time, "results": results}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for face detection hot paths.")
+    ap.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per case")
+    ap.add_argument("--max-iters", type=int, default=100000)
+    ap.add_argument("--only", help="comma-separated ops, e.g. b64_to_image,detect")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--quiet", action="store_true")
+    ap.add_argument("--rebuild-fixtures", action="store_true")
+    args = ap.parse_args()
+
+    if args.rebuild_fixtures:
+        build_fixtures()
+        print(f"Fixtures written to {FIXTURE_DIR}")
+        return
+
+    out = run(args)
+    if args.json:
+        Path(args.json).write_text(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# bench/loadtest.py
+# Load generator that drives N simulated examinees through the real exam flow:
+#   /api/login -> /api/verify -> /api/session/start
+#   -> /analyze_frame every 300 ms + /voice_event every 200 ms
+#   -> /api/session/end
+# and writes per-endpoint throughput and latency percentiles as JSON.
+#
+# Example:
+#   python bench/loadtest.py --users 50 --duration 60 --register --photo face.jpg --out results.json
+import argparse
+import base64
+import http.client
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlparse
+
+from PIL import Image, ImageDraw
+
+FRAME_ENDPOINT = "/analyze_frame"
+VOICE_ENDPOINT = "/voice_event"
+
+
+# ----------------- FRAMES -----------------
+def synthetic_frames(count, width, height, seed):
+    """Generate JPEG data URLs with a face-like blob on a noisy background"""
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        img = Image.effect_noise((width, height), 24).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        cx = width // 2 + rng.randint(-width // 10, width // 10)
+        cy = height // 2 + rng.randint(-height // 10, height // 10)
+        r = min(width, height) // 5
+        draw.ellipse((cx - r, cy - int(r * 1.3), cx + r, cy + int(r * 1.3)), fill=(205, 170, 140))
+        for ex in (cx - r // 2, cx + r // 2):
+            draw.ellipse((ex - r // 8, cy - r // 3 - r // 10, ex + r // 8, cy - r // 3 + r // 10), fill=(40, 30, 30))
+        draw.rectangle((cx - r // 3, cy + r // 2, cx + r // 3, cy + r // 2 + r // 10), fill=(120, 50, 50))
+        frames.append(_to_data_url(img))
+    return frames
+
+
+def recorded_frames(frames_dir):
+    """Load recorded frames (*.jpg / *.png) as JPEG data URLs"""
+    paths = sorted(p for p in Path(frames_dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not paths:
+        raise SystemExit(f"No frames found in {frames_dir}")
+    return [_to_data_url(Image.open(p).convert("RGB")) for p in paths]
+
+
+def _to_data_url(img):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=60)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+# ----------------- RECORDING -----------------
+class Recorder:
+    """Thread-safe collection of (endpoint, status, latency) samples"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.statuses = {}
+
+    def add(self, endpoint, status, seconds):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            codes = self.statuses.setdefault(endpoint, {})
+            codes[str(status)] = codes.get(str(status), 0) + 1
+
+    def summary(self, elapsed):
+        out = {}
+        with self.lock:
+            for endpoint, lat in sorted(self.samples.items()):
+                lat = sorted(lat)
+                errors = sum(n for code, n in self.statuses[endpoint].items()
+                             if code == "error" or int(code) >= 500)
+                out[endpoint] = {
+                    "requests": len(lat),
+                    "throughput_rps": round(len(lat) / elapsed, 3) if elapsed > 0 else 0.0,
+                    "errors": errors,
+                    "status_codes": dict(self.statuses[endpoint]),
+                    "latency_ms": {
+                        "min": round(lat[0] * 1000, 3),
+                        "p50": round(percentile(lat, 50) * 1000, 3),
+                        "p95": round(percentile(lat, 95) * 1000, 3),
+                        "p99": round(percentile(lat, 99) * 1000, 3),
+                        "max": round(lat[-1] * 1000, 3),
+                        "mean": round(sum(lat) / len(lat) * 1000, 3),
+                    },
+                }
+        return out
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+# ----------------- HTTP CLIENT -----------------
+class Client:
+    """Keep-alive HTTP client; one instance per thread"""
+
+    def __init__(self, base_url, recorder, timeout):
+        u = urlparse(base_url)
+        self.host = u.hostname
+        self.port = u.port or (443 if u.scheme == "https" else 80)
+        self.https = u.scheme == "https"
+        self.recorder = recorder
+        self.timeout = timeout
+        self.token = None
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, body=None, headers=None, label=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = "Bearer " + self.token
+        label = label or path
+        t0 = time.perf_counter()
+        try:
+            if self.conn is None:
+                self._connect()
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            raw = resp.read()
+            self.recorder.add(label, resp.status, time.perf_counter() - t0)
+        except (OSError, http.client.HTTPException):
+            self.recorder.add(label, "error", time.perf_counter() - t0)
+            self.close()
+            return None, {}
+        try:
+            return resp.status, json.loads(raw or b"{}")
+        except ValueError:
+            return resp.status, {}
+
+    def post_json(self, path, payload, label=None, headers=None):
+        return self.request("POST", path, json.dumps(payload).encode("utf-8"),
+                            {"Content-Type": "application/json", **(headers or {})}, label)
+
+    def post_multipart(self, path, fields, files, label=None):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, (filename, data) in files.items():
+            parts.append((f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                          f'Content-Type: image/jpeg\r\n\r\n').encode() + data + b"\r\n")
+        parts.append(f"--{boundary}--\r\n".encode())
+        return self.request("POST", path, b"".join(parts),
+                            {"Content-Type": f"multipart/form-data; boundary={boundary}"}, label)
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+
+
+# ----------------- EXAMINEE -----------------
+class Examinee:
+    def __init__(self, idx, args, frames, photo, recorder, stop_at):
+        self.idx = idx
+        self.args = args
+        self.frames = frames
+        self.photo = photo
+        self.recorder = recorder
+        self.stop_at = stop_at
+        self.email = args.email_template.format(i=idx)
+        self.session_id = None
+        self.proctor_headers = {}
+        self.failed = None
+
+    def run(self):
+        client = Client(self.args.base_url, self.recorder, self.args.timeout)
+        try:
+            if not self.login(client):
+                return
+            if self.photo is not None:
+                status, _ = client.post_multipart("/api/verify", {}, {"photo": ("verify.jpg", self.photo)})
+                if status != 200:
+                    self.failed = f"verify:{status}"
+                    return
+            status, data = client.post_json("/api/session/start", {"exam_id": self.args.exam_id})
+            if status != 200 or not data.get("success"):
+                self.failed = f"session_start:{status}"
+                return
+            self.session_id = data["session_id"]
+            self.proctor_headers = {"X-Proctor-Token": data.get("proctor_token", "")}
+
+            voice = threading.Thread(target=self.voice_loop, daemon=True)
+            voice.start()
+            self.frame_loop(client)
+            voice.join()
+
+            client.post_json("/api/session/end", {"session_id": self.session_id, "answers": {}})
+        finally:
+            client.close()
+
+    def login(self, client):
+        creds = {"email": self.email, "password": self.args.password}
+        status, data = client.post_json("/api/login", creds)
+        if status == 401 and self.args.register and self.photo is not None:
+            fields = {"fullName": f"Load Test {self.idx}", "studentId": f"LT{self.idx:05d}",
+                      "email": self.email, "role": "student", "password": self.args.password}
+            client.post_multipart("/api/register", fields, {"photo": ("photo.jpg", self.photo)})
+            status, data = client.post_json("/api/login", creds)
+        if status != 200 or not data.get("token"):
+            self.failed = f"login:{status}"
+            return False
+        client.token = data["token"]
+        return True
+
+    def _payload(self, extra):
+        payload = {"session_id": self.session_id}
+        payload.update(extra)
+        return payload
+
+    def frame_loop(self, client):
+        rng = random.Random(self.args.seed + self.idx)
+        interval = self.args.frame_interval
+        next_due = time.perf_counter() + rng.random() * interval
+        while time.perf_counter() < self.stop_at:
+            _sleep_until(next_due)
+            frame = self.frames[rng.randrange(len(self.frames))]
+            client.post_json(FRAME_ENDPOINT, self._payload({"image": frame}), headers=self.proctor_headers)
+            # like the browser: the next frame is scheduled after the response arrives
+            next_due = time.perf_counter() + interval
+
+    def voice_loop(self):
+        client = Client(self.args.base_url, self.recorder, self.args.timeout)
+        rng = random.Random(self.args.seed * 7 + self.idx)
+        next_due = time.perf_counter() + rng.random() * self.args.voice_interval
+        try:
+            while time.perf_counter() < self.stop_at:
+                _sleep_until(next_due)
+                rms = rng.random() * 0.12
+                event = "periodic" if rng.random() > 0.05 else "voice_start"
+                client.post_json(VOICE_ENDPOINT, self._payload({"rms": rms, "event": event}),
+                                 headers=self.proctor_headers)
+                next_due += self.args.voice_interval
+        finally:
+            client.close()
+
+
+def _sleep_until(deadline):
+    delay = deadline - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def fetch_db_stats(base_url, timeout):
+    status, data = Client(base_url, Recorder(), timeout).request("GET", "/health")
+    return (data or {}).get("db", {}) if status == 200 else {}
+
+
+def diff_stats(before, after):
+    out = {}
+    for key, value in after.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[key] = round(value - before.get(key, 0), 6)
+        else:
+            out[key] = value
+    return out
+
+
+# ----------------- MAIN -----------------
+def main():
+    ap = argparse.ArgumentParser(description="Load test the proctoring server.")
+    ap.add_argument("--base-url", default="http://127.0.0.1:5000")
+    ap.add_argument("--users", type=int, default=10, help="number of concurrent examinees")
+    ap.add_argument("--duration", type=float, default=30.0, help="proctoring phase length in seconds")
+    ap.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which examinees start")
+    ap.add_argument("--exam-id", type=int, default=1)
+    ap.add_argument("--email-template", default="loadtest{i}@example.com")
+    ap.add_argument("--password", default="loadtest-password")
+    ap.add_argument("--register", action="store_true", help="register missing users (needs --photo)")
+    ap.add_argument("--photo", help="face photo used for /api/register and /api/verify")
+    ap.add_argument("--frames-dir", help="directory of recorded frames; synthetic frames if omitted")
+    ap.add_argument("--frame-size", default="640x480", help="synthetic frame size WxH")
+    ap.add_argument("--frame-interval", type=float, default=0.3)
+    ap.add_argument("--voice-interval", type=float, default=0.2)
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--out", help="write JSON results to this file (stdout otherwise)")
+    args = ap.parse_args()
+
+    if args.frames_dir:
+        frames = recorded_frames(args.frames_dir)
+    else:
+        w, h = (int(v) for v in args.frame_size.lower().split("x"))
+        frames = synthetic_frames(8, w, h, args.seed)
+    photo = Path(args.photo).read_bytes() if args.photo else None
+
+    recorder = Recorder()
+    db_before = fetch_db_stats(args.base_url, args.timeout)
+
+    t0 = time.perf_counter()
+    stop_at = t0 + args.ramp_up + args.duration
+    examinees = [Examinee(i, args, frames, photo, recorder, stop_at) for i in range(args.users)]
+    threads = []
+    for i, ex in enumerate(examinees):
+        th = threading.Thread(target=ex.run, daemon=True)
+        threads.append(th)
+        _sleep_until(t0 + args.ramp_up * i / max(1, args.users))
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t0
+
+    db_after = fetch_db_stats(args.base_url, args.timeout)
+    failures = {}
+    for ex in examinees:
+        if ex.failed:
+            failures[ex.failed] = failures.get(ex.failed, 0) + 1
+
+    endpoints = recorder.summary(elapsed)
+    results = {
+        "config": {
+            "base_url": args.base_url, "users": args.users, "duration_s": args.duration,
+            "ramp_up_s": args.ramp_up, "exam_id": args.exam_id,
+            "frame_interval_s": args.frame_interval, "voice_interval_s": args.voice_interval,
+            "frames": "recorded" if args.frames_dir else f"synthetic:{args.frame_size}",
+            "verify": photo is not None, "seed": args.seed,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "examinees_completed": sum(1 for ex in examinees if ex.session_id and not ex.failed),
+        "examinee_failures": failures,
+        "total_requests": sum(e["requests"] for e in endpoints.values()),
+        "throughput_rps": round(sum(e["requests"] for e in endpoints.values()) / elapsed, 3),
+        "endpoints": endpoints,
+        "db_contention": diff_stats(db_before, db_after),
+    }
+    text = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
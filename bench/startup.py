@@ -0,0 +1,73 @@
+# bench/startup.py
+# Measures worker start-up cost in fresh interpreters:
+#   import_s        - `import next` (DB init/seed, Flask app, lazy models untouched)
+#   preload_s       - next.preload_models() (YuNet + face_recognition/dlib)
+#   first_detect_s  - first detect_faces_stable() call after import (lazy init path)
+#
+#   python bench/startup.py --runs 5 --json startup.json
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).parent
+ROOT = BENCH_DIR.parent
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import next as nx
+t1 = time.perf_counter()
+out = {"import_s": t1 - t0}
+if sys.argv[1] == "preload":
+    nx.preload_models()
+    out["preload_s"] = time.perf_counter() - t1
+else:
+    import numpy as np
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    nx.detect_faces_stable(frame)
+    out["first_detect_s"] = time.perf_counter() - t1
+print("STARTUP_RESULT " + json.dumps(out))
+"""
+
+
+def probe(mode):
+    # no background warm-up: the probes time the lazy paths on their own
+    env = dict(os.environ, WARMUP_ON_START="0")
+    proc = subprocess.run([sys.executable, "-c", PROBE, mode], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=False)
+    for line in proc.stdout.splitlines():
+        if line.startswith("STARTUP_RESULT "):
+            return json.loads(line[len("STARTUP_RESULT "):])
+    raise SystemExit(f"probe failed ({mode}):\n{proc.stderr[-2000:]}")
+
+
+def summarize(values):
+    return {"min": round(min(values), 4), "median": round(statistics.median(values), 4),
+            "max": round(max(values), 4), "runs": len(values)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark worker start-up time.")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    samples = {}
+    for _ in range(args.runs):
+        for mode in ("lazy", "preload"):
+            for key, value in probe(mode).items():
+                samples.setdefault(key, []).append(value)
+
+    results = {key: summarize(values) for key, values in sorted(samples.items())}
+    text = json.dumps(results, indent=2)
+    if args.json:
+        Path(args.json).write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# cache.py
+# Small thread-safe LRU cache with per-entry expiry, used to keep hot
+# lookups (verified tokens, user profiles) off the crypto and database paths,
+# and as a bounded store of fixed-window counters (login throttling).
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU; entries expire after `ttl` seconds or at an explicit deadline."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, expires_at=None):
+        """Store value; expires_at (time.monotonic() based) can only shorten the default ttl"""
+        deadline = time.monotonic() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._data[key] = (deadline, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def incr(self, key, amount=1):
+        """Counter that expires ttl seconds after its first increment; returns (count, seconds_left)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                entry = (now + self.ttl, 0)
+            entry = (entry[0], entry[1] + amount)
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return entry[1], entry[0] - now
+
+    def peek(self, key):
+        """(value, seconds_left) without touching LRU order or hit counters; (None, 0) if absent"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] <= now:
+            return None, 0.0
+        return entry[1], entry[0] - now
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,181 @@
+# evidence.py
+# Append-only store for the frames that caused violations. Image bytes are
+# appended to one segment file per UTC day (segments/YYYYMMDD.seg) and a
+# fixed-width record per frame is appended to index.bin, linking the
+# violation_logs row to (segment, offset, length). Both files are opened
+# O_APPEND, so several worker processes can write without coordinating.
+# Reads use read-only memory maps. Index records are grouped by session as they
+# appear (each new part of index.bin is read once), so looking up a session
+# costs its own records, not the whole index.
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+
+INDEX_DTYPE = np.dtype([
+    ("violation_id", "<i8"),
+    ("session_id", "<i8"),
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("day", "<u4"),        # segment name, YYYYMMDD
+    ("timestamp", "<f8"),  # unix seconds
+])
+
+
+class EvidenceStore:
+    """Segment files + offset index; per-session byte budget and minimum capture interval."""
+
+    def __init__(self, root, session_budget, min_interval=0.0):
+        self.root = str(root)
+        self.session_budget = session_budget
+        self.min_interval = min_interval
+        os.makedirs(os.path.join(self.root, "segments"), exist_ok=True)
+        self._index_path = os.path.join(self.root, "index.bin")
+        self._lock = threading.Lock()
+        self._fds = {}        # (pid, day) -> append fd of the segment
+        self._index_fd = None
+        self._index_pid = None
+        self._maps = {}       # path -> mmap (remapped when the file has grown)
+        self._map_lock = threading.Lock()    # taken after _lock when both are held
+        self._index_lock = threading.Lock()  # likewise
+        self._indexed = 0     # bytes of index.bin grouped into _by_session
+        self._by_session = {}  # session_id -> [record arrays]
+        self._used = {}       # session_id -> bytes stored (seeded from the index)
+        self._last = {}       # (session_id, kind) -> time of the last capture
+
+    # ---- writing ----
+    def admit(self, session_id, kind, size):
+        """Reserve budget for a frame; returns None if it may be stored, else the reason it may not"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get((session_id, kind))
+            if last is not None and now - last < self.min_interval:
+                return "interval"
+            used = self._used.get(session_id)
+            if used is None:
+                used = int(self.session_index(session_id)["length"].sum())
+            if used + size > self.session_budget:
+                self._used[session_id] = used
+                return "budget"
+            self._used[session_id] = used + size
+            self._last[(session_id, kind)] = now
+        return None
+
+    def append(self, session_id, violation_id, data):
+        """Store one frame for a violation; returns its index record as a dict"""
+        ts = time.time()
+        day = int(time.strftime("%Y%m%d", time.gmtime(ts)))
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        with self._lock:
+            fd = self._segment_fd(day)
+            os.write(fd, data)
+            offset = os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+            record[0] = (violation_id, session_id, offset, len(data), day, ts)
+            os.write(self._index(), record.tobytes())
+        return {"violation_id": violation_id, "day": day, "offset": offset, "length": len(data)}
+
+    def forget(self, session_id):
+        """Drop in-memory sampling state of a finished session (stored evidence is kept)"""
+        with self._lock:
+            self._used.pop(session_id, None)
+            for key in [k for k in self._last if k[0] == session_id]:
+                del self._last[key]
+
+    def _segment_fd(self, day):
+        key = (os.getpid(), day)
+        fd = self._fds.get(key)
+        if fd is None:
+            for old in list(self._fds):
+                os.close(self._fds.pop(old))
+            path = self._segment_path(day)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+            self._fds[key] = fd
+        return fd
+
+    def _index(self):
+        if self._index_pid != os.getpid():
+            self._index_fd = os.open(self._index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+            self._index_pid = os.getpid()
+        return self._index_fd
+
+    def _segment_path(self, day):
+        return os.path.join(self.root, "segments", f"{day}.seg")
+
+    # ---- reading ----
+    def _map(self, path, need):
+        """Read-only mmap of path covering at least `need` bytes, or None"""
+        mm = self._maps.get(path)
+        if mm is not None and len(mm) >= need:
+            return mm
+        with self._map_lock:
+            mm = self._maps.get(path)
+            if mm is None or len(mm) < need:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    return None
+                if size == 0 or size < need:
+                    return None
+                with open(path, "rb") as f:
+                    # the previous map is dropped, not closed: callers may still hold views of it
+                    mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                self._maps[path] = mm
+        return mm
+
+    def index(self):
+        """All index records as a structured array viewing the mapped index (no copy)"""
+        try:
+            size = os.path.getsize(self._index_path)
+        except OSError:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        size -= size % INDEX_DTYPE.itemsize  # ignore a record still being written
+        mm = self._map(self._index_path, size) if size else None
+        if mm is None:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.frombuffer(mm, dtype=INDEX_DTYPE, count=size // INDEX_DTYPE.itemsize)
+
+    def _group_new_records(self):
+        """Add index records written since the last call to _by_session"""
+        idx = self.index()
+        done = self._indexed // INDEX_DTYPE.itemsize
+        if len(idx) < done:  # index.bin was replaced: start over
+            self._by_session.clear()
+            done = 0
+        if len(idx) == done:
+            return
+        new = idx[done:]
+        new = new[np.argsort(new["session_id"], kind="stable")]  # a copy, in write order per session
+        sessions, starts = np.unique(new["session_id"], return_index=True)
+        for session_id, chunk in zip(sessions.tolist(), np.split(new, starts[1:])):
+            self._by_session.setdefault(session_id, []).append(chunk)
+        self._indexed = len(idx) * INDEX_DTYPE.itemsize
+
+    def session_index(self, session_id):
+        """Index records of one session, oldest first"""
+        with self._index_lock:
+            self._group_new_records()
+            chunks = self._by_session.get(session_id)
+            if not chunks:
+                return np.zeros(0, dtype=INDEX_DTYPE)
+            if len(chunks) > 1:
+                chunks[:] = [np.concatenate(chunks)]
+            return chunks[0]
+
+    def read(self, session_id, violation_id):
+        """memoryview of the stored frame of a violation, or None"""
+        records = self.session_index(session_id)
+        records = records[records["violation_id"] == violation_id]
+        if not len(records):
+            return None
+        rec = records[-1]
+        offset, length = int(rec["offset"]), int(rec["length"])
+        mm = self._map(self._segment_path(int(rec["day"])), offset + length)
+        if mm is None:
+            return None
+        return memoryview(mm)[offset:offset + length]
+
+    def stats(self):
+        idx = self.index()
+        return {"frames": int(len(idx)), "bytes": int(idx["length"].sum()), "sessions": len(self._used)}
@@ -0,0 +1,150 @@
+# grading.py
+# Answer storage and scoring. A session's answers are packed as one signed
+# byte per question in exam question order (UNANSWERED = -1), so a
+# submission costs a few dozen bytes and a whole exam's submissions load as
+# one (submissions x questions) int8 matrix that is scored in a single
+# vectorised comparison against the answer key.
+#
+# Regrade after fixing exam_questions.correct_answer:
+#   python grading.py --exam 3 [--dry-run]
+#   python grading.py --all
+import argparse
+import json
+import time
+
+import numpy as np
+
+UNANSWERED = -1
+
+
+def answer_positions(answers, question_ids, allow_clear=False):
+    """{question_id: option index} -> {position: stored value}; unknown questions and bad options are skipped
+
+    With allow_clear, an option of None clears the answer (UNANSWERED).
+    """
+    position = {qid: i for i, qid in enumerate(question_ids)}
+    out = {}
+    for qid, choice in (answers or {}).items():
+        try:
+            i = position.get(int(qid))
+        except (TypeError, ValueError):
+            continue
+        if i is None:
+            continue
+        if choice is None and allow_clear:
+            out[i] = UNANSWERED
+        # numbers equal to an option index count (1.0 == 1), as in the original scoring
+        elif isinstance(choice, (int, float)) and not isinstance(choice, bool) \
+                and 0 <= choice < 127 and float(choice).is_integer():
+            out[i] = int(choice)
+    return out
+
+
+def apply_delta(blob, width, delta):
+    """Packed answers of `width` questions: blob (or all unanswered) with delta {position: value} applied"""
+    packed = np.full(width, UNANSWERED, dtype=np.int8)
+    if blob:
+        old = decode_answers(blob)[:width]
+        packed[:len(old)] = old
+    for i, value in delta.items():
+        if i < width:
+            packed[i] = value
+    return packed.tobytes()
+
+
+def apply_stamped_delta(blob, stamps, width, delta):
+    """apply_delta for delta {position: (value, stamp)}: a stored answer with a later stamp is kept.
+
+    stamps packs one float64 per position (0 = unknown, so any change replaces it);
+    returns (packed answers, packed stamps).
+    """
+    packed = np.frombuffer(apply_delta(blob, width, {}), dtype=np.int8).copy()
+    when = np.zeros(width, dtype="<f8")
+    if stamps:
+        old = np.frombuffer(stamps, dtype="<f8")[:width]
+        when[:len(old)] = old
+    for i, (value, stamp) in delta.items():
+        if i < width and stamp >= when[i]:
+            packed[i] = value
+            when[i] = stamp
+    return packed.tobytes(), when.tobytes()
+
+
+def encode_answers(answers, question_ids):
+    """Pack {question_id: option index} into bytes laid out like question_ids"""
+    return apply_delta(None, len(question_ids), answer_positions(answers, question_ids))
+
+
+def decode_answers(blob):
+    return np.frombuffer(blob, dtype=np.int8)
+
+
+def answers_matrix(blobs, width):
+    """Stack packed answers into an (n, width) int8 matrix; shorter rows are padded as unanswered"""
+    blobs = list(blobs)
+    if blobs and all(len(b) == width for b in blobs):
+        return np.frombuffer(b"".join(blobs), dtype=np.int8).reshape(len(blobs), width)
+    matrix = np.full((len(blobs), width), UNANSWERED, dtype=np.int8)
+    for row, blob in zip(matrix, blobs):
+        packed = decode_answers(blob)[:width]
+        row[:len(packed)] = packed
+    return matrix
+
+
+def score(key, matrix):
+    """Correct answers per row of matrix against key (int8 array of correct options)"""
+    return np.count_nonzero(matrix == key, axis=1)
+
+
+def regrade_exam(store, exam_id, batch_size=5000, dry_run=False):
+    """Rescore every stored submission of an exam against its current key; returns a summary"""
+    t0 = time.perf_counter()
+    key = np.array([correct for _, correct in store.get_ordered_answer_key(exam_id)], dtype=np.int8)
+    submissions = store.list_exam_submissions(exam_id)
+    t_load = time.perf_counter()
+
+    summary = {"exam_id": exam_id, "questions": int(len(key)), "submissions": len(submissions),
+               "without_answers": store.count_exam_reports(exam_id) - len(submissions), "changed": 0}
+    if submissions:
+        report_ids = np.array([s[0] for s in submissions], dtype=np.int64)
+        old_total = np.array([s[1] for s in submissions], dtype=np.int64)
+        old_correct = np.array([s[2] for s in submissions], dtype=np.int64)
+        correct = score(key, answers_matrix((s[3] for s in submissions), len(key)))
+        total = len(key)
+        percentage = correct * 100.0 / total if total else np.zeros(len(correct))
+        changed = np.flatnonzero((correct != old_correct) | (old_total != total))
+        summary["changed"] = int(len(changed))
+        summary["mean_before"] = round(float(old_correct.mean()), 3)
+        summary["mean_after"] = round(float(correct.mean()), 3)
+        if not dry_run:
+            rows = [(total, int(correct[i]), float(correct[i]), float(percentage[i]), int(report_ids[i]))
+                    for i in changed]
+            for start in range(0, len(rows), batch_size):
+                store.update_report_scores(rows[start:start + batch_size])
+    t_end = time.perf_counter()
+    summary["load_s"] = round(t_load - t0, 3)
+    summary["total_s"] = round(t_end - t0, 3)
+    summary["dry_run"] = dry_run
+    return summary
+
+
+def main():
+    from pathlib import Path
+    from storage import create_store
+
+    ap = argparse.ArgumentParser(description="Regrade stored submissions against the current answer keys")
+    group = ap.add_mutually_exclusive_group(required=True)
+    group.add_argument("--exam", type=int, action="append", help="exam_id to regrade (repeatable)")
+    group.add_argument("--all", action="store_true", help="regrade every active exam")
+    ap.add_argument("--batch", type=int, default=5000, help="report updates per transaction")
+    ap.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = ap.parse_args()
+
+    store = create_store(Path(__file__).parent / "users.db")
+    exam_ids = [e["id"] for e in store.list_exams()] if args.all else args.exam
+    for exam_id in exam_ids:
+        print(json.dumps(regrade_exam(store, exam_id, args.batch, args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
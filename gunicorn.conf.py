@@ -0,0 +1,57 @@
+# gunicorn.conf.py
+# Production entry point:  gunicorn -c gunicorn.conf.py next:app
+import os
+import sys
+
+from admission import worker_limits
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+os.environ["WEB_CONCURRENCY"] = str(workers)  # next.py splits the node's frame budget by it
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+
+# Frames admitted or waiting in the worker's FrameGate each hold a thread, so
+# give it that many on top of GUNICORN_THREADS: the queue can actually fill
+# and the next frame reaches the gate (and gets its 429) instead of waiting
+# unseen in gunicorn's accept backlog.
+threads += sum(worker_limits())
+
+# Every live feed (Server-Sent Events) served by a worker holds a thread for as
+# long as it is watched. next.py caps them at LIVE_FEED_MAX_SUBSCRIBERS per
+# worker; that many threads are added so watchers can never take the threads
+# serving examinees. Set it to 0 when `python next.py live-feed` serves them.
+if os.environ.get("LIVE_FEED_ENABLED", "1") == "1":
+    threads += int(os.environ.get("LIVE_FEED_MAX_SUBSCRIBERS", "16"))
+
+# Import next.py once in the master before forking. Together with
+# PRELOAD_MODELS=1 this also loads YuNet and dlib there, so every worker
+# shares the model pages copy-on-write; only the short warm-up inference
+# runs per worker (post_fork).
+preload_app = os.environ.get("PRELOAD_APP", "1") == "1"
+
+# Warm-up threads must not be started in the master (threads do not survive
+# fork); each worker starts its own in post_fork instead.
+WARMUP = os.environ.get("WARMUP_ON_START", "1") == "1"
+os.environ["WARMUP_ON_START"] = "0"
+
+
+def pre_fork(server, worker):
+    # The preloaded app may have opened database connections in the master
+    # (schema setup, seeding); close them so no worker inherits the sockets.
+    # Each worker opens its own pool on first use.
+    app_module = sys.modules.get("next")
+    close = getattr(getattr(app_module, "store", None), "close", None)
+    if close is not None:
+        close()
+
+
+def post_fork(server, worker):
+    # OpenCV's internal thread pool is not fork-safe; run inference single-threaded
+    # per worker (parallelism comes from the workers themselves).
+    import cv2
+    cv2.setNumThreads(1)
+    if WARMUP or os.environ.get("PRELOAD_MODELS", "0") == "1":
+        # with PRELOAD_MODELS the master only loaded the models; /ready waits for this
+        import next
+        next.start_warmup()
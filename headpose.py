@@ -0,0 +1,71 @@
+# headpose.py
+# Head pose (yaw / pitch / roll) from the five YuNet landmarks, solved as a
+# weak-perspective PnP problem against a mean 3D face. Everything is batched:
+# landmarks of shape (N, 5, 2) -- all faces of a frame, or of many frames --
+# are solved with a handful of NumPy calls and no per-face Python loop.
+#
+# Angle conventions (degrees, image seen as on screen):
+#   yaw   > 0  nose turned towards image right
+#   pitch > 0  nose turned down
+#   roll  > 0  head tilted clockwise
+import numpy as np
+
+# Mean face in YuNet landmark order: right eye, left eye, nose tip,
+# right mouth corner, left mouth corner. x right, y down, z away from the
+# camera (mm, origin between the eyes).
+MODEL_POINTS = np.array([
+    [-31.0, 0.0, 0.0],
+    [31.0, 0.0, 0.0],
+    [0.0, 36.0, -28.0],
+    [-24.0, 66.0, -6.0],
+    [24.0, 66.0, -6.0],
+])
+
+_MODEL_CENTERED = MODEL_POINTS - MODEL_POINTS.mean(axis=0)
+# (3, 5) least-squares solve for the affine camera: M = P_c @ _MODEL_PINV
+_MODEL_PINV = np.linalg.pinv(_MODEL_CENTERED.T)
+
+
+def solve_pose(landmarks):
+    """Batched weak-perspective PnP; landmarks (N, 5, 2) or (5, 2) -> (yaw, pitch, roll, scale) arrays of shape (N,)"""
+    pts = np.asarray(landmarks, dtype=np.float64)
+    if pts.ndim == 2:
+        pts = pts[None]
+    centered = pts - pts.mean(axis=1, keepdims=True)          # (N, 5, 2)
+    affine = np.swapaxes(centered, 1, 2) @ _MODEL_PINV         # (N, 2, 3)
+
+    # scale = mean row norm; rows made orthonormal symmetrically (sum/difference
+    # of the unit rows are always orthogonal), third row is their cross product
+    a, b = affine[:, 0], affine[:, 1]
+    na = np.sqrt((a * a).sum(axis=1, keepdims=True))
+    nb = np.sqrt((b * b).sum(axis=1, keepdims=True))
+    a, b = a / na, b / nb
+    c, d = a + b, a - b
+    c /= np.sqrt((c * c).sum(axis=1, keepdims=True))
+    d /= np.sqrt((d * d).sum(axis=1, keepdims=True))
+    r1 = (c + d) * np.sqrt(0.5)
+    r2 = (c - d) * np.sqrt(0.5)
+    r3 = np.stack([r1[:, 1] * r2[:, 2] - r1[:, 2] * r2[:, 1],
+                   r1[:, 2] * r2[:, 0] - r1[:, 0] * r2[:, 2],
+                   r1[:, 0] * r2[:, 1] - r1[:, 1] * r2[:, 0]], axis=1)
+    scale = (na[:, 0] + nb[:, 0]) / 2
+
+    # R = Rz(roll) @ Ry(yaw_b) @ Rx(pitch_a); model z points away from the camera
+    yaw_b = np.arcsin(np.clip(-r3[:, 0], -1.0, 1.0))
+    pitch_a = np.arctan2(r3[:, 1], r3[:, 2])
+    roll = np.arctan2(r2[:, 0], r1[:, 0])
+    return np.degrees(-yaw_b), np.degrees(pitch_a), np.degrees(roll), scale
+
+
+def classify(yaw, pitch, yaw_threshold, pitch_threshold):
+    """Direction labels per face: (horizontal Left/Right/Center, vertical Up/Down/Center, severity)
+
+    Horizontal labels follow estimate_head_pose_simple: nose towards image right is "Left".
+    Severity is the larger angle relative to its threshold (>= 1 means turned away).
+    """
+    yaw = np.asarray(yaw)
+    pitch = np.asarray(pitch)
+    horizontal = np.where(yaw > yaw_threshold, "Left", np.where(yaw < -yaw_threshold, "Right", "Center"))
+    vertical = np.where(pitch > pitch_threshold, "Down", np.where(pitch < -pitch_threshold, "Up", "Center"))
+    severity = np.maximum(np.abs(yaw) / yaw_threshold, np.abs(pitch) / pitch_threshold)
+    return horizontal, vertical, severity
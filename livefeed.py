@@ -0,0 +1,496 @@
+# livefeed.py
+# Live proctoring feed for exam staff, as Server-Sent Events. Request handlers
+# publish without blocking into pending state: the latest status of each
+# session (a newer status replaces one not yet sent) and a bounded queue of
+# violations and session events. A single publisher thread drains it every
+# `interval` seconds, skips statuses that did not change, encodes each exam's
+# batch once and hands the same bytes to every subscriber of that exam.
+# With a shared channel (sessionstate.py) the publisher first passes what this
+# process collected to the channel and then fans out what every process put
+# there, so each feed covers all sessions of the node, whichever worker
+# serves them.
+# Subscriber buffers are bounded: one that falls behind loses its backlog and
+# is sent a fresh snapshot, so a slow proctor never holds up the others.
+#
+# LiveServer serves the streams from one thread with non-blocking sockets: an
+# open stream costs a socket and its buffers, not a request thread, so one
+# process holds hundreds of watchers.
+import json
+import os
+import re
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from cache import TTLCache
+
+RESYNC = object()
+_MISSING = object()
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+class Subscriber:
+    """One watching connection: a bounded buffer of encoded chunks."""
+
+    def __init__(self, exam_id, max_chunks, wake=None):
+        self.exam_id = exam_id
+        self.max_chunks = max_chunks
+        self.wake = wake  # called after each delivery, e.g. to wake a LiveServer
+        self._chunks = deque()
+        self._cond = threading.Condition()
+        self._resync = False
+
+    def deliver(self, chunk):
+        with self._cond:
+            if self._resync:
+                return  # the snapshot sent next covers it
+            if len(self._chunks) >= self.max_chunks:
+                self._chunks.clear()
+                self._resync = True
+            else:
+                self._chunks.append(chunk)
+            self._cond.notify()
+        if self.wake is not None:
+            self.wake()
+
+    def _take(self):
+        if self._resync:
+            self._resync = False
+            return RESYNC
+        if not self._chunks:
+            return None
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+    def take(self):
+        """Buffered bytes, RESYNC if a snapshot must be sent, or None; never waits"""
+        with self._cond:
+            return self._take()
+
+    def next(self, timeout):
+        """Like take(), but waits up to timeout for something to arrive"""
+        with self._cond:
+            if not self._chunks and not self._resync:
+                self._cond.wait(timeout)
+            return self._take()
+
+
+class LiveFeed:
+    """Per-process publisher: coalesces session updates and fans them out by exam."""
+
+    def __init__(self, resolve, interval=0.5, max_chunks=64, max_pending=10000,
+                 recent=50, keepalive=10.0, stale_after=900.0, channel=None):
+        self.resolve = resolve  # session_id -> {"exam_id", ...} of an active session, or None
+        self.channel = channel  # SharedChannel to the other processes' feeds, or None
+        self.interval = interval
+        self.max_chunks = max_chunks
+        self.keepalive = keepalive  # an unchanged status is still re-sent this often
+        self.stale_after = stale_after  # sessions silent this long leave the snapshot
+        self.dropped = 0  # events lost because the pending queue was full
+        self.published = 0  # batches handed to subscribers
+        self.resyncs = 0  # snapshots re-sent to subscribers that fell behind
+        self._lock = threading.Lock()
+        self._pending_status = {}  # session_id -> latest status not yet published
+        self._pending_events = deque(maxlen=max_pending)  # (event, session_id, data)
+        self._sessions = TTLCache(100000, 3600)  # session_id -> resolved info or None
+        self._status = {}  # exam_id -> {session_id: (status, sent_at)}
+        self._recent = {}  # exam_id -> deque of recent violations
+        self._recent_max = recent
+        self._subscribers = {}  # exam_id -> set of Subscriber
+        self._pid = None
+        self._pruned = time.monotonic()
+
+    # ---- publishing (request threads) ----
+    def start(self):
+        """Start the publisher once per process (threads do not survive a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name="live-feed", daemon=True).start()
+
+    def publish_status(self, session_id, status):
+        """Merge status fields into the session's pending update"""
+        self.start()
+        with self._lock:
+            self._pending_status.setdefault(session_id, {}).update(status)
+
+    def publish_event(self, event, session_id, data):
+        self.start()
+        with self._lock:
+            if len(self._pending_events) == self._pending_events.maxlen:
+                self.dropped += 1
+            self._pending_events.append((event, session_id, data))
+
+    # ---- subscribing (streaming responses) ----
+    def subscribe(self, exam_id, max_subscribers, wake=None):
+        """A Subscriber for exam_id, or None when max_subscribers are already connected"""
+        self.start()
+        with self._lock:
+            if self.subscriber_count() >= max_subscribers:
+                return None
+            sub = Subscriber(exam_id, self.max_chunks, wake)
+            self._subscribers.setdefault(exam_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.exam_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.exam_id]
+
+    def subscriber_count(self):
+        return sum(len(s) for s in self._subscribers.values())
+
+    def snapshot(self, exam_id):
+        """SSE 'snapshot' event: every live session of the exam and its recent violations"""
+        with self._lock:
+            sessions = {sid: status for sid, (status, _) in self._status.get(exam_id, {}).items()}
+            recent = list(self._recent.get(exam_id, ()))
+        return sse("snapshot", {"exam_id": exam_id, "sessions": sessions, "violations": recent,
+                                "interval_s": self.interval})
+
+    def resync(self, exam_id):
+        """snapshot() for a subscriber that fell behind and lost its backlog"""
+        self.resyncs += 1
+        return self.snapshot(exam_id)
+
+    # ---- publisher thread ----
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print("live feed error:", e)
+
+    def _info(self, session_id):
+        info = self._sessions.get(session_id, _MISSING)
+        if info is _MISSING:
+            try:
+                info = self.resolve(session_id)
+            except Exception as e:
+                print("live feed resolve error:", e)
+                return None
+            self._sessions.set(session_id, info)
+        return info
+
+    def _exchange(self, statuses, events):
+        """Pass this process's updates to the channel; returns everything published there since
+        the last exchange (these updates included), merged in order"""
+        if statuses or events:
+            self.channel.publish(json.dumps({"statuses": statuses, "events": events},
+                                            separators=(",", ":")))
+        statuses, events = {}, []
+        for payload in self.channel.read():
+            message = json.loads(payload)
+            for sid, status in message["statuses"].items():
+                statuses.setdefault(int(sid), {}).update(status)
+            events.extend((event, sid, data) for event, sid, data in message["events"])
+        return statuses, events
+
+    def flush(self):
+        """Publish everything pending; returns the number of exams that got a batch"""
+        with self._lock:
+            statuses, self._pending_status = self._pending_status, {}
+            events = list(self._pending_events)
+            self._pending_events.clear()
+        if self.channel is not None:
+            statuses, events = self._exchange(statuses, events)
+        if not statuses and not events and time.monotonic() - self._pruned < self.stale_after:
+            return 0
+        # resolving may hit the database, so it happens outside the lock
+        infos = {sid: self._info(sid) for sid in set(statuses) | {e[1] for e in events}}
+        now = time.monotonic()
+        batches = {}  # exam_id -> ({session_id: status}, [sse chunks])
+        with self._lock:
+            for sid, status in statuses.items():
+                info = infos[sid]
+                if not info:
+                    continue
+                exam = self._status.setdefault(info["exam_id"], {})
+                changed, events_out = batches.setdefault(info["exam_id"], ({}, []))
+                previous = exam.get(sid)
+                status = {**(previous[0] if previous else {}), **status, "name": info.get("name")}
+                if previous is None:
+                    events_out.append(sse("session", {"session_id": sid, "state": "active", **info}))
+                elif previous[0] == status and now - previous[1] < self.keepalive:
+                    exam[sid] = (status, previous[1])
+                    continue
+                exam[sid] = (status, now)
+                changed[sid] = {k: v for k, v in status.items() if k != "name"}
+            for event, sid, data in events:
+                info = infos[sid]
+                if not info:
+                    continue
+                exam_id = info["exam_id"]
+                data = {"session_id": sid, **data}
+                if event == "violation":
+                    self._recent.setdefault(exam_id, deque(maxlen=self._recent_max)).append(data)
+                elif event == "session" and data.get("state") == "ended":
+                    self._status.get(exam_id, {}).pop(sid, None)
+                    self._sessions.pop(sid)
+                batches.setdefault(exam_id, ({}, []))[1].append(sse(event, data))
+            if now - self._pruned >= self.stale_after:
+                self._pruned = now
+                for exam in self._status.values():
+                    for sid in [s for s, (_, sent) in exam.items() if now - sent > self.stale_after]:
+                        del exam[sid]
+            sent = 0
+            for exam_id, (changed, chunks) in batches.items():
+                subs = self._subscribers.get(exam_id)
+                if not subs or (not changed and not chunks):
+                    continue
+                if changed:
+                    chunks.append(sse("status", {"sessions": changed}))
+                data = b"".join(chunks)
+                for sub in subs:
+                    sub.deliver(data)
+                sent += 1
+            self.published += sent
+        return sent
+
+    def stream(self, sub, heartbeat=15.0):
+        """Response body for a subscriber: a snapshot, then batches as they are published"""
+        try:
+            yield self.snapshot(sub.exam_id)
+            while True:
+                data = sub.next(heartbeat)
+                if data is None:
+                    yield b": ping\n\n"  # keeps proxies from closing an idle stream
+                elif data is RESYNC:
+                    yield self.resync(sub.exam_id)
+                else:
+                    yield data
+        finally:
+            self.unsubscribe(sub)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": self.subscriber_count(), "exams": len(self._subscribers),
+                    "published": self.published, "dropped": self.dropped, "resyncs": self.resyncs}
+
+
+class _Connection:
+    __slots__ = ("sock", "request", "sub", "out", "closing", "writing", "opened", "last_sent")
+
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.request = b""  # request head, until the stream opens
+        self.sub = None
+        self.out = b""  # bytes the socket did not take yet
+        self.closing = False  # close once `out` is sent (refusals)
+        self.writing = False  # registered for EVENT_WRITE: the socket buffer was full
+        self.opened = now
+        self.last_sent = now
+
+
+class LiveServer:
+    """Serves GET /api/exam/<exam_id>/live?stream_token=... for many watchers from one thread."""
+
+    PATH = re.compile(r"/api/exam/(\d+)/live")
+    REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+               404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+    def __init__(self, feed, authorize, max_subscribers=1000, heartbeat=15.0,
+                 request_timeout=10.0, max_request=8192):
+        self.feed = feed
+        self.authorize = authorize  # (exam_id, stream_token) -> None, or (status, message) to refuse
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.request_timeout = request_timeout  # for the request head, before the stream opens
+        self.max_request = max_request
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._signalled = False
+        self._connections = set()
+        self._stopped = False
+
+    def _wake(self):
+        # one byte per loop iteration at most: the loop sends every pending chunk anyway
+        if not self._signalled:
+            self._signalled = True
+            try:
+                self._wake_w.send(b"\0")
+            except OSError:
+                pass
+
+    def stop(self):
+        self._stopped = True
+        self._signalled = False
+        self._wake()
+
+    def serve_forever(self, listener):
+        """Run the loop on a bound, listening socket until stop()"""
+        listener.setblocking(False)
+        self._selector.register(listener, selectors.EVENT_READ, "listen")
+        self._selector.register(self._wake_r, selectors.EVENT_READ, "wake")
+        self.feed.start()
+        try:
+            while not self._stopped:
+                for key, events in self._selector.select(timeout=1.0):
+                    if key.data == "listen":
+                        self._accept(listener)
+                    elif key.data == "wake":
+                        self._drain_wake()
+                    else:
+                        if events & selectors.EVENT_READ:
+                            self._read(key.data)
+                        if events & selectors.EVENT_WRITE and key.data in self._connections:
+                            self._send(key.data)
+                now = time.monotonic()
+                for conn in list(self._connections):
+                    self._pump(conn, now)
+        finally:
+            for conn in list(self._connections):
+                self._close(conn)
+            self._selector.unregister(listener)
+            self._selector.unregister(self._wake_r)
+
+    def _accept(self, listener):
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print("live server accept error:", e)  # e.g. out of file descriptors
+                return
+            sock.setblocking(False)
+            conn = _Connection(sock, time.monotonic())
+            self._connections.add(conn)
+            self._selector.register(sock, selectors.EVENT_READ, conn)
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        self._signalled = False
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(conn)  # the watcher went away
+            return
+        if conn.sub is not None or conn.closing:
+            return  # nothing is expected after the request head
+        conn.request += data
+        if b"\r\n\r\n" in conn.request:
+            self._open(conn)
+        elif len(conn.request) > self.max_request:
+            self._refuse(conn, 400, "Request too large")
+
+    def _open(self, conn):
+        try:
+            method, target, _ = conn.request.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+        except ValueError:
+            return self._refuse(conn, 400, "Bad request")
+        url = urlsplit(target)
+        match = self.PATH.fullmatch(url.path)
+        if not match:
+            return self._refuse(conn, 404, "Not found")
+        if method != "GET":
+            return self._refuse(conn, 405, "Method not allowed")
+        exam_id = int(match.group(1))
+        token = parse_qs(url.query).get("stream_token", [""])[0]
+        try:
+            refused = self.authorize(exam_id, token)
+        except Exception as e:
+            print("live server authorize error:", e)
+            refused = (503, "Live feed unavailable, retry later")
+        if refused:
+            return self._refuse(conn, *refused)
+        sub = self.feed.subscribe(exam_id, self.max_subscribers, self._wake)
+        if sub is None:
+            return self._refuse(conn, 503, "Too many live watchers, retry later", retry_after=30)
+        conn.sub = sub
+        conn.out = (b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                    b"Cache-Control: no-cache\r\nX-Accel-Buffering: no\r\nConnection: close\r\n\r\n"
+                    + self.feed.snapshot(exam_id))
+        self._send(conn)
+
+    def _refuse(self, conn, status, message, retry_after=None):
+        body = json.dumps({"success": False, "message": message}).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {self.REASONS.get(status, 'Error')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n")
+        if retry_after:
+            head += f"Retry-After: {retry_after}\r\n"
+        conn.out = head.encode("latin-1") + b"\r\n" + body
+        conn.closing = True
+        self._send(conn)
+
+    def _pump(self, conn, now):
+        if conn.sub is None:
+            if not conn.closing and now - conn.opened > self.request_timeout:
+                self._close(conn)
+            return
+        if conn.out:
+            return  # still sending; what piles up meanwhile stays bounded in the Subscriber
+        data = conn.sub.take()
+        if data is RESYNC:
+            data = self.feed.resync(conn.sub.exam_id)
+        elif data is None:
+            if now - conn.last_sent < self.heartbeat:
+                return
+            data = b": ping\n\n"  # keeps proxies from closing an idle stream
+        conn.out = data
+        self._send(conn)
+
+    def _send(self, conn):
+        try:
+            sent = conn.sock.send(conn.out)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(conn)
+            return
+        conn.out = conn.out[sent:]
+        conn.last_sent = time.monotonic()
+        if not conn.out and conn.closing:
+            self._close(conn)
+        elif bool(conn.out) != conn.writing:
+            conn.writing = bool(conn.out)
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.writing else 0)
+            self._selector.modify(conn.sock, events, conn)
+
+    def _close(self, conn):
+        if conn not in self._connections:
+            return
+        self._connections.discard(conn)
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        conn.sock.close()
+        if conn.sub is not None:
+            self.feed.unsubscribe(conn.sub)
+
+
+def listen(bind, backlog=1024):
+    """Listening socket for "host:port" """
+    host, _, port = bind.rpartition(":")
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host.strip("[]") or "0.0.0.0", int(port)))
+    sock.listen(backlog)
+    return sock
@@ -1,24 +1,47 @@
 # app.py
 import os
-import sqlite3
+import atexit
 import pickle
 import json
+import random
 import base64
 import io
+import queue
 import threading
+import time
+import hmac
+import hashlib
+import math
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from pathlib import Path
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from PIL import Image
+from PIL import Image, ImageOps
 
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, request, jsonify, send_file, render_template, g
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 
 import jwt
-import face_recognition
 import numpy as np
 import cv2
 
+from storage import create_store
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import tracer_from_env
+from profiler import SamplingProfiler, ProfilerBusy
+from admission import FrameGate, QueueFull, ADMITTED, SUPERSEDED, worker_limits
+import headpose
+from cache import TTLCache
+from sessionstate import session_state_from_env
+from evidence import EvidenceStore
+import timeline as tl
+from livefeed import LiveFeed, LiveServer, listen
+from ratelimit import TokenBucketLimiter, parse_limit
+import grading
+
 # ----------------- CONFIG -----------------
 BASE_DIR = Path(__file__).parent
 STATIC_DIR = BASE_DIR / "static"
@@ -28,6 +51,8 @@ DB_PATH = BASE_DIR / "users.db"
 
 # create dirs
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+THUMB_DIR = UPLOAD_DIR / "thumbs"
+THUMB_DIR.mkdir(parents=True, exist_ok=True)
 ENC_DIR.mkdir(parents=True, exist_ok=True)
 
 # JWT config - prefer env var in production
@@ -40,119 +65,166 @@ if not JWT_SECRET:
 JWT_ALGORITHM = "HS256"
 JWT_EXP_DAYS = int(os.environ.get("JWT_EXP_DAYS", "7"))
 
+# Operational endpoints (/api/admin/*) are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
 ALLOWED_EXT = {"png", "jpg", "jpeg"}
 MAX_PHOTO_BYTES = 4 * 1024 * 1024  # 4MB
 
 app = Flask(__name__, static_folder="static", static_url_path="/static")
+# behind Apache/lighttpd, let the front server stream photos and reports itself
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "0") == "1"
 
 # ----------------- DATABASE -----------------
-def get_db_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# All persistence goes through the repository layer in storage.py.
+# DATABASE_URL=postgresql://... selects PostgreSQL; otherwise users.db is used.
+store = create_store(DB_PATH)
 
 def init_db():
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
-    # Users table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT UNIQUE,
-        full_name TEXT,
-        student_id TEXT,
-        email TEXT UNIQUE,
-        phone TEXT,
-        course TEXT,
-        role TEXT,
-        password_hash TEXT,
-        photo_path TEXT,
-        encoding_path TEXT,
-        notes TEXT,
-        created_at TEXT
-    );
-    """)
-    
-    # Exams table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS exams (
-        exam_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        exam_title TEXT NOT NULL,
-        description TEXT,
-        domain TEXT,
-        difficulty TEXT,
-        duration INTEGER DEFAULT 60,
-        total_questions INTEGER DEFAULT 0,
-        is_active INTEGER DEFAULT 1,
-        created_at TEXT
-    );
-    """)
-    
-    # Exam Questions table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS exam_questions (
-        question_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        exam_id INTEGER NOT NULL,
-        question TEXT NOT NULL,
-        options TEXT NOT NULL,
-        correct_answer INTEGER NOT NULL,
-        question_order INTEGER DEFAULT 0,
-        FOREIGN KEY (exam_id) REFERENCES exams(exam_id) ON DELETE CASCADE
-    );
-    """)
-    
-    # Sessions table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS sessions (
-        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        exam_id INTEGER NOT NULL,
-        start_time TEXT NOT NULL,
-        end_time TEXT,
-        status TEXT DEFAULT 'active',
-        created_at TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(user_id),
-        FOREIGN KEY (exam_id) REFERENCES exams(exam_id)
-    );
-    """)
-    
-    # Reports table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS reports (
-        report_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id INTEGER NOT NULL,
-        user_id TEXT NOT NULL,
-        exam_id INTEGER NOT NULL,
-        total_questions INTEGER DEFAULT 0,
-        correct_answers INTEGER DEFAULT 0,
-        marks REAL DEFAULT 0.0,
-        percentage REAL DEFAULT 0.0,
-        submitted_at TEXT,
-        FOREIGN KEY (session_id) REFERENCES sessions(session_id),
-        FOREIGN KEY (user_id) REFERENCES users(user_id),
-        FOREIGN KEY (exam_id) REFERENCES exams(exam_id)
-    );
-    """)
-    
-    # Violation Logs table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS violation_logs (
-        violation_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id INTEGER NOT NULL,
-        violation_type TEXT NOT NULL,
-        violation_details TEXT,
-        timestamp TEXT NOT NULL,
-        severity TEXT DEFAULT 'medium',
-        FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
-    );
-    """)
-    
-    conn.commit()
-    conn.close()
+    store.init_schema()
+
+# ----------------- SESSION STATE -----------------
+# Per-session proctoring state (ROI tracking, pre-detection sampling,
+# re-verification schedule) and the login throttling counters. With the
+# default SESSION_STATE_URL=local it lives in this process only, so a session
+# must stick to one worker; shm:// shares it between the workers of a node and
+# redis:// between nodes. Each frame loads its session's entries in one batched
+# read and writes back only what changed (sessionstate.py).
+session_state = session_state_from_env()
+
+def load_session_state(session_id):
+    """Pull a session's shared entries before handling its frame; on backend errors the local copy is used"""
+    try:
+        with SESSION_STATE_SECONDS.time(op="load"):
+            session_state.load(session_id)
+    except Exception as e:
+        SESSION_STATE_ERRORS_TOTAL.inc(op="load")
+        print("session state load error:", e)
+
+def save_session_state(session_id):
+    try:
+        with SESSION_STATE_SECONDS.time(op="save"):
+            session_state.save(session_id)
+    except Exception as e:
+        SESSION_STATE_ERRORS_TOTAL.inc(op="save")
+        print("session state save error:", e)
 
 init_db()
 
+# ----------------- METRICS -----------------
+# Exposed at /metrics in Prometheus text format; values are per worker process.
+ANALYZE_STAGE_SECONDS = REGISTRY.histogram(
+    "proctor_analyze_frame_stage_seconds", "Time spent in each /analyze_frame stage", ["stage"])
+VIOLATIONS_TOTAL = REGISTRY.counter(
+    "proctor_violations_total", "Violations logged, by type", ["type"])
+DETECTOR_CALLS_TOTAL = REGISTRY.counter(
+    "proctor_detector_calls_total", "Face detector invocations by backend and outcome", ["backend", "outcome"])
+ACTIVE_SESSIONS = REGISTRY.gauge(
+    "proctor_active_sessions", "Exam sessions currently in the active state",
+    fn=lambda: store.count_active_sessions())
+DB_BUSY_RETRIES = REGISTRY.callback_counter(
+    "proctor_db_busy_retries_total", "Retries after SQLite reported the database busy/locked", (),
+    lambda: {(): store.stats().get("busy_retries", 0)})
+DB_BUSY_WAIT = REGISTRY.callback_counter(
+    "proctor_db_busy_wait_seconds_total", "Time spent waiting on SQLite locks", (),
+    lambda: {(): store.stats().get("busy_wait_seconds", 0.0)})
+ANALYZE_INFLIGHT = REGISTRY.gauge(
+    "proctor_analyze_frame_inflight", "/analyze_frame requests currently being processed")
+ANALYZE_INFLIGHT.set(0)
+FRAMES_SHED_TOTAL = REGISTRY.counter(
+    "proctor_frames_shed_total", "Frames dropped by admission control, by reason", ["reason"])
+ROI_FRAMES_TOTAL = REGISTRY.counter(
+    "proctor_roi_frames_total", "Frames by detection region: hit (crop found a face), miss (crop empty, redone on full frame), full", ["result"])
+REVERIFY_TOTAL = REGISTRY.counter(
+    "proctor_reverify_total", "Background identity re-verification samples, by outcome", ["outcome"])
+REVERIFY_SECONDS = REGISTRY.histogram(
+    "proctor_reverify_seconds", "Time to encode and compare one re-verification sample")
+REVERIFY_QUEUE_DEPTH = REGISTRY.gauge(
+    "proctor_reverify_queue_depth", "Re-verification samples waiting for a worker",
+    fn=lambda: _reverify_queue.qsize())
+AUTH_CACHE_TOTAL = REGISTRY.callback_counter(
+    "proctor_auth_cache_total", "Token and user-profile cache lookups", ["cache", "result"],
+    lambda: {("token", "hit"): token_cache.hits, ("token", "miss"): token_cache.misses,
+             ("user", "hit"): user_cache.hits, ("user", "miss"): user_cache.misses})
+PASSWORD_HASH_SECONDS = REGISTRY.histogram(
+    "proctor_password_hash_seconds", "Password hash/check time on the password pool", ["op"])
+PASSWORD_PENDING = REGISTRY.gauge(
+    "proctor_password_pending", "Password hash/check tasks running or queued")
+PASSWORD_PENDING.set(0)
+LOGIN_REJECTED_TOTAL = REGISTRY.counter(
+    "proctor_login_rejected_total", "Logins refused before checking the password, by reason", ["reason"])
+AUTOSAVE_DELTAS_TOTAL = REGISTRY.counter(
+    "proctor_autosave_deltas_total", "Answer changes received by /api/session/autosave")
+AUTOSAVE_DISCARDED_TOTAL = REGISTRY.counter(
+    "proctor_autosave_discarded_total", "Pending answer changes dropped because their session had ended")
+AUTOSAVE_FLUSH_SECONDS = REGISTRY.histogram(
+    "proctor_autosave_flush_seconds", "Time to write one batch of coalesced answer deltas")
+AUTOSAVE_PENDING = REGISTRY.gauge(
+    "proctor_autosave_pending_sessions", "Sessions with answer changes not yet written",
+    fn=lambda: len(_autosave_pending))
+EVIDENCE_FRAMES_TOTAL = REGISTRY.counter(
+    "proctor_evidence_frames_total", "Violation frames offered to the evidence store, by result", ["result"])
+EVIDENCE_BYTES_TOTAL = REGISTRY.counter(
+    "proctor_evidence_bytes_total", "Bytes appended to evidence segments")
+PREDETECT_REPORTS_TOTAL = REGISTRY.counter(
+    "proctor_predetect_reports_total", "Client pre-detection reports, by whether a frame was attached", ["frame"])
+PREDETECT_DISPUTES_TOTAL = REGISTRY.counter(
+    "proctor_predetect_disputes_total", "Verified frames whose server face count differed from the client's")
+PREDETECT_REFUSED_TOTAL = REGISTRY.counter(
+    "proctor_predetect_refused_total", "Frame-less reports refused because a requested frame never came")
+ANALYZE_QUEUE_DEPTH = REGISTRY.gauge(
+    "proctor_analyze_frame_queue_depth", "Frames waiting for a detection slot",
+    fn=lambda: frame_gate.depth())
+SESSION_STATE_SECONDS = REGISTRY.histogram(
+    "proctor_session_state_seconds", "Time to load/save one session's shared proctoring state", ["op"])
+SESSION_STATE_ERRORS_TOTAL = REGISTRY.counter(
+    "proctor_session_state_errors_total", "Shared session state operations that failed", ["op"])
+LIVE_FEED_SUBSCRIBERS = REGISTRY.gauge(
+    "proctor_live_feed_subscribers", "Open live monitoring streams",
+    fn=lambda: live_feed.subscriber_count())
+LIVE_FEED_BATCHES_TOTAL = REGISTRY.callback_counter(
+    "proctor_live_feed_batches_total", "Per-exam update batches handed to live monitoring streams", (),
+    lambda: {(): live_feed.published})
+LIVE_FEED_DROPPED_TOTAL = REGISTRY.callback_counter(
+    "proctor_live_feed_dropped_total", "Live feed updates lost: pending queue full, or a slow stream resent a snapshot", ["reason"],
+    lambda: {("pending",): live_feed.dropped, ("resync",): live_feed.resyncs})
+RATE_LIMITED_TOTAL = REGISTRY.counter(
+    "proctor_rate_limited_total", "Requests refused with 429 by the per-route token buckets", ["route", "key"])
+RATE_LIMIT_BUCKETS = REGISTRY.gauge(
+    "proctor_rate_limit_buckets", "Token buckets currently held by the rate limiter",
+    fn=lambda: sum(len(limiter) for _, limiter in rate_limits.values()))
+
+# ----------------- TRACING -----------------
+# Per-stage spans for the proctoring and verification routes.
+# TRACE_SAMPLE_RATE (0..1) exports a fraction of requests, TRACE_SLOW_MS exports
+# any request slower than the threshold; TRACE_FORMAT=jsonl|otlp, TRACE_FILE=path.
+tracer = tracer_from_env(BASE_DIR / "traces.jsonl")
+TRACED_ENDPOINTS = {"analyze_frame", "voice_event", "api_verify", "start_session", "end_session"}
+
+@app.before_request
+def start_request_trace():
+    if tracer.enabled and request.endpoint in TRACED_ENDPOINTS:
+        tracer.start(request.endpoint, method=request.method, path=request.path)
+
+@app.after_request
+def annotate_request_trace(response):
+    tracer.annotate("http.status_code", response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_trace(exc):
+    tracer.finish()
+
+@app.before_request
+def track_analyze_inflight():
+    if request.endpoint == "analyze_frame":
+        ANALYZE_INFLIGHT.inc()
+
+@app.teardown_request
+def untrack_analyze_inflight(exc):
+    if request.endpoint == "analyze_frame":
+        ANALYZE_INFLIGHT.dec()
+
 # ----------------- POPULATE INITIAL EXAM DATA -----------------
 def get_domain_questions():
     """Returns domain-specific questions for each exam"""
@@ -380,22 +452,6 @@ def get_domain_questions():
 def populate_initial_exams():
     """Populate exams and questions from domain-specific questions"""
     
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
-    # Check if exams already exist
-    cur.execute("SELECT COUNT(*) as count FROM exams")
-    count = cur.fetchone()["count"]
-    
-    # If exams exist, clear existing questions to repopulate with domain-specific ones
-    if count > 0:
-        print("Exams already exist. Clearing existing questions to repopulate with domain-specific questions...")
-        # Delete all existing questions
-        cur.execute("DELETE FROM exam_questions")
-        # Update exam total_questions to 0 temporarily
-        cur.execute("UPDATE exams SET total_questions = 0")
-        conn.commit()
-    
     # Define exams based on the existing test structure
     exams_data = [
         {"id": 1, "title": "Python Basics", "description": "20 MCQs — Variables, Data Types, Operators", "domain": "Programming", "difficulty": "Beginner"},
@@ -433,67 +489,18 @@ def populate_initial_exams():
     # Get domain-specific questions
     domain_questions = get_domain_questions()
     
+    # Skip the reseed when the stored question bank already matches this code
+    fingerprint = hashlib.sha256(
+        json.dumps([exams_data, domain_questions], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    if store.get_meta("question_bank_fingerprint") == fingerprint:
+        return
+    
     created_at = datetime.utcnow().isoformat() + "Z"
     
     # Insert or update exams and their questions
-    for exam in exams_data:
-        exam_id = exam["id"]
-        questions = domain_questions.get(exam_id, [])
-        
-        # Check if exam exists
-        cur.execute("SELECT exam_id FROM exams WHERE exam_id = ?", (exam_id,))
-        exam_exists = cur.fetchone()
-        
-        if exam_exists:
-            # Update existing exam
-            cur.execute("""
-                UPDATE exams 
-                SET exam_title = ?, description = ?, domain = ?, difficulty = ?, 
-                    duration = ?, total_questions = ?, is_active = ?
-                WHERE exam_id = ?
-            """, (
-                exam["title"],
-                exam["description"],
-                exam["domain"],
-                exam["difficulty"],
-                60,  # Default duration in minutes
-                len(questions),
-                1,
-                exam_id
-            ))
-        else:
-            # Insert new exam
-            cur.execute("""
-                INSERT INTO exams (exam_id, exam_title, description, domain, difficulty, duration, total_questions, is_active, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                exam_id,
-                exam["title"],
-                exam["description"],
-                exam["domain"],
-                exam["difficulty"],
-                60,  # Default duration in minutes
-                len(questions),
-                1,
-                created_at
-            ))
-        
-        # Insert questions for this exam
-        for idx, q in enumerate(questions):
-            options_json = json.dumps(q.get("options", []))
-            cur.execute("""
-                INSERT INTO exam_questions (exam_id, question, options, correct_answer, question_order)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                exam_id,
-                q.get("question", ""),
-                options_json,
-                q.get("answer", 0),
-                idx
-            ))
-    
-    conn.commit()
-    conn.close()
+    store.seed_exams(exams_data, domain_questions, created_at)
+    store.set_meta("question_bank_fingerprint", fingerprint)
     print("Initial exam data populated successfully with domain-specific questions!")
 
 # Populate on startup
@@ -508,6 +515,8 @@ CAFFE_MODEL = BASE_DIR / "models" / "res10_300x300_ssd_iter_140000.caffemodel"
 # Proctoring state
 proctoring_state = {
     "head_pose_threshold": 0.25,
+    "head_yaw_threshold": 25.0,    # degrees, landmark PnP (head_pose_from_landmarks)
+    "head_pitch_threshold": 20.0,
     "head_pose_alert_duration": 3.0,
     "voice_threshold": 0.08,
     "voice_alert_duration": 2.0,
@@ -516,13 +525,24 @@ proctoring_state = {
     "confidence_threshold": 0.6
 }
 
-# Detector placeholders
+# Detector placeholders (loaded on first use, or up front by preload_models())
 detector_yunet = None
 net_caffe = None
 face_cascade = None
+detectors_ready = False
+_face_recognition = None
+_model_lock = threading.Lock()
 
 def init_detectors():
     """Initialize face detection models"""
+    global detector_yunet, net_caffe, face_cascade, detectors_ready
+    with _model_lock:
+        if detectors_ready:
+            return
+        _load_detectors()
+        detectors_ready = True
+
+def _load_detectors():
     global detector_yunet, net_caffe, face_cascade
     try:
         if YUNET_PATH.exists():
@@ -540,81 +560,249 @@ def init_detectors():
         print("Detector init error:", e)
         face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
-init_detectors()
+def get_face_recognition():
+    """Import face_recognition (dlib) on first use; it is slow to load"""
+    global _face_recognition
+    if _face_recognition is None:
+        with _model_lock:
+            if _face_recognition is None:
+                import face_recognition
+                _face_recognition = face_recognition
+    return _face_recognition
+
+def preload_models():
+    """Load every heavy model now, e.g. in a prefork master so workers share them copy-on-write"""
+    init_detectors()
+    get_face_recognition()
+
+def active_detector_backend():
+    if detector_yunet is not None:
+        return "yunet"
+    if net_caffe is not None:
+        return "caffe"
+    if face_cascade is not None:
+        return "haar"
+    return None
 
-def b64_to_image(base64_data):
-    """Convert base64 string to OpenCV image"""
+def b64_to_bytes(base64_data):
+    """Decode a base64 string or data URL to the encoded image bytes"""
     header, encoded = base64_data.split(",", 1) if "," in base64_data else (None, base64_data)
-    binary = base64.b64decode(encoded)
+    return base64.b64decode(encoded)
+
+def bytes_to_image(binary):
+    """Convert encoded image bytes to OpenCV image"""
     image = Image.open(io.BytesIO(binary)).convert("RGB")
     return np.array(image)[:, :, ::-1]  # PIL RGB -> OpenCV BGR
 
-def detect_faces_stable(frame):
-    """Detect faces using YuNet, Caffe, or Haar cascade"""
+def b64_to_image(base64_data):
+    """Convert base64 string to OpenCV image"""
+    return bytes_to_image(b64_to_bytes(base64_data))
+
+def min_face_px():
+    """Smallest face box (pixels) accepted by the detectors"""
+    return max(24, int(proctoring_state.get("min_face_size", 40) * 0.5))
+
+# Every detector returns one record per face: box (x, y, w, h), the five YuNet
+# landmarks (NaN when the backend has none) and the detector score (NaN for Haar).
+FACE_DTYPE = np.dtype([("box", np.int32, (4,)), ("landmarks", np.float32, (5, 2)), ("score", np.float32)])
+
+def make_faces(boxes, landmarks=None, scores=None):
+    """Pack boxes (N, 4) [+ landmarks (N, 5, 2), scores (N,)] into a FACE_DTYPE array"""
+    faces = np.zeros(len(boxes), dtype=FACE_DTYPE)
+    if len(boxes):
+        faces["box"] = boxes
+    faces["landmarks"] = np.nan if landmarks is None else landmarks
+    faces["score"] = np.nan if scores is None else scores
+    return faces
+
+def face_boxes(faces):
+    """Boxes as a list of (x, y, w, h) int tuples"""
+    return [tuple(int(v) for v in box) for box in faces["box"]]
+
+def detect_with_yunet(detector, frame):
+    """Run a YuNet detector; returns a FACE_DTYPE array with landmarks and scores"""
+    h, w = frame.shape[:2]
+    min_px = min_face_px()
+    detector.setInputSize((w, h))
+    result = detector.detect(frame)
+    detections = result[1] if isinstance(result, tuple) and len(result) >= 2 else result
+    if detections is None or len(detections) == 0:
+        return make_faces(np.empty((0, 4)))
+    detections = detections[(detections[:, 2] >= min_px) & (detections[:, 3] >= min_px)]
+    landmarks = detections[:, 4:14].reshape(-1, 5, 2) if detections.shape[1] >= 15 else None
+    scores = detections[:, 14] if detections.shape[1] >= 15 else None
+    return make_faces(detections[:, :4].astype(np.int32), landmarks, scores)
+
+def detect_with_caffe(net, frame):
+    """Run the Caffe SSD face detector; returns a FACE_DTYPE array (no landmarks)"""
     h, w = frame.shape[:2]
     faces = []
-    landmarks = None
+    scores = []
+    min_px = min_face_px()
+    blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 1.0,
+                                 (300, 300), (104.0, 177.0, 123.0))
+    net.setInput(blob)
+    detections = net.forward()
+    for i in range(0, detections.shape[2]):
+        confidence = float(detections[0, 0, i, 2])
+        if confidence > proctoring_state.get("confidence_threshold", 0.5):
+            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+            (startX, startY, endX, endY) = box.astype("int")
+            x = max(0, startX)
+            y = max(0, startY)
+            ww = max(0, endX - startX)
+            hh = max(0, endY - startY)
+            if ww >= min_px and hh >= min_px:
+                faces.append((int(x), int(y), int(ww), int(hh)))
+                scores.append(confidence)
+    return make_faces(np.array(faces, dtype=np.int32).reshape(-1, 4), scores=scores)
+
+def detect_with_haar(cascade, frame):
+    """Run a Haar cascade; returns a FACE_DTYPE array (no landmarks or scores)"""
+    min_px = min_face_px()
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    haar_faces = cascade.detectMultiScale(
+        gray,
+        scaleFactor=1.05,
+        minNeighbors=3,
+        minSize=(min_px, min_px)
+    )
+    return make_faces(np.asarray(haar_faces, dtype=np.int32).reshape(-1, 4))
+
+# ----------------- ROI TRACKING -----------------
+# While exactly one face is in view, YuNet runs on a padded crop around the
+# previous box for that session instead of the full frame. The full frame is
+# still searched every ROI_FULL_EVERY frames (so a second person is noticed)
+# and whenever the crop comes back empty. The examinee's last box is also kept
+# per session so that, with several faces in view, the same person is followed.
+ROI_CROP = os.environ.get("ROI_CROP", "1") == "1"
+ROI_PADDING = float(os.environ.get("ROI_PADDING", "0.75"))  # face sizes added on each side
+ROI_FULL_EVERY = int(os.environ.get("ROI_FULL_EVERY", "5"))
+
+roi_state = {}  # roi key (session id) -> {"box", "shape", "since_full"}
+examinee_boxes = {}  # roi key -> last examinee box (x, y, w, h)
+_roi_lock = threading.Lock()
+session_state.bind("roi", roi_state, _roi_lock,
+                   decode=lambda v: {**v, "box": tuple(v["box"]), "shape": tuple(v["shape"])})
+session_state.bind("examinee", examinee_boxes, _roi_lock, decode=tuple)
+
+def roi_window(box, shape, padding=ROI_PADDING):
+    """Padded crop (x0, y0, x1, y1) around box, clipped to a frame of the given shape"""
+    x, y, w, h = box
+    fh, fw = shape[:2]
+    pad_x, pad_y = int(w * padding), int(h * padding)
+    return max(0, x - pad_x), max(0, y - pad_y), min(fw, x + w + pad_x), min(fh, y + h + pad_y)
+
+def detect_in_roi(frame, roi_key):
+    """YuNet on the tracked crop; returns full-frame (faces, landmarks) or None to search the full frame"""
+    with _roi_lock:
+        state = roi_state.get(roi_key)
+        if state is None or state["shape"] != frame.shape[:2] or state["since_full"] >= ROI_FULL_EVERY:
+            return None
+        state["since_full"] += 1
+        x0, y0, x1, y1 = roi_window(state["box"], state["shape"])
+    try:
+        faces = detect_with_yunet(detector_yunet, frame[y0:y1, x0:x1])
+        DETECTOR_CALLS_TOTAL.inc(backend="yunet_roi", outcome="ok")
+    except Exception as e:
+        DETECTOR_CALLS_TOTAL.inc(backend="yunet_roi", outcome="error")
+        print("YuNet ROI error:", e)
+        return None
+    if len(faces) != 1:
+        ROI_FRAMES_TOTAL.inc(result="miss")
+        return None
+    ROI_FRAMES_TOTAL.inc(result="hit")
+    faces["box"][:, :2] += (x0, y0)
+    faces["landmarks"] += (x0, y0)
+    with _roi_lock:
+        if roi_key in roi_state:
+            roi_state[roi_key]["box"] = face_boxes(faces)[0]
+    return faces
+
+def update_roi(roi_key, frame, faces):
+    """Track the face found on a full frame; only a lone face is tracked"""
+    with _roi_lock:
+        if len(faces) == 1:
+            roi_state[roi_key] = {"box": face_boxes(faces)[0], "shape": frame.shape[:2], "since_full": 0}
+        else:
+            roi_state.pop(roi_key, None)
+
+def roi_forget(roi_key):
+    with _roi_lock:
+        roi_state.pop(roi_key, None)
+        examinee_boxes.pop(roi_key, None)
+
+def select_examinee(roi_key, faces):
+    """Index of the examinee among faces: best overlap with their previous box, else the largest face"""
+    if len(faces) == 0:
+        return None
+    boxes = faces["box"].astype(np.float64)
+    areas = boxes[:, 2] * boxes[:, 3]
+    with _roi_lock:
+        prev = examinee_boxes.get(roi_key) if roi_key is not None else None
+    idx = int(np.argmax(areas))
+    if prev is not None and len(faces) > 1:
+        px, py, pw, ph = prev
+        ix = np.clip(np.minimum(boxes[:, 0] + boxes[:, 2], px + pw) - np.maximum(boxes[:, 0], px), 0, None)
+        iy = np.clip(np.minimum(boxes[:, 1] + boxes[:, 3], py + ph) - np.maximum(boxes[:, 1], py), 0, None)
+        inter = ix * iy
+        iou = inter / (areas + pw * ph - inter)
+        if iou.max() > 0:
+            idx = int(np.argmax(iou))
+    if roi_key is not None:
+        with _roi_lock:
+            examinee_boxes[roi_key] = tuple(int(v) for v in faces["box"][idx])
+    return idx
+
+def detect_faces_stable(frame, roi_key=None):
+    """Detect faces using YuNet, Caffe, or Haar cascade
+
+    With roi_key (e.g. a session id) and YuNet available, successive frames are
+    searched around the last known face first (see ROI TRACKING).
+    """
+    if not detectors_ready:
+        init_detectors()
+
+    track = roi_key is not None and ROI_CROP and detector_yunet is not None
+    if track:
+        result = detect_in_roi(frame, roi_key)
+        if result is not None:
+            return result
+        ROI_FRAMES_TOTAL.inc(result="full")
 
     # YuNet detector
     if detector_yunet is not None:
         try:
-            detector_yunet.setInputSize((w, h))
-            result = detector_yunet.detect(frame)
-            detections = result[1] if isinstance(result, tuple) and len(result) >= 2 else result
-            if detections is not None and len(detections) > 0:
-                for d in detections:
-                    x, y, ww, hh = map(int, d[:4])
-                    if ww >= max(24, int(proctoring_state.get("min_face_size", 40) * 0.5)) and hh >= max(24, int(proctoring_state.get("min_face_size", 40) * 0.5)):
-                        faces.append((x, y, ww, hh))
-                if detections.shape[1] >= 14:
-                    try:
-                        landmark_data = detections[0][4:14].reshape(5, 2)
-                        landmarks = landmark_data.tolist()
-                    except Exception:
-                        landmarks = None
-            return faces, landmarks
+            result = detect_with_yunet(detector_yunet, frame)
+            DETECTOR_CALLS_TOTAL.inc(backend="yunet", outcome="ok")
+            if track:
+                update_roi(roi_key, frame, result)
+            return result
         except Exception as e:
+            DETECTOR_CALLS_TOTAL.inc(backend="yunet", outcome="error")
             print("YuNet error:", e)
 
     # Caffe SSD fallback
     if net_caffe is not None:
         try:
-            blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 1.0,
-                                         (300, 300), (104.0, 177.0, 123.0))
-            net_caffe.setInput(blob)
-            detections = net_caffe.forward()
-            for i in range(0, detections.shape[2]):
-                confidence = float(detections[0, 0, i, 2])
-                if confidence > proctoring_state.get("confidence_threshold", 0.5):
-                    box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                    (startX, startY, endX, endY) = box.astype("int")
-                    x = max(0, startX)
-                    y = max(0, startY)
-                    ww = max(0, endX - startX)
-                    hh = max(0, endY - startY)
-                    if ww >= max(24, int(proctoring_state.get("min_face_size", 40) * 0.5)) and hh >= max(24, int(proctoring_state.get("min_face_size", 40) * 0.5)):
-                        faces.append((int(x), int(y), int(ww), int(hh)))
-            return faces, None
+            result = detect_with_caffe(net_caffe, frame)
+            DETECTOR_CALLS_TOTAL.inc(backend="caffe", outcome="ok")
+            return result
         except Exception as e:
+            DETECTOR_CALLS_TOTAL.inc(backend="caffe", outcome="error")
             print("Caffe error:", e)
 
     # Haar Cascade fallback
     if face_cascade is not None:
         try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            haar_faces = face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.05,
-                minNeighbors=3,
-                minSize=(max(24, int(proctoring_state.get("min_face_size", 40) * 0.5)), max(24, int(proctoring_state.get("min_face_size", 40) * 0.5)))
-            )
-            for (x, y, ww, hh) in haar_faces:
-                faces.append((int(x), int(y), int(ww), int(hh)))
-            return faces, None
+            result = detect_with_haar(face_cascade, frame)
+            DETECTOR_CALLS_TOTAL.inc(backend="haar", outcome="ok")
+            return result
         except Exception as e:
+            DETECTOR_CALLS_TOTAL.inc(backend="haar", outcome="error")
             print("Haar error:", e)
 
-    return [], None
+    return make_faces(np.empty((0, 4)))
 
 def estimate_head_pose_simple(landmarks, face_rect):
     """Estimate head pose from facial landmarks"""
@@ -643,21 +831,380 @@ def estimate_head_pose_simple(landmarks, face_rect):
     except Exception as e:
         return 0.0, "Center", 0.0
 
+def head_pose_from_landmarks(landmarks):
+    """Yaw/pitch/roll for each face from YuNet landmarks (N, 5, 2); one dict per face"""
+    yaw, pitch, roll, _ = headpose.solve_pose(landmarks)
+    horizontal, vertical, severity = headpose.classify(
+        yaw, pitch, proctoring_state["head_yaw_threshold"], proctoring_state["head_pitch_threshold"])
+    return [{"yaw": round(float(y), 1), "pitch": round(float(p), 1), "roll": round(float(r), 1),
+             "direction": str(h), "vertical": str(v), "severity": round(float(s), 3)}
+            for y, p, r, h, v, s in zip(yaw, pitch, roll, horizontal, vertical, severity)]
+
+def face_poses(faces):
+    """Head pose of every face that has landmarks, solved as one batch; None for the rest"""
+    poses = [None] * len(faces)
+    has_landmarks = ~np.isnan(faces["landmarks"]).any(axis=(1, 2))
+    if has_landmarks.any():
+        for i, pose in zip(np.flatnonzero(has_landmarks), head_pose_from_landmarks(faces["landmarks"][has_landmarks])):
+            poses[i] = pose
+    return poses
+
+def head_pose_for_face(landmarks, face_rect):
+    """Pose of one face: PnP with all five landmarks, nose/eye offset ratio with fewer"""
+    if len(landmarks) >= 5:
+        return head_pose_from_landmarks([landmarks[:5]])[0]
+    ratio, direction, severity = estimate_head_pose_simple(landmarks, face_rect)
+    return {"ratio": float(ratio), "direction": direction, "vertical": "Center", "severity": float(severity)}
+
+def head_pose_summary(head_pose):
+    """'Left', 'Down', 'Left and Down', or None when facing the screen"""
+    turned = [d for d in (head_pose["direction"], head_pose.get("vertical", "Center")) if d != "Center"]
+    return " and ".join(turned) or None
+
 def log_violation(session_id, violation_type, violation_details, severity="medium"):
     """Log violation to database"""
-    conn = get_db_conn()
-    cur = conn.cursor()
+    VIOLATIONS_TOTAL.inc(type=violation_type)
     timestamp = datetime.utcnow().isoformat() + "Z"
     try:
-        cur.execute("""
-            INSERT INTO violation_logs (session_id, violation_type, violation_details, timestamp, severity)
-            VALUES (?, ?, ?, ?, ?)
-        """, (session_id, violation_type, violation_details, timestamp, severity))
-        conn.commit()
+        violation_id = store.add_violation(session_id, violation_type, violation_details, timestamp, severity)
     except Exception as e:
         print(f"Error logging violation: {e}")
+        return None
+    publish_violation(session_id, violation_id, violation_type, violation_details, severity, timestamp)
+    return violation_id
+
+# ----------------- EVIDENCE -----------------
+# The frame behind a NO_FACE / MULTIPLE_FACES / HEAD_POSE violation is kept as
+# the bytes the client sent (no re-encode), appended to the evidence store.
+# Per session and violation type at most one frame per EVIDENCE_MIN_INTERVAL_S
+# is kept, and at most EVIDENCE_SESSION_BUDGET_MB in total.
+EVIDENCE_CAPTURE = os.environ.get("EVIDENCE_CAPTURE", "1") == "1"
+EVIDENCE_DIR = os.environ.get("EVIDENCE_DIR", str(BASE_DIR / "evidence"))
+EVIDENCE_SESSION_BUDGET_MB = float(os.environ.get("EVIDENCE_SESSION_BUDGET_MB", "8"))
+EVIDENCE_MIN_INTERVAL_S = float(os.environ.get("EVIDENCE_MIN_INTERVAL_S", "15"))
+
+evidence_store = EvidenceStore(EVIDENCE_DIR, int(EVIDENCE_SESSION_BUDGET_MB * 1024 * 1024), EVIDENCE_MIN_INTERVAL_S)
+
+def capture_evidence(session_id, violation_id, violation_type, binary):
+    """Attach the violating frame to its violation_logs row, within the session's budget"""
+    if not EVIDENCE_CAPTURE or violation_id is None or not binary:
+        return
+    try:
+        session_id = int(session_id)
+        reason = evidence_store.admit(session_id, violation_type, len(binary))
+        if reason:
+            EVIDENCE_FRAMES_TOTAL.inc(result=reason)
+            return
+        evidence_store.append(session_id, violation_id, binary)
+        EVIDENCE_FRAMES_TOTAL.inc(result="stored")
+        EVIDENCE_BYTES_TOTAL.inc(len(binary))
+    except Exception as e:
+        EVIDENCE_FRAMES_TOTAL.inc(result="error")
+        print(f"Error storing evidence: {e}")
+
+def evidence_mimetype(data):
+    if bytes(data[:8]) == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if bytes(data[:4]) == b"RIFF":
+        return "image/webp"
+    return "image/jpeg"
+
+# ----------------- TIMELINE -----------------
+# Every analysed frame and voice report is also kept as a 16-byte sample in the
+# session's timeline (timeline.py), so reviewers can scrub the whole session,
+# not just the discrete violations.
+TIMELINE_ENABLED = os.environ.get("TIMELINE_ENABLED", "1") == "1"
+TIMELINE_DIR = os.environ.get("TIMELINE_DIR", str(BASE_DIR / "timelines"))
+TIMELINE_RAW_MAX = int(os.environ.get("TIMELINE_RAW_MAX", "20000"))
+
+timeline = tl.Timeline(TIMELINE_DIR)
+
+VIOLATION_FLAGS = {"NO_FACE": tl.FLAG_NO_FACE, "MULTIPLE_FACES": tl.FLAG_MULTIPLE_FACES,
+                   "HEAD_POSE": tl.FLAG_HEAD_POSE}
+
+def record_frame_sample(session_id, face_count, head_pose, violation_type=None, client=False):
+    if not TIMELINE_ENABLED:
+        return
+    flags = VIOLATION_FLAGS.get(violation_type, 0) | (tl.FLAG_CLIENT if client else 0)
+    pose = head_pose or {}
+    try:
+        timeline.append(int(session_id), tl.KIND_FRAME, face_count, flags,
+                        pose.get("yaw", np.nan), pose.get("pitch", np.nan), pose.get("severity", np.nan))
+    except Exception as e:
+        print(f"Error recording timeline: {e}")
+
+def record_voice_sample(session_id, rms, detected):
+    if not TIMELINE_ENABLED:
+        return
+    try:
+        timeline.append(int(session_id), tl.KIND_VOICE, flags=tl.FLAG_VOICE if detected else 0,
+                        value=np.nan if rms is None else float(rms))
+    except Exception as e:
+        print(f"Error recording timeline: {e}")
+
+# ----------------- LIVE FEED -----------------
+# Staff watch an exam at /api/exam/<exam_id>/live (Server-Sent Events).
+# Handlers only record the latest status of a session and queue violations;
+# one publisher thread per process coalesces them every LIVE_FEED_INTERVAL_S
+# and sends each exam's batch to all of its watchers (livefeed.py). With a
+# shared SESSION_STATE_URL the processes exchange their updates through the
+# "live_feed" channel, so every feed covers all sessions of the node;
+# otherwise a feed only covers the sessions handled by its own process.
+# Served by the app, an open stream occupies one of the worker's threads for
+# as long as it is watched, so at most LIVE_FEED_MAX_SUBSCRIBERS may be open
+# per worker and gunicorn.conf.py adds that many threads on top of
+# GUNICORN_THREADS. For many watchers run `python next.py live-feed` instead:
+# one thread serves up to LIVE_SERVER_MAX_SUBSCRIBERS streams on
+# LIVE_FEED_BIND (serve_live_feed).
+# EventSource cannot send an Authorization header: watchers first get a
+# LIVE_TOKEN_TTL_S stream token for one exam (POST /api/exam/<id>/live/token)
+# and pass it as ?stream_token=, so no reusable JWT ends up in access logs.
+LIVE_FEED_ENABLED = os.environ.get("LIVE_FEED_ENABLED", "1") == "1"
+LIVE_FEED_INTERVAL_S = float(os.environ.get("LIVE_FEED_INTERVAL_S", "0.5"))
+LIVE_FEED_BUFFER = int(os.environ.get("LIVE_FEED_BUFFER", "64"))  # batches a watcher may fall behind
+LIVE_FEED_MAX_SUBSCRIBERS = int(os.environ.get("LIVE_FEED_MAX_SUBSCRIBERS", "16"))
+LIVE_FEED_HEARTBEAT_S = float(os.environ.get("LIVE_FEED_HEARTBEAT_S", "15"))
+LIVE_TOKEN_TTL_S = int(os.environ.get("LIVE_TOKEN_TTL_S", "60"))
+LIVE_FEED_BIND = os.environ.get("LIVE_FEED_BIND", "0.0.0.0:5001")
+LIVE_SERVER_MAX_SUBSCRIBERS = int(os.environ.get("LIVE_SERVER_MAX_SUBSCRIBERS", "1000"))
+
+live_feed = LiveFeed(store.get_live_session, LIVE_FEED_INTERVAL_S, LIVE_FEED_BUFFER,
+                     channel=session_state.channel("live_feed"))
+
+def publish_status(session_id, **status):
+    """Latest face count / head direction / voice state of a session for live watchers"""
+    if LIVE_FEED_ENABLED:
+        live_feed.publish_status(int(session_id), status)
+
+def publish_violation(session_id, violation_id, violation_type, details, severity, timestamp):
+    if LIVE_FEED_ENABLED:
+        live_feed.publish_event("violation", int(session_id), {
+            "violation_id": violation_id, "type": violation_type, "details": details,
+            "severity": severity, "timestamp": timestamp})
+
+def publish_session_ended(session_id, report_id):
+    if LIVE_FEED_ENABLED:
+        live_feed.publish_event("session", int(session_id), {"state": "ended", "report_id": report_id})
+
+# ----------------- WARM-UP / READINESS -----------------
+# A worker reports ready (/ready) only after synthetic frames have gone through
+# detect_faces_stable and face_recognition, so real requests do not pay model
+# load, allocation and first-inference costs.
+WARMUP_FRAME_SIZES = [(640, 480), (1280, 720)]
+READY_MAX_INFLIGHT = int(os.environ.get("READY_MAX_INFLIGHT", "32"))
+
+warmup_state = {"status": "pending", "backend": None, "duration_s": None,
+                "detect_ms": None, "recognition_ms": None, "error": None}
+_warmup_pid = None
+
+def _synthetic_frame(w, h):
+    frame = np.full((h, w, 3), 96, dtype=np.uint8)
+    cv2.ellipse(frame, (w // 2, h // 2), (h // 6, h // 4), 0, 0, 360, (150, 176, 214), -1)
+    cv2.circle(frame, (w // 2 - h // 12, h // 2 - h // 16), max(2, h // 60), (25, 25, 30), -1)
+    cv2.circle(frame, (w // 2 + h // 12, h // 2 - h // 16), max(2, h // 60), (25, 25, 30), -1)
+    return frame
+
+def run_warmup():
+    """Load models and push synthetic frames through every inference path"""
+    warmup_state.update(status="running", error=None)
+    t0 = time.perf_counter()
+    try:
+        preload_models()
+        warmup_state["backend"] = active_detector_backend()
+
+        t1 = time.perf_counter()
+        for (w, h) in WARMUP_FRAME_SIZES:
+            frame = _synthetic_frame(w, h)
+            for _ in range(2):
+                detect_faces_stable(frame)
+        warmup_state["detect_ms"] = round((time.perf_counter() - t1) * 1000, 1)
+
+        t2 = time.perf_counter()
+        face_recognition = get_face_recognition()
+        rgb = cv2.cvtColor(_synthetic_frame(640, 480), cv2.COLOR_BGR2RGB)
+        face_recognition.face_locations(rgb, model="hog")
+        # force the landmark + embedding networks to run once on a fixed box
+        face_recognition.face_encodings(rgb, [(120, 420, 360, 220)])
+        warmup_state["recognition_ms"] = round((time.perf_counter() - t2) * 1000, 1)
+
+        warmup_state["status"] = "done"
+    except Exception as e:
+        warmup_state.update(status="failed", error=str(e))
+        print("Warm-up error:", e)
     finally:
-        conn.close()
+        warmup_state["duration_s"] = round(time.perf_counter() - t0, 3)
+
+def start_warmup():
+    """Run warm-up in a background thread once per process (call again after fork)"""
+    global _warmup_pid
+    if _warmup_pid == os.getpid():
+        return
+    _warmup_pid = os.getpid()
+    if warmup_state["status"] == "done":
+        return
+    threading.Thread(target=run_warmup, name="model-warmup", daemon=True).start()
+
+def readiness():
+    inflight = ANALYZE_INFLIGHT.value()
+    warm = warmup_state["status"] == "done"
+    return {
+        "ready": warm and inflight < READY_MAX_INFLIGHT and not frame_gate.full(),
+        "backend": active_detector_backend(),
+        "warmup": dict(warmup_state),
+        "queue_depth": inflight,
+        "max_queue_depth": READY_MAX_INFLIGHT,
+        "frame_queue": frame_gate.depth(),
+        "frame_queue_max": frame_gate.max_queue,
+    }
+
+# ----------------- ADAPTIVE FRAME RATE -----------------
+# /analyze_frame responses carry a recommended send interval and capture size so
+# clients slow down (instead of timing out) when this node falls behind.
+FRAME_INTERVAL_MIN_MS = int(os.environ.get("FRAME_INTERVAL_MIN_MS", "300"))
+FRAME_INTERVAL_MAX_MS = int(os.environ.get("FRAME_INTERVAL_MAX_MS", "3000"))
+ANALYZE_TARGET_MS = float(os.environ.get("ANALYZE_TARGET_MS", "150"))
+# (max load, max frame width, JPEG quality); the last tier applies above all others
+FRAME_QUALITY_TIERS = [(1.0, 1280, 0.6), (2.0, 640, 0.5), (float("inf"), 480, 0.4)]
+
+analyze_latency_ewma_ms = 0.0
+
+def record_analyze_latency(ms, alpha=0.2):
+    global analyze_latency_ewma_ms
+    analyze_latency_ewma_ms += alpha * (ms - analyze_latency_ewma_ms)
+
+def recommend_frame_params():
+    """Interval/resolution hint from queue depth and recent detection latency"""
+    queue_load = frame_gate.load()
+    latency_load = analyze_latency_ewma_ms / ANALYZE_TARGET_MS
+    load = max(queue_load, latency_load)
+    interval = min(FRAME_INTERVAL_MAX_MS, max(FRAME_INTERVAL_MIN_MS, int(FRAME_INTERVAL_MIN_MS * max(1.0, load))))
+    for limit, width, quality in FRAME_QUALITY_TIERS:
+        if load <= limit:
+            break
+    if load <= 1.0:
+        level = "normal"
+    elif interval < FRAME_INTERVAL_MAX_MS:
+        level = "degraded"
+    else:
+        level = "overloaded"
+    return {"interval_ms": interval, "max_width": width, "jpeg_quality": quality,
+            "level": level, "load": round(load, 2)}
+
+# ----------------- ADMISSION CONTROL -----------------
+# At most ANALYZE_CONCURRENCY frames are decoded/detected at once per node and
+# ANALYZE_QUEUE_MAX more may wait (one per session; a newer frame replaces the
+# queued one), split evenly over the WEB_CONCURRENCY workers. Beyond that
+# /analyze_frame answers 429 + Retry-After immediately, and frames that wait
+# longer than ANALYZE_QUEUE_WAIT_MS are dropped as stale.
+_analyze_slots, _analyze_queue = worker_limits()
+frame_gate = FrameGate(
+    slots=_analyze_slots,
+    max_queue=_analyze_queue,
+    max_wait=float(os.environ.get("ANALYZE_QUEUE_WAIT_MS", "1000")) / 1000.0,
+)
+
+def shed_frame(reason, status, message, retry_after=None):
+    FRAMES_SHED_TOTAL.inc(reason=reason)
+    tracer.annotate("shed", reason)
+    resp = jsonify({"error": message, "shed": reason, "recommended": recommend_frame_params()})
+    resp.status_code = status
+    if retry_after:
+        resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+# ----------------- CLIENT PRE-DETECTION -----------------
+# Browsers with an on-device face detector post {"client": {"faces": n, ...}}
+# instead of a frame. The server stays authoritative: it asks for a real frame
+# (verify_next) every ~CLIENT_SAMPLE_EVERY reports at randomised points, for any
+# report it would act on (no face, several faces, head turned) and for the next
+# CLIENT_DISPUTE_FRAMES reports after a verified frame disagreed with the client.
+# Violations are only logged from server-side detections. A client that keeps
+# sending frame-less reports after a frame was asked for gets CLIENT_FRAME_GRACE
+# of them (requests already in flight), then every further one is refused (409)
+# and a FRAME_WITHHELD violation is logged once, until a real frame arrives.
+CLIENT_PREDETECT = os.environ.get("CLIENT_PREDETECT", "1") == "1"
+CLIENT_SAMPLE_EVERY = max(1, int(os.environ.get("CLIENT_SAMPLE_EVERY", "10")))
+CLIENT_DISPUTE_FRAMES = int(os.environ.get("CLIENT_DISPUTE_FRAMES", "5"))
+CLIENT_FRAME_GRACE = max(0, int(os.environ.get("CLIENT_FRAME_GRACE", "2")))
+
+predetect_sessions = {}  # session_id -> {"since_sample", "due", "distrust", "owed"}
+_predetect_lock = threading.Lock()
+session_state.bind("predetect", predetect_sessions, _predetect_lock)
+
+def predetect_hint():
+    return {"enabled": CLIENT_PREDETECT, "sample_every": CLIENT_SAMPLE_EVERY}
+
+def parse_client_report(raw):
+    """Validate a client report; returns (faces, landmarks) or None"""
+    if not isinstance(raw, dict):
+        return None
+    try:
+        count = int(raw.get("faces", -1))
+        boxes = raw.get("boxes") or []
+        faces = [tuple(int(b[k]) for k in ("x", "y", "w", "h")) for b in boxes[:count if count > 0 else 0]]
+        landmarks = raw.get("landmarks")
+        if landmarks is not None:
+            landmarks = [[float(p[0]), float(p[1])] for p in landmarks[:5]]
+    except (TypeError, ValueError, KeyError, IndexError):
+        return None
+    if count < 0 or len(faces) != count:
+        return None
+    return faces, landmarks
+
+def _predetect_entry(session_id):
+    entry = predetect_sessions.get(session_id)
+    if entry is None:
+        entry = predetect_sessions[session_id] = {"since_sample": 0, "due": 0, "distrust": 0, "owed": None}
+    return entry
+
+def predetect_overdue(session_id):
+    """Count a frame-less report against an outstanding frame request; returns how
+    many reports past CLIENT_FRAME_GRACE it is (0 while the report is acceptable)"""
+    with _predetect_lock:
+        entry = _predetect_entry(session_id)
+        if entry.get("owed") is None:
+            return 0
+        entry["owed"] += 1
+        return max(0, entry["owed"] - CLIENT_FRAME_GRACE)
+
+def predetect_wants_frame(session_id, suspicious):
+    """Count an accepted frame-less report; True if the next report must carry a frame"""
+    with _predetect_lock:
+        entry = _predetect_entry(session_id)
+        entry["since_sample"] += 1
+        wants = suspicious or entry["distrust"] > 0 or entry["since_sample"] >= entry["due"]
+        if wants and entry.get("owed") is None:
+            entry["owed"] = 0
+        return wants
+
+def predetect_verified(session_id, client_count, server_count):
+    """Record a server-checked frame (client_count None: no report came with it);
+    returns True if the next report must carry a frame too"""
+    with _predetect_lock:
+        entry = predetect_sessions.get(session_id) if client_count is None else _predetect_entry(session_id)
+        if entry is None:
+            return False
+        entry["since_sample"] = 0
+        entry["owed"] = None
+        entry["due"] = random.randint(max(1, CLIENT_SAMPLE_EVERY // 2), CLIENT_SAMPLE_EVERY * 3 // 2)
+        disputed = client_count is not None and client_count != server_count
+        if disputed:
+            entry["distrust"] = CLIENT_DISPUTE_FRAMES
+        elif entry["distrust"] > 0:
+            entry["distrust"] -= 1
+        return entry["distrust"] > 0
+
+def predetect_forget(session_id):
+    with _predetect_lock:
+        predetect_sessions.pop(session_id, None)
+
+if os.environ.get("PRELOAD_MODELS", "0") == "1":
+    # e.g. in a prefork master: load the models so workers share them copy-on-write.
+    # No inference here (OpenCV's thread pool is not fork-safe); each worker runs
+    # the warm-up inference after the fork (gunicorn.conf.py post_fork).
+    preload_models()
+if os.environ.get("WARMUP_ON_START", "1") == "1":
+    start_warmup()
 
 # ----------------- HELPERS -----------------
 def allowed_filename(filename):
@@ -666,17 +1213,109 @@ def allowed_filename(filename):
     ext = filename.rsplit(".", 1)[1].lower()
     return ext in ALLOWED_EXT
 
+# Photos are stored content-addressed as uploads/<sha256>.<ext>: the digest is
+# also the HTTP ETag, and a small JPEG thumbnail for proctor views is written
+# next to it (uploads/thumbs/<sha256>.jpg) at registration time.
+THUMB_SIZE = int(os.environ.get("THUMB_SIZE", "160"))
+PHOTO_MAX_AGE_S = int(os.environ.get("PHOTO_MAX_AGE_S", "86400"))
+_photo_digests = {}  # legacy (non content-addressed) path -> (mtime, sha256)
+
+def _write_file(path, data):
+    """Atomically write data to path through a uniquely named temp file next to it"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.stem}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def save_photo_file(file_storage, user_id):
     filename = secure_filename(file_storage.filename or f"{user_id}.jpg")
     ext = filename.rsplit(".", 1)[1].lower() if "." in filename else "jpg"
-    out_name = f"{user_id}.{ext}"
-    out_path = UPLOAD_DIR / out_name
-    file_storage.save(out_path)
+    data = file_storage.read()
+    digest = hashlib.sha256(data).hexdigest()
+    out_path = UPLOAD_DIR / f"{digest}.{ext}"
+    if not out_path.exists():
+        _write_file(out_path, data)
+    try:
+        make_thumbnail(out_path, digest)
+    except Exception as e:
+        # not fatal: the thumbnail is rebuilt on first request
+        print("Thumbnail error:", e)
     return str(out_path)
 
+def keep_photo_file(path, file_storage):
+    """Once the user row exists: rewrite the photo if a concurrent discard_photo removed it"""
+    if not os.path.exists(path):
+        file_storage.stream.seek(0)
+        _write_file(Path(path), file_storage.read())
+
+def discard_photo(path):
+    """Remove a photo saved for a failed registration, unless another user has the same file.
+    The file is first moved aside, so a registration that stores the same photo meanwhile
+    either finds it gone (and rewrites it, keep_photo_file) or gets it back here."""
+    if store.photo_in_use(path):
+        return
+    digest = photo_digest(path)
+    fd, tomb = tempfile.mkstemp(dir=Path(path).parent, prefix=".discard.", suffix=".tmp")
+    os.close(fd)
+    try:
+        os.replace(path, tomb)
+    except OSError:
+        os.remove(tomb)
+        return
+    try:
+        in_use = store.photo_in_use(path)
+    except Exception as e:
+        print("Photo discard error:", e)
+        in_use = True
+    if in_use:
+        os.replace(tomb, path)
+        return
+    for p in (tomb, THUMB_DIR / f"{digest}.jpg"):
+        try:
+            os.remove(p)
+        except Exception:
+            pass
+
+def photo_digest(path):
+    """sha256 of a stored photo: its file name, or hashed once for photos saved before content addressing"""
+    stem = Path(path).stem
+    if len(stem) == 64 and all(c in "0123456789abcdef" for c in stem):
+        return stem
+    mtime = os.path.getmtime(path)
+    cached = _photo_digests.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    _photo_digests[path] = (mtime, h.hexdigest())
+    return h.hexdigest()
+
+def make_thumbnail(photo_path, digest):
+    """Write (if missing) and return the THUMB_SIZE JPEG thumbnail of a stored photo"""
+    thumb_path = THUMB_DIR / f"{digest}.jpg"
+    if thumb_path.exists():
+        return thumb_path
+    with Image.open(photo_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=80, optimize=True)
+    _write_file(thumb_path, out.getvalue())
+    return thumb_path
+
 def compute_and_save_encoding(image_path, user_id):
     # loads image from path and computes face encoding using face_recognition
     try:
+        face_recognition = get_face_recognition()
         img = face_recognition.load_image_file(str(image_path))
         boxes = face_recognition.face_locations(img, model="hog")
         if len(boxes) == 0:
@@ -690,10 +1329,124 @@ def compute_and_save_encoding(image_path, user_id):
         out_path = ENC_DIR / f"{user_id}.pkl"
         with open(out_path, "wb") as f:
             pickle.dump({"user_id": user_id, "encoding": encoding, "timestamp": datetime.utcnow().isoformat() + "Z"}, f)
+        forget_registered_encoding(user_id)
         return str(out_path), None
     except Exception as e:
         return None, f"exception:{e}"
 
+# ----------------- IDENTITY RE-VERIFICATION -----------------
+# While a session runs, /analyze_frame hands a crop of the examinee's face to a
+# background pool every REVERIFY_INTERVAL_S seconds. The pool encodes the face at
+# its known box (no face search) and compares it with the registered encoding,
+# logging IDENTITY_MISMATCH on failure. The per-node budget is REVERIFY_WORKERS
+# threads and REVERIFY_QUEUE_MAX pending samples; when the queue is full the
+# sample is skipped and the session stays due, so load is shed, never queued.
+REVERIFY_INTERVAL_S = float(os.environ.get("REVERIFY_INTERVAL_S", "60"))  # 0 disables
+REVERIFY_WORKERS = int(os.environ.get("REVERIFY_WORKERS", "1"))
+REVERIFY_QUEUE_MAX = int(os.environ.get("REVERIFY_QUEUE_MAX", "16"))
+REVERIFY_TOLERANCE = float(os.environ.get("REVERIFY_TOLERANCE", "0.55"))
+ENCODING_CACHE_SIZE = int(os.environ.get("ENCODING_CACHE_SIZE", "4096"))
+
+_encoding_cache = OrderedDict()  # user_id -> registered encoding, least recently used first
+_encoding_lock = threading.Lock()
+reverify_last = {}  # session_id -> wall-clock time the session was last sampled (compared across workers)
+_reverify_lock = threading.Lock()
+session_state.bind("reverify", reverify_last, _reverify_lock)
+_reverify_queue = queue.Queue(maxsize=REVERIFY_QUEUE_MAX)
+_reverify_pid = None
+
+def load_registered_encoding(user_id):
+    """Registered face encoding for a user (LRU-cached), or None"""
+    with _encoding_lock:
+        if user_id in _encoding_cache:
+            _encoding_cache.move_to_end(user_id)
+            return _encoding_cache[user_id]
+    enc_path = ENC_DIR / f"{user_id}.pkl"
+    if not enc_path.exists():
+        return None
+    with open(enc_path, "rb") as f:
+        encoding = pickle.load(f).get("encoding")
+    if encoding is not None:
+        with _encoding_lock:
+            _encoding_cache[user_id] = encoding
+            while len(_encoding_cache) > ENCODING_CACHE_SIZE:
+                _encoding_cache.popitem(last=False)
+    return encoding
+
+def forget_registered_encoding(user_id):
+    with _encoding_lock:
+        _encoding_cache.pop(user_id, None)
+
+def _start_reverify_workers():
+    """Start the pool once per process (threads do not survive a fork)"""
+    global _reverify_pid
+    if _reverify_pid == os.getpid():
+        return
+    _reverify_pid = os.getpid()
+    for i in range(max(1, REVERIFY_WORKERS)):
+        threading.Thread(target=_reverify_worker, name=f"reverify-{i}", daemon=True).start()
+
+def sample_for_reverify(session_id, frame, box):
+    """Queue the examinee's face if the session is due; never blocks the request"""
+    if REVERIFY_INTERVAL_S <= 0:
+        return False
+    now = time.time()
+    with _reverify_lock:
+        last = reverify_last.get(session_id)
+        if last is not None and now - last < REVERIFY_INTERVAL_S:
+            return False
+        _start_reverify_workers()
+    x, y, w, h = box
+    fh, fw = frame.shape[:2]
+    x0, y0 = max(0, x - w // 4), max(0, y - h // 4)
+    x1, y1 = min(fw, x + w + w // 4), min(fh, y + h + h // 4)
+    crop = frame[y0:y1, x0:x1].copy()
+    location = (y - y0, x - x0 + w, y - y0 + h, x - x0)  # face_recognition order: top, right, bottom, left
+    try:
+        _reverify_queue.put_nowait((session_id, crop, location))
+    except queue.Full:
+        REVERIFY_TOTAL.inc(outcome="skipped")
+        return False
+    with _reverify_lock:
+        # jitter keeps sessions that started together from staying in lockstep
+        reverify_last[session_id] = now + random.uniform(-0.1, 0.1) * REVERIFY_INTERVAL_S
+    return True
+
+def reverify_forget(session_id):
+    with _reverify_lock:
+        reverify_last.pop(session_id, None)
+
+def reverify_face(session_id, crop, location):
+    """Compare one sampled face with the session owner's registered encoding; returns the outcome"""
+    user_id = store.get_session_owner(session_id)
+    if user_id is None:
+        return "no_session"
+    registered = load_registered_encoding(user_id)
+    if registered is None:
+        return "no_encoding"
+    face_recognition = get_face_recognition()
+    rgb = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+    encodings = face_recognition.face_encodings(rgb, [location])
+    if not encodings:
+        return "no_face"
+    distance = float(face_recognition.face_distance([registered], encodings[0])[0])
+    if distance <= REVERIFY_TOLERANCE:
+        return "match"
+    log_violation(session_id, "IDENTITY_MISMATCH",
+                  f"Face does not match the registered photo (distance {distance:.2f})", "high")
+    return "mismatch"
+
+def _reverify_worker():
+    while True:
+        session_id, crop, location = _reverify_queue.get()
+        try:
+            with REVERIFY_SECONDS.time():
+                outcome = reverify_face(session_id, crop, location)
+            REVERIFY_TOTAL.inc(outcome=outcome)
+        except Exception as e:
+            REVERIFY_TOTAL.inc(outcome="error")
+            print("Re-verification error:", e)
+
 def make_jwt(payload: dict):
     exp = datetime.utcnow() + timedelta(days=JWT_EXP_DAYS)
     payload_copy = dict(payload)
@@ -708,11 +1461,36 @@ def decode_jwt(token):
     return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
 
 # ----------------- AUTH HELPERS -----------------
-def get_user_id_from_auth_header():
+# Verified bearer tokens are cached per process until their exp or
+# AUTH_CACHE_TTL_S, whichever comes first, so the JWT HMAC check and the
+# revocation lookup run once per token per TTL rather than on every request.
+# A revocation takes effect at once in the worker that handled it and within
+# AUTH_CACHE_TTL_S in the others. User profiles are cached the same way.
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_S = float(os.environ.get("AUTH_CACHE_TTL_S", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL_S = float(os.environ.get("USER_CACHE_TTL_S", "300"))
+
+token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_S)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_S)
+
+def bearer_token():
     auth = request.headers.get("Authorization", "") or request.headers.get("authorization", "")
     if not auth or not auth.startswith("Bearer "):
+        return None
+    return auth.split(" ", 1)[1].strip()
+
+def token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def get_user_id_from_auth_header():
+    """(user_id, None) or (None, error)"""
+    token = bearer_token()
+    if not token:
         return None, "Missing or invalid Authorization header"
-    token = auth.split(" ", 1)[1].strip()
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id, None
     try:
         payload = decode_jwt(token)
     except jwt.ExpiredSignatureError:
@@ -722,8 +1500,312 @@ def get_user_id_from_auth_header():
     user_id = payload.get("sub") or payload.get("user_id") or payload.get("uid")
     if not user_id:
         return None, "Token missing subject (sub)"
+    if store.is_token_revoked(token_hash(token)):
+        return None, "Token revoked"
+    expires_at = None
+    if payload.get("exp") is not None:
+        expires_at = time.monotonic() + (float(payload["exp"]) - time.time())
+    token_cache.set(token, user_id, expires_at=expires_at)
     return user_id, None
 
+def revoke_token(token, exp):
+    """Reject token from now on (exp: unix seconds when it would lapse anyway)"""
+    store.revoke_token(token_hash(token), float(exp))
+    token_cache.pop(token)
+
+def get_user_cached(user_id):
+    """store.get_user() behind the profile cache; callers must not modify the row"""
+    row = user_cache.get(user_id)
+    if row is None:
+        row = store.get_user(user_id)
+        if row:
+            user_cache.set(user_id, row)
+    return row
+
+def invalidate_user(user_id):
+    user_cache.pop(user_id)
+
+# ----------------- PROCTOR TOKENS -----------------
+# /api/session/start hands out a per-session token for the high-rate proctoring
+# endpoints (/analyze_frame, /voice_event), sent as X-Proctor-Token. It is
+# "<session_id>.<exp>.<mac>" with a 128-bit HMAC-SHA256 over "<session_id>.<exp>",
+# so checking it is one HMAC, no JWT decode and, most of the time, no database
+# access: whether the session is still active is cached for
+# PROCTOR_ACTIVE_CACHE_S. end_session clears it in its own process; other
+# workers stop accepting the token within that many seconds.
+# POST /api/session/<id>/proctor-token renews the token of an active session.
+PROCTOR_TOKEN_TTL_S = int(os.environ.get("PROCTOR_TOKEN_TTL_S", str(6 * 3600)))
+PROCTOR_TOKEN_REQUIRED = os.environ.get("PROCTOR_TOKEN_REQUIRED", "1") == "1"
+PROCTOR_ACTIVE_CACHE_S = float(os.environ.get("PROCTOR_ACTIVE_CACHE_S", "10"))
+# derived key: a proctor token can never be passed off as a JWT signature or vice versa
+_PROCTOR_KEY = hmac.new(JWT_SECRET.encode("utf-8"), b"proctor-token", hashlib.sha256).digest()
+
+def _proctor_mac(message):
+    digest = hmac.new(_PROCTOR_KEY, message.encode("ascii"), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+def make_proctor_token(session_id, ttl=PROCTOR_TOKEN_TTL_S):
+    message = f"{int(session_id)}.{int(time.time()) + ttl}"
+    return f"{message}.{_proctor_mac(message)}"
+
+def _verify_proctor_token(token):
+    """(session_id, None) if token is valid for an active session, else (None, error)"""
+    parts = token.split(".")
+    if len(parts) != 3 or not parts[0].isdigit() or not parts[1].isdigit():
+        return None, "Invalid proctor token"
+    sid, exp, mac = parts
+    if not hmac.compare_digest(mac, _proctor_mac(f"{sid}.{exp}")):
+        return None, "Invalid proctor token"
+    if int(exp) < time.time():
+        return None, "Proctor token expired"
+    if not proctor_session_active(int(sid)):
+        return None, "Session is not active"
+    return int(sid), None
+
+def proctor_token_session():
+    """_verify_proctor_token for this request's X-Proctor-Token, checked once per request
+    (the rate limiter and the handler both need it); (None, None) without a token"""
+    if "proctor_token" not in g:
+        token = request.headers.get("X-Proctor-Token", "")
+        g.proctor_token = _verify_proctor_token(token) if token else (None, None)
+    return g.proctor_token
+
+def check_proctor_token(session_id):
+    """Returns an error message unless X-Proctor-Token is valid for session_id (an int)"""
+    sid, err = proctor_token_session()
+    if err:
+        return err
+    if sid is None:
+        return "Proctor token required" if PROCTOR_TOKEN_REQUIRED else None
+    if sid != session_id:
+        return "Proctor token does not match session"
+    return None
+
+def parse_session_id(value):
+    """session_id from a request body as an int (clients send numbers or strings), or None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        session_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return session_id if session_id > 0 else None
+
+proctor_sessions = TTLCache(100000, PROCTOR_ACTIVE_CACHE_S)  # session_id -> whether it is active
+
+def proctor_session_active(session_id):
+    active = proctor_sessions.get(session_id)
+    if active is None:
+        active = store.get_session_owner(session_id) is not None
+        proctor_sessions.set(session_id, active)
+    return active
+
+def check_admin_token():
+    """Returns an error message unless the request carries the ADMIN_TOKEN secret"""
+    if not ADMIN_TOKEN:
+        return "Admin endpoints are disabled (ADMIN_TOKEN not set)"
+    supplied = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(supplied.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return "Invalid admin token"
+    return None
+
+# ----------------- PASSWORD HASHING -----------------
+# PBKDF2 runs on a dedicated pool of PASSWORD_WORKERS threads (hashlib releases
+# the GIL), so a login storm can occupy at most that many cores and proctoring
+# requests keep the rest. At most PASSWORD_QUEUE_MAX tasks wait behind them;
+# beyond that, or after PASSWORD_WAIT_S, the login is answered 503 + Retry-After.
+# New hashes use PASSWORD_HASH_METHOD, or werkzeug's default when it is unset.
+# A stored hash weaker than that (older algorithm, or the same one at a lower
+# cost) is upgraded after a successful login when the pool has spare capacity;
+# a stronger one is kept, so lowering the setting never downgrades accounts.
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 4))))
+PASSWORD_QUEUE_MAX = int(os.environ.get("PASSWORD_QUEUE_MAX", "64"))
+PASSWORD_WAIT_S = float(os.environ.get("PASSWORD_WAIT_S", "10"))
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD") or None  # None: werkzeug's default
+# fixed-window throttles: failed logins per account and client IP, login attempts
+# per client IP (generous, because a whole campus may sit behind one NAT address).
+# Failures are counted per (email, IP) rather than per email: a hard per-account
+# lockout would let anyone lock an examinee out mid-exam just by knowing their
+# email. The cost is that guessing one account from many addresses is only
+# slowed by the per-IP limit.
+LOGIN_ACCOUNT_MAX_FAILURES = int(os.environ.get("LOGIN_ACCOUNT_MAX_FAILURES", "5"))
+LOGIN_ACCOUNT_WINDOW_S = float(os.environ.get("LOGIN_ACCOUNT_WINDOW_S", "900"))
+LOGIN_IP_MAX_ATTEMPTS = int(os.environ.get("LOGIN_IP_MAX_ATTEMPTS", "300"))
+LOGIN_IP_WINDOW_S = float(os.environ.get("LOGIN_IP_WINDOW_S", "60"))
+
+login_failures = session_state.counter("login_failures", LOGIN_ACCOUNT_WINDOW_S)
+login_attempts = session_state.counter("login_attempts", LOGIN_IP_WINDOW_S)
+
+class PasswordPoolBusy(Exception):
+    pass
+
+_password_pool = None
+_password_pool_pid = None
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(max(1, PASSWORD_WORKERS) + PASSWORD_QUEUE_MAX)
+
+def _password_executor():
+    """Pool for this process (created lazily so forked workers get their own threads)"""
+    global _password_pool, _password_pool_pid
+    with _password_pool_lock:
+        if _password_pool_pid != os.getpid():
+            _password_pool = ThreadPoolExecutor(max_workers=max(1, PASSWORD_WORKERS), thread_name_prefix="password")
+            _password_pool_pid = os.getpid()
+        return _password_pool
+
+def run_password_task(op, fn, *args, wait=True):
+    """Run fn(*args) on the password pool; returns its result (or the future if wait=False)"""
+    if not _password_slots.acquire(blocking=False):
+        LOGIN_REJECTED_TOTAL.inc(reason="pool_full")
+        raise PasswordPoolBusy()
+
+    def task():
+        with PASSWORD_HASH_SECONDS.time(op=op):
+            return fn(*args)
+
+    def done(_):
+        PASSWORD_PENDING.dec()
+        _password_slots.release()
+
+    PASSWORD_PENDING.inc()
+    future = _password_executor().submit(task)
+    future.add_done_callback(done)
+    if not wait:
+        return future
+    try:
+        return future.result(timeout=PASSWORD_WAIT_S)
+    except FutureTimeout:
+        LOGIN_REJECTED_TOTAL.inc(reason="timeout")
+        raise PasswordPoolBusy()
+
+def _generate_password_hash(password):
+    if PASSWORD_HASH_METHOD:
+        return generate_password_hash(password, PASSWORD_HASH_METHOD)
+    return generate_password_hash(password)
+
+def hash_password(password):
+    return run_password_task("hash", _generate_password_hash, password)
+
+def password_hash_strength(password_hash):
+    """(algorithm rank, cost) of a werkzeug hash: scrypt > pbkdf2 > anything older;
+    cost is pbkdf2 iterations or scrypt n*r*p (None if the hash does not say)"""
+    method = password_hash.split("$", 1)[0].split(":")
+    try:
+        if method[0] == "scrypt":
+            n, r, p = (int(v) for v in method[1:4]) if len(method) >= 4 else (None, None, None)
+            return 2, n * r * p if n else None
+        if method[0] == "pbkdf2":
+            if len(method) > 1 and method[1] in ("md5", "sha1"):
+                return 0, None
+            return 1, int(method[2]) if len(method) > 2 else None
+    except ValueError:
+        pass
+    return 0, None
+
+_password_target = None  # strength of the hashes hash_password makes, measured once
+
+def password_hash_outdated(password_hash):
+    """True if the stored hash is weaker than what hash_password would make now"""
+    global _password_target
+    if _password_target is None:
+        _password_target = password_hash_strength(_generate_password_hash(""))
+    rank, cost = password_hash_strength(password_hash)
+    if rank != _password_target[0]:
+        return rank < _password_target[0]
+    return cost is not None and _password_target[1] is not None and cost < _password_target[1]
+
+def rehash_in_background(user_id, password):
+    """Upgrade a weaker stored hash, only if the pool is mostly idle"""
+    if PASSWORD_PENDING.value() >= max(1, PASSWORD_WORKERS):
+        return
+    def rehash():
+        store.update_password_hash(user_id, _generate_password_hash(password))
+    try:
+        run_password_task("rehash", rehash, wait=False)
+    except PasswordPoolBusy:
+        pass
+
+def login_failure_key(email, ip):
+    return f"{email}|{ip}"
+
+def login_throttle(email, ip):
+    """Seconds to wait before another attempt is allowed, or 0"""
+    attempts, left = login_attempts.incr(ip)
+    if attempts > LOGIN_IP_MAX_ATTEMPTS:
+        LOGIN_REJECTED_TOTAL.inc(reason="ip_throttled")
+        return left
+    failures, left = login_failures.peek(login_failure_key(email, ip))
+    if failures is not None and failures >= LOGIN_ACCOUNT_MAX_FAILURES:
+        LOGIN_REJECTED_TOTAL.inc(reason="account_throttled")
+        return left
+    return 0
+
+def busy_response(message, retry_after):
+    resp = jsonify({"success": False, "message": message})
+    resp.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+# ----------------- RATE LIMITING -----------------
+# Token buckets per route (ratelimit.py), checked before the handler runs so a
+# flooding client costs a dict lookup instead of a detector run or a DB write.
+# Proctoring routes are limited per session (from a valid X-Proctor-Token),
+# authenticated routes per user; requests without valid credentials fall back
+# to a bucket per client IP. Override a route with RATE_LIMIT_<ENDPOINT>, e.g.
+# RATE_LIMIT_ANALYZE_FRAME=20/s:40 or =off. Limits apply per worker process.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_CAPACITY = int(os.environ.get("RATE_LIMIT_CAPACITY", "65536"))  # buckets per route
+RATE_LIMIT_DEFAULTS = {
+    # endpoint: (key, "<requests>/<period>[:<burst>]")
+    "analyze_frame": ("session", "10/s:20"),
+    "voice_event": ("session", "10/s:20"),
+    "api_verify": ("user", "12/m:6"),
+    "api_register": ("ip", "10/m:10"),
+}
+
+def _rate_limits_from_env():
+    limits = {}
+    for endpoint, (key, default) in RATE_LIMIT_DEFAULTS.items():
+        name = f"RATE_LIMIT_{endpoint.upper()}"
+        try:
+            limit = parse_limit(os.environ.get(name, default))
+        except ValueError as e:
+            # a typo must not keep every worker from booting
+            print(f"WARNING: {name}: {e}; using the default {default}")
+            limit = parse_limit(default)
+        if limit is not None:
+            limits[endpoint] = (key, TokenBucketLimiter(*limit, capacity=RATE_LIMIT_CAPACITY))
+    return limits
+
+rate_limits = _rate_limits_from_env() if RATE_LIMIT_ENABLED else {}  # endpoint -> (key, limiter)
+
+def rate_limit_key(key):
+    """(kind, bucket key) for the current request; kind is what the bucket is actually keyed by"""
+    if key == "session":
+        sid, err = proctor_token_session()
+        if sid is not None:
+            return "session", f"s:{sid}"
+    elif key == "user":
+        user_id, err = get_user_id_from_auth_header()
+        if not err:
+            return "user", f"u:{user_id}"
+    return "ip", "ip:" + (request.remote_addr or "unknown")
+
+@app.before_request
+def enforce_rate_limits():
+    limit = rate_limits.get(request.endpoint)
+    if limit is None:
+        return None
+    kind, bucket = rate_limit_key(limit[0])
+    wait = limit[1].take(bucket)
+    if not wait:
+        return None
+    RATE_LIMITED_TOTAL.inc(route=request.endpoint, key=kind)
+    if request.endpoint == "analyze_frame":
+        return shed_frame("rate_limited", 429, "too many frames, slow down", max(1, math.ceil(wait)))
+    resp = busy_response("Too many requests, retry later", wait)
+    resp.status_code = 429
+    return resp
+
 # ----------------- STATIC PAGE ROUTES -----------------
 @app.route("/")
 def index():
@@ -770,34 +1852,10 @@ def api_tests():
     # Get domain filter from query parameter
     domain_filter = request.args.get("domain", "").strip().lower()
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
-    # Build query based on domain filter
-    if domain_filter:
-        cur.execute("""
-            SELECT exam_id as id, exam_title as title, description, domain, difficulty, duration, total_questions
-            FROM exams
-            WHERE is_active = 1 AND LOWER(domain) = ?
-            ORDER BY exam_id
-        """, (domain_filter,))
-    else:
-        cur.execute("""
-            SELECT exam_id as id, exam_title as title, description, domain, difficulty, duration, total_questions
-            FROM exams
-            WHERE is_active = 1
-            ORDER BY exam_id
-        """)
-    
-    rows = cur.fetchall()
-    tests = [dict(row) for row in rows]
+    tests = store.list_exams(domain_filter or None)
     
     # Get unique domains for filter options
-    cur.execute("SELECT DISTINCT domain FROM exams WHERE is_active = 1 ORDER BY domain")
-    domain_rows = cur.fetchall()
-    domains = [row["domain"] for row in domain_rows]
-    
-    conn.close()
+    domains = store.list_domains()
 
     return jsonify({
         "success": True,
@@ -819,25 +1877,13 @@ def get_exam_questions(exam_id):
     if err:
         return jsonify({"success": False, "message": err}), 401
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
     # Verify exam exists and is active
-    cur.execute("SELECT exam_id, exam_title, duration FROM exams WHERE exam_id = ? AND is_active = 1", (exam_id,))
-    exam = cur.fetchone()
+    exam = store.get_active_exam(exam_id)
     if not exam:
-        conn.close()
         return jsonify({"success": False, "message": "Exam not found or inactive"}), 404
     
     # Get questions for this exam
-    cur.execute("""
-        SELECT question_id, question, options, correct_answer, question_order
-        FROM exam_questions
-        WHERE exam_id = ?
-        ORDER BY question_order
-    """, (exam_id,))
-    
-    rows = cur.fetchall()
+    rows = store.get_questions(exam_id)
     questions = []
     for row in rows:
         options = json.loads(row["options"]) if row["options"] else []
@@ -849,8 +1895,6 @@ def get_exam_questions(exam_id):
             "question_order": row["question_order"]
         })
     
-    conn.close()
-    
     return jsonify({
         "success": True,
         "exam_id": exam_id,
@@ -874,49 +1918,215 @@ def start_session():
     if not exam_id:
         return jsonify({"success": False, "message": "exam_id is required."}), 400
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
     # Verify exam exists
-    cur.execute("SELECT exam_id FROM exams WHERE exam_id = ? AND is_active = 1", (exam_id,))
-    if not cur.fetchone():
-        conn.close()
+    if not store.get_active_exam(exam_id):
         return jsonify({"success": False, "message": "Exam not found or inactive"}), 404
     
     # Check if user has an active session for this exam
-    cur.execute("""
-        SELECT session_id FROM sessions
-        WHERE user_id = ? AND exam_id = ? AND status = 'active'
-    """, (user_id, exam_id))
-    existing = cur.fetchone()
+    existing = store.find_active_session(user_id, exam_id)
     if existing:
-        conn.close()
         return jsonify({
             "success": True,
             "session_id": existing["session_id"],
+            "proctor_token": make_proctor_token(existing["session_id"]),
             "message": "Active session already exists"
         })
     
     # Create new session
     start_time = datetime.utcnow().isoformat() + "Z"
-    created_at = start_time
-    
-    cur.execute("""
-        INSERT INTO sessions (user_id, exam_id, start_time, status, created_at)
-        VALUES (?, ?, ?, 'active', ?)
-    """, (user_id, exam_id, start_time, created_at))
-    
-    session_id = cur.lastrowid
-    conn.commit()
-    conn.close()
+    session_id = store.create_session(user_id, exam_id, start_time)
     
     return jsonify({
         "success": True,
         "session_id": session_id,
+        "proctor_token": make_proctor_token(session_id),
         "start_time": start_time,
         "message": "Session started successfully"
     })
 
+@app.route("/api/session/<int:session_id>/proctor-token", methods=["POST"])
+def renew_proctor_token(session_id):
+    """A new proctor token for the caller's active session; never starts one"""
+    user_id, err = get_user_id_from_auth_header()
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    if not store.get_active_session(session_id, user_id):
+        return jsonify({"success": False, "message": "Active session not found"}), 404
+    proctor_sessions.set(session_id, True)
+    return jsonify({"success": True, "session_id": session_id, "proctor_token": make_proctor_token(session_id)})
+
+# ----------------- ANSWER AUTOSAVE -----------------
+# Answers are autosaved as small deltas while the exam runs. Deltas are merged
+# per session in memory and written by one flusher thread per process every
+# AUTOSAVE_FLUSH_S seconds, all sessions in one transaction, or sooner when
+# AUTOSAVE_MAX_PENDING sessions are waiting. end_session then only has to add
+# its own last changes and grade what is stored.
+# Each change carries the client's sequence number for it ("seqs", a
+# millisecond clock; the server's clock for clients that send none), stored
+# per question next to the answers: the change with the highest number wins,
+# whichever worker flushes it last. Answers submitted with end_session win
+# over everything.
+# end_session merges the changes still pending in its own worker. Changes still
+# pending in another worker when the exam is submitted are discarded at that
+# worker's next flush (the session is no longer active) and counted in
+# proctor_autosave_discarded_total. The exam page submits every selected
+# answer with end_session, so only changes made in another tab can be lost.
+AUTOSAVE_FLUSH_S = float(os.environ.get("AUTOSAVE_FLUSH_S", "5"))
+AUTOSAVE_MAX_PENDING = int(os.environ.get("AUTOSAVE_MAX_PENDING", "500"))
+
+exam_layouts = TTLCache(256, 60)        # exam_id -> ([question_id in stored order], key int8 array)
+session_owners = TTLCache(100000, 60)   # session_id -> (user_id, exam_id) of an active session
+_autosave_pending = {}                  # session_id -> (exam_id, width, {position: (value, seq)})
+_autosave_lock = threading.Lock()
+_autosave_wake = threading.Event()
+_autosave_pid = None
+
+def exam_layout(exam_id):
+    layout = exam_layouts.get(exam_id)
+    if layout is None:
+        answer_key = store.get_ordered_answer_key(exam_id)
+        layout = ([qid for qid, _ in answer_key], np.array([c for _, c in answer_key], dtype=np.int8))
+        exam_layouts.set(exam_id, layout)
+    return layout
+
+def active_session_exam(session_id, user_id):
+    """exam_id of the user's active session, or None"""
+    owner = session_owners.get(session_id)
+    if owner is None:
+        session = store.get_active_session(session_id, user_id)
+        if not session:
+            return None
+        owner = (user_id, session["exam_id"])
+        session_owners.set(session_id, owner)
+    return owner[1] if owner[0] == user_id else None
+
+def _merge_delta(blob, stamps, delta):
+    width, changes = delta
+    return grading.apply_stamped_delta(blob, stamps, width, changes)
+
+def _merge_changes(into, changes):
+    """Merge {position: (value, seq)} into `into`, keeping the higher seq per position"""
+    for i, change in changes.items():
+        current = into.get(i)
+        if current is None or change[1] >= current[1]:
+            into[i] = change
+    return into
+
+def answer_seqs(seqs, question_ids):
+    """{question_id: seq} from a client -> {position: seq}; unknown questions and bad numbers are skipped"""
+    position = {qid: i for i, qid in enumerate(question_ids)}
+    out = {}
+    for qid, seq in (seqs if isinstance(seqs, dict) else {}).items():
+        try:
+            i, seq = position.get(int(qid)), float(seq)
+        except (TypeError, ValueError):
+            continue
+        if i is not None and math.isfinite(seq):
+            out[i] = seq
+    return out
+
+def queue_answer_delta(session_id, exam_id, width, changes):
+    with _autosave_lock:
+        entry = _autosave_pending.get(session_id)
+        if entry is None:
+            _autosave_pending[session_id] = (exam_id, width, dict(changes))
+        else:
+            _merge_changes(entry[2], changes)
+        crowded = len(_autosave_pending) >= AUTOSAVE_MAX_PENDING
+        _start_autosave_flusher()
+    if crowded:
+        _autosave_wake.set()
+
+def take_answer_delta(session_id):
+    """Remove and return this process's unsaved changes of a session ({} if none)"""
+    with _autosave_lock:
+        entry = _autosave_pending.pop(session_id, None)
+    return entry[2] if entry else {}
+
+def flush_autosaves():
+    """Write every pending delta in one transaction; failed batches are put back"""
+    global _autosave_pending
+    with _autosave_lock:
+        batch, _autosave_pending = _autosave_pending, {}
+    if not batch:
+        return 0
+    try:
+        with AUTOSAVE_FLUSH_SECONDS.time():
+            merged = store.merge_answers(
+                [(sid, exam_id, (width, changes)) for sid, (exam_id, width, changes) in batch.items()],
+                _merge_delta, datetime.utcnow().isoformat() + "Z")
+    except Exception as e:
+        print(f"Error flushing autosaved answers: {e}")
+        with _autosave_lock:
+            for sid, (exam_id, width, changes) in batch.items():
+                newer = _autosave_pending.get(sid)
+                if newer is not None:
+                    _merge_changes(changes, newer[2])
+                _autosave_pending[sid] = (exam_id, width, changes)
+        return 0
+    discarded = sum(len(changes) for sid, (_, _, changes) in batch.items() if sid not in merged)
+    if discarded:
+        AUTOSAVE_DISCARDED_TOTAL.inc(discarded)
+    return len(merged)
+
+def _autosave_flusher():
+    while True:
+        _autosave_wake.wait(AUTOSAVE_FLUSH_S)
+        _autosave_wake.clear()
+        flush_autosaves()
+
+def _start_autosave_flusher():
+    """Start the flusher once per process (threads do not survive a fork)"""
+    global _autosave_pid
+    if _autosave_pid == os.getpid():
+        return
+    _autosave_pid = os.getpid()
+    threading.Thread(target=_autosave_flusher, name="autosave-flusher", daemon=True).start()
+
+atexit.register(flush_autosaves)
+
+@app.route("/api/session/autosave", methods=["POST"])
+def autosave_answers():
+    """Accept answer changes {question_id: option or null} for an active session; written in the background"""
+    user_id, err = get_user_id_from_auth_header()
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    data = request.get_json(force=True, silent=True)
+    if not data or not isinstance(data.get("answers"), dict):
+        return jsonify({"success": False, "message": "Expected JSON body with answers."}), 400
+    session_id = parse_session_id(data.get("session_id"))
+    if not session_id:
+        return jsonify({"success": False, "message": "session_id is required."}), 400
+
+    exam_id = active_session_exam(session_id, user_id)
+    if exam_id is None:
+        return jsonify({"success": False, "message": "Active session not found"}), 404
+    question_ids, _ = exam_layout(exam_id)
+    seqs, now = answer_seqs(data.get("seqs"), question_ids), time.time() * 1000.0
+    changes = {i: (value, seqs.get(i, now))
+               for i, value in grading.answer_positions(data["answers"], question_ids, allow_clear=True).items()}
+    if changes:
+        queue_answer_delta(session_id, exam_id, len(question_ids), changes)
+        AUTOSAVE_DELTAS_TOTAL.inc(len(changes))
+    return jsonify({"success": True, "accepted": len(changes), "ignored": len(data["answers"]) - len(changes)})
+
+@app.route("/api/session/<int:session_id>/answers", methods=["GET"])
+def get_session_answers(session_id):
+    """Saved answers of an active session as {question_id: option}, to restore the exam page"""
+    user_id, err = get_user_id_from_auth_header()
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    exam_id = active_session_exam(session_id, user_id)
+    if exam_id is None:
+        return jsonify({"success": False, "message": "Active session not found"}), 404
+    question_ids, _ = exam_layout(exam_id)
+    with _autosave_lock:
+        entry = _autosave_pending.get(session_id)
+        pending = {i: value for i, (value, _) in entry[2].items()} if entry else {}
+    packed = grading.decode_answers(grading.apply_delta(store.get_answers(session_id), len(question_ids), pending))
+    answers = {str(qid): int(v) for qid, v in zip(question_ids, packed.tolist()) if v != grading.UNANSWERED}
+    return jsonify({"success": True, "session_id": session_id, "answers": answers})
+
 # ----------------- API: END EXAM SESSION AND CREATE REPORT -----------------
 @app.route("/api/session/end", methods=["POST"])
 def end_session():
@@ -928,69 +2138,57 @@ def end_session():
     if not data:
         return jsonify({"success": False, "message": "Expected JSON body."}), 400
     
-    session_id = data.get("session_id")
+    session_id = parse_session_id(data.get("session_id"))
     answers = data.get("answers", {})  # {question_id: selected_answer_index}
     
     if not session_id:
         return jsonify({"success": False, "message": "session_id is required."}), 400
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
     # Get session details
-    cur.execute("""
-        SELECT session_id, user_id, exam_id, start_time
-        FROM sessions
-        WHERE session_id = ? AND user_id = ? AND status = 'active'
-    """, (session_id, user_id))
-    session = cur.fetchone()
+    session = store.get_active_session(session_id, user_id)
     
     if not session:
-        conn.close()
         return jsonify({"success": False, "message": "Active session not found"}), 404
     
     exam_id = session["exam_id"]
     end_time = datetime.utcnow().isoformat() + "Z"
     
-    # Get correct answers for this exam
-    cur.execute("""
-        SELECT question_id, correct_answer
-        FROM exam_questions
-        WHERE exam_id = ?
-    """, (exam_id,))
-    
-    correct_answers = {row["question_id"]: row["correct_answer"] for row in cur.fetchall()}
-    
-    # Calculate score
-    total_questions = len(correct_answers)
-    correct_count = 0
+    # Get correct answers for this exam, in the order answers are stored
+    question_ids, key = exam_layout(exam_id)
+    total_questions = len(question_ids)
+    
+    # Final answers: what autosave stored, plus unsaved changes and the submitted answers
+    changes = take_answer_delta(session_id)
+    changes.update((i, (value, math.inf)) for i, value in grading.answer_positions(answers, question_ids).items())
+    if changes:
+        merged = store.merge_answers([(session_id, exam_id, (total_questions, changes))], _merge_delta, end_time)
+        packed = merged.get(session_id)
+        if packed is None:
+            return jsonify({"success": False, "message": "Active session not found"}), 404
+    else:
+        packed = grading.apply_delta(store.get_answers(session_id), total_questions, {})
     
-    for question_id, user_answer in answers.items():
-        question_id = int(question_id)
-        if question_id in correct_answers:
-            if user_answer == correct_answers[question_id]:
-                correct_count += 1
+    # Calculate score; the packed answers are kept for regrading (grading.py)
+    correct_count = int(grading.score(key, grading.answers_matrix([packed], total_questions))[0])
     
     marks = float(correct_count)
     percentage = (marks / total_questions * 100) if total_questions > 0 else 0.0
     
-    # Update session
-    cur.execute("""
-        UPDATE sessions
-        SET end_time = ?, status = 'completed'
-        WHERE session_id = ?
-    """, (end_time, session_id))
-    
-    # Create report
-    submitted_at = end_time
-    cur.execute("""
-        INSERT INTO reports (session_id, user_id, exam_id, total_questions, correct_answers, marks, percentage, submitted_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (session_id, user_id, exam_id, total_questions, correct_count, marks, percentage, submitted_at))
-    
-    report_id = cur.lastrowid
-    conn.commit()
-    conn.close()
+    # Update session, store answers and create report
+    report_id = store.complete_session(session_id, user_id, exam_id, end_time,
+                                       total_questions, correct_count, marks, percentage, packed)
+    predetect_forget(session_id)
+    roi_forget(session_id)
+    reverify_forget(session_id)
+    try:
+        session_state.forget(session_id)
+    except Exception as e:
+        print("session state forget error:", e)
+    evidence_store.forget(session_id)
+    timeline.close(session_id)
+    session_owners.pop(session_id)
+    proctor_sessions.set(session_id, False)
+    publish_session_ended(session_id, report_id)
     
     return jsonify({
         "success": True,
@@ -1007,68 +2205,173 @@ def end_session():
 @app.route("/analyze_frame", methods=["POST"])
 def analyze_frame():
     """Analyze video frame for proctoring violations"""
-    data = request.get_json()
-    if not data or "image" not in data:
+    with tracer.span("parse_json"):
+        data = request.get_json()
+    if not data or ("image" not in data and "client" not in data):
         return jsonify({"error": "no image"}), 400
     
-    session_id = data.get("session_id")
+    # one key for every per-session structure (ROI, pre-detection, admission, ...)
+    session_id = parse_session_id(data.get("session_id"))
     if not session_id:
         return jsonify({"error": "session_id required"}), 400
+    err = check_proctor_token(session_id)
+    if err:
+        return jsonify({"error": err}), 401
+
+    client = None
+    if CLIENT_PREDETECT and "client" in data:
+        client = parse_client_report(data["client"])
+        if client is None:
+            return jsonify({"error": "invalid client report"}), 400
+        PREDETECT_REPORTS_TOTAL.inc(frame="yes" if "image" in data else "no")
+        tracer.annotate("predetect", True)
+    if "image" not in data:
+        if client is None:
+            return jsonify({"error": "no image"}), 400
+        load_session_state(session_id)
+        try:
+            return client_report_response(session_id, *client)
+        finally:
+            save_session_state(session_id)
     
+    retry_after = frame_gate.retry_after(max(analyze_latency_ewma_ms, ANALYZE_TARGET_MS) / 1000.0)
+    try:
+        with tracer.span("admission"), ANALYZE_STAGE_SECONDS.time(stage="queue"):
+            outcome = frame_gate.acquire(session_id, retry_after)
+    except QueueFull:
+        return shed_frame("queue_full", 429, "server busy, retry later", retry_after)
+    if outcome != ADMITTED:
+        if outcome == SUPERSEDED:
+            return shed_frame("superseded", 409, "superseded by a newer frame")
+        return shed_frame("expired", 503, "frame waited too long", retry_after)
+
+    started = time.perf_counter()
+    # loaded after admission: the previous frame of this session has been saved by then
+    load_session_state(session_id)
     try:
-        frame = b64_to_image(data["image"])
-        faces, landmarks = detect_faces_stable(frame)
-        head_pose = None
+        with tracer.span("decode"), ANALYZE_STAGE_SECONDS.time(stage="decode"):
+            binary = b64_to_bytes(data["image"])
+            frame = bytes_to_image(binary)
+        with tracer.span("detect") as span, ANALYZE_STAGE_SECONDS.time(stage="detect"):
+            faces = detect_faces_stable(frame, roi_key=session_id)
+            span.set("faces", len(faces))
+        with tracer.span("head_pose"):
+            examinee = select_examinee(session_id, faces)
+            poses = face_poses(faces)
+        head_pose = poses[examinee] if examinee is not None else None
+        landmarks = None
+        if examinee is not None and head_pose is not None:
+            landmarks = faces["landmarks"][examinee].tolist()
         
-        if faces and landmarks:
-            ratio, direction, severity = estimate_head_pose_simple(landmarks, faces[0])
-            head_pose = {"ratio": float(ratio), "direction": direction, "severity": float(severity)}
+        if len(faces) == 1:
+            sample_for_reverify(session_id, frame, face_boxes(faces)[0])
         
-        faces_out = [{"x": int(x), "y": int(y), "w": int(w_), "h": int(h_)} for (x, y, w_, h_) in faces]
+        faces_out = [{"x": x, "y": y, "w": w_, "h": h_,
+                      "score": None if np.isnan(score) else round(float(score), 3), "head_pose": pose}
+                     for (x, y, w_, h_), score, pose in zip(face_boxes(faces), faces["score"], poses)]
         fc = len(faces_out)
         
         # Log violations
-        if fc == 0:
-            log_violation(session_id, "NO_FACE", "Person not present in frame", "high")
-        elif fc > 1:
-            log_violation(session_id, "MULTIPLE_FACES", f"Multiple persons detected ({fc} faces)", "high")
-        elif head_pose and head_pose["direction"] != "Center" and head_pose["severity"] > 0.3:
-            log_violation(session_id, "HEAD_POSE", f"Looking {head_pose['direction']}", "medium")
+        with tracer.span("log_violation"), ANALYZE_STAGE_SECONDS.time(stage="db_write"):
+            violation = None
+            if fc == 0:
+                violation = "NO_FACE", "Person not present in frame", "high"
+            elif fc > 1:
+                violation = "MULTIPLE_FACES", f"Multiple persons detected ({fc} faces)", "high"
+            elif head_pose and head_pose_summary(head_pose):
+                violation = "HEAD_POSE", f"Looking {head_pose_summary(head_pose)}", "medium"
+            if violation:
+                violation_id = log_violation(session_id, *violation)
+                capture_evidence(session_id, violation_id, violation[0], binary)
+        record_frame_sample(session_id, fc, head_pose, violation and violation[0])
+        publish_status(session_id, faces=fc, looking=head_pose and head_pose_summary(head_pose), verified=True)
         
+        verify_next = False
+        if CLIENT_PREDETECT:
+            verify_next = predetect_verified(session_id, client and len(client[0]), fc)
+            if client is not None and len(client[0]) != fc:
+                PREDETECT_DISPUTES_TOTAL.inc()
+
+        record_analyze_latency((time.perf_counter() - started) * 1000.0)
         return jsonify({
             "faces": faces_out,
             "face_count": fc,
+            "examinee": examinee,
             "landmarks": landmarks,
-            "head_pose": head_pose
+            "head_pose": head_pose,
+            "verified": True,
+            "verify_next": verify_next,
+            "client_predetect": predetect_hint(),
+            "recommended": recommend_frame_params()
         })
     except Exception as e:
         print("analyze_frame error:", e)
         return jsonify({"error": str(e)}), 500
+    finally:
+        save_session_state(session_id)
+        frame_gate.release()
+
+def client_report_response(session_id, faces, landmarks):
+    """Answer a frame-less pre-detection report without decoding or detecting anything"""
+    overdue = predetect_overdue(session_id)
+    if overdue:
+        PREDETECT_REFUSED_TOTAL.inc()
+        if overdue == 1:
+            log_violation(session_id, "FRAME_WITHHELD",
+                          "Camera frame not sent when requested for verification", "medium")
+        return jsonify({"error": "frame required", "verify_next": True,
+                        "client_predetect": predetect_hint()}), 409
+    head_pose = None
+    if len(faces) == 1 and landmarks:
+        head_pose = head_pose_for_face(landmarks, faces[0])
+    # anything that would become a violation must be confirmed on a real frame
+    suspicious = len(faces) != 1 or (head_pose is not None and head_pose_summary(head_pose) is not None)
+    record_frame_sample(session_id, len(faces), head_pose, client=True)
+    publish_status(session_id, faces=len(faces), looking=head_pose and head_pose_summary(head_pose), verified=False)
+    return jsonify({
+        "faces": [{"x": x, "y": y, "w": w_, "h": h_} for (x, y, w_, h_) in faces],
+        "face_count": len(faces),
+        "landmarks": None,
+        "head_pose": head_pose,
+        "verified": False,
+        "verify_next": predetect_wants_frame(session_id, suspicious),
+        "client_predetect": predetect_hint(),
+        "recommended": recommend_frame_params()
+    })
 
 # ----------------- API: VOICE EVENT (Proctoring) -----------------
 @app.route("/voice_event", methods=["POST"])
 def voice_event():
     """Log voice violations during exam"""
-    data = request.get_json()
+    with tracer.span("parse_json"):
+        data = request.get_json()
     if not data:
         return jsonify({"error": "no data"}), 400
     
-    session_id = data.get("session_id")
+    session_id = parse_session_id(data.get("session_id"))
     rms = data.get("rms")
     event = data.get("event", "periodic")
     duration = data.get("duration", 0.0)
     
     if not session_id:
         return jsonify({"error": "session_id required"}), 400
+    err = check_proctor_token(session_id)
+    if err:
+        return jsonify({"error": err}), 401
     
     try:
-        if event == "voice_start":
-            log_violation(session_id, "VOICE_START", f"Voice detected (RMS: {rms:.4f})", "low")
-        elif event == "voice_stop":
-            if duration >= proctoring_state["voice_alert_duration"]:
-                log_violation(session_id, "VOICE_VIOLATION", f"Voice detected for {duration:.1f}s", "medium")
-        elif event == "periodic" and rms is not None and rms > proctoring_state["voice_threshold"]:
-            log_violation(session_id, "VOICE_DETECTED", f"RMS {rms:.4f} over threshold", "low")
+        with tracer.span("log_violation"):
+            if event == "voice_start":
+                log_violation(session_id, "VOICE_START", f"Voice detected (RMS: {rms:.4f})", "low")
+            elif event == "voice_stop":
+                if duration >= proctoring_state["voice_alert_duration"]:
+                    log_violation(session_id, "VOICE_VIOLATION", f"Voice detected for {duration:.1f}s", "medium")
+            elif event == "periodic" and rms is not None and rms > proctoring_state["voice_threshold"]:
+                log_violation(session_id, "VOICE_DETECTED", f"RMS {rms:.4f} over threshold", "low")
+        detected = event == "voice_start" or (rms is not None and rms > proctoring_state["voice_threshold"])
+        if event != "voice_stop":
+            record_voice_sample(session_id, rms, detected)
+        publish_status(session_id, voice=event != "voice_stop" and detected)
         
         return jsonify({"ok": True})
     except Exception as e:
@@ -1081,45 +2384,18 @@ def get_report(session_id):
     if err:
         return jsonify({"success": False, "message": err}), 401
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
     # Get report
-    cur.execute("""
-        SELECT r.report_id, r.session_id, r.user_id, r.exam_id, r.total_questions,
-               r.correct_answers, r.marks, r.percentage, r.submitted_at,
-               e.exam_title, e.domain, s.start_time, s.end_time
-        FROM reports r
-        JOIN exams e ON r.exam_id = e.exam_id
-        JOIN sessions s ON r.session_id = s.session_id
-        WHERE r.session_id = ? AND r.user_id = ?
-    """, (session_id, user_id))
-    
-    report = cur.fetchone()
+    report = store.get_report(session_id, user_id)
     
     if not report:
-        conn.close()
         return jsonify({"success": False, "message": "Report not found"}), 404
     
-    # Get violations
-    cur.execute("""
-        SELECT violation_type, violation_details, timestamp, severity
-        FROM violation_logs
-        WHERE session_id = ?
-        ORDER BY timestamp
-    """, (session_id,))
-    
-    violations = [dict(row) for row in cur.fetchall()]
-    
-    # Get question details for strengths/weaknesses
-    cur.execute("""
-        SELECT eq.question_id, eq.question, eq.correct_answer
-        FROM exam_questions eq
-        WHERE eq.exam_id = ?
-        ORDER BY eq.question_order
-    """, (report["exam_id"],))
-    
-    questions = [dict(row) for row in cur.fetchall()]
+    # Get violations, with links to the frames kept as evidence
+    violations = store.list_violations(session_id)
+    evidence_ids = set(evidence_store.session_index(session_id)["violation_id"].tolist())
+    for v in violations:
+        if v["violation_id"] in evidence_ids:
+            v["evidence_url"] = f"/api/report/{session_id}/evidence/{v['violation_id']}"
     
     # Get user answers (if stored separately, otherwise calculate from report)
     # For now, we'll analyze based on correct/incorrect counts
@@ -1142,8 +2418,6 @@ def get_report(session_id):
         v_type = v["violation_type"]
         violation_summary[v_type] = violation_summary.get(v_type, 0) + 1
     
-    conn.close()
-    
     return jsonify({
         "success": True,
         "report": {
@@ -1167,6 +2441,59 @@ def get_report(session_id):
         }
     })
 
+# ----------------- API: REPORT EVIDENCE -----------------
+@app.route("/api/report/<int:session_id>/evidence/<int:violation_id>", methods=["GET"])
+def get_report_evidence(session_id, violation_id):
+    """Frame stored for a violation, read from the mapped segment"""
+    user_id, err = get_user_id_from_auth_header()
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    if not store.get_report(session_id, user_id):
+        return jsonify({"success": False, "message": "Report not found"}), 404
+    data = evidence_store.read(session_id, violation_id)
+    if data is None:
+        return jsonify({"success": False, "message": "No evidence for this violation"}), 404
+    # copied: WSGI servers (gunicorn) only accept bytes, and the frame is small
+    resp = app.response_class(bytes(data), mimetype=evidence_mimetype(data))
+    # evidence never changes once written
+    resp.cache_control.private = True
+    resp.cache_control.max_age = 86400
+    resp.cache_control.immutable = True
+    return resp
+
+# ----------------- API: REPORT TIMELINE -----------------
+@app.route("/api/report/<int:session_id>/timeline", methods=["GET"])
+def get_report_timeline(session_id):
+    """Detection timeline of a session: ?buckets=N summary (default 600) or ?raw=1 samples, within ?from=&to= seconds"""
+    user_id, err = get_user_id_from_auth_header()
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    if not store.get_report(session_id, user_id):
+        return jsonify({"success": False, "message": "Report not found"}), 404
+    try:
+        t0 = request.args.get("from", type=float)
+        t1 = request.args.get("to", type=float)
+        buckets = min(max(1, request.args.get("buckets", 600, type=int)), 10000)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid range"}), 400
+
+    if request.args.get("raw") == "1":
+        start, samples = timeline.range(session_id, t0, t1)
+        samples = samples[:TIMELINE_RAW_MAX]
+        return jsonify({
+            "success": True,
+            "start": start,
+            "truncated": len(samples) == TIMELINE_RAW_MAX,
+            "t": (samples["t_ms"] / 1000.0).round(3).tolist(),
+            "kind": samples["kind"].tolist(),
+            "faces": samples["faces"].tolist(),
+            "flags": samples["flags"].tolist(),
+            "yaw": [None if np.isnan(x) else round(x, 1) for x in samples["yaw"].astype(float).tolist()],
+            "pitch": [None if np.isnan(x) else round(x, 1) for x in samples["pitch"].astype(float).tolist()],
+            "value": [None if np.isnan(x) else round(x, 4) for x in samples["value"].astype(float).tolist()],
+        })
+    return jsonify({"success": True, **timeline.downsample(session_id, buckets, t0, t1)})
+
 # ----------------- API: DOWNLOAD REPORT -----------------
 @app.route("/api/report/<int:session_id>/download", methods=["GET"])
 def download_report(session_id):
@@ -1182,36 +2509,14 @@ def download_report(session_id):
     except:
         return jsonify({"success": False, "message": "Invalid token"}), 401
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    
     # Get report with all details
-    cur.execute("""
-        SELECT r.*, e.exam_title, e.domain, u.full_name, u.student_id, u.email,
-               s.start_time, s.end_time
-        FROM reports r
-        JOIN exams e ON r.exam_id = e.exam_id
-        JOIN users u ON r.user_id = u.user_id
-        JOIN sessions s ON r.session_id = s.session_id
-        WHERE r.session_id = ? AND r.user_id = ?
-    """, (session_id, user_id))
-    
-    report = cur.fetchone()
+    report = store.get_report_detail(session_id, user_id)
     
     if not report:
-        conn.close()
         return jsonify({"success": False, "message": "Report not found"}), 404
     
     # Get violations
-    cur.execute("""
-        SELECT violation_type, violation_details, timestamp, severity
-        FROM violation_logs
-        WHERE session_id = ?
-        ORDER BY timestamp
-    """, (session_id,))
-    
-    violations = [dict(row) for row in cur.fetchall()]
-    conn.close()
+    violations = store.list_violations(session_id)
     
     # Generate HTML report
     html_content = f"""
@@ -1334,52 +2639,54 @@ def api_register():
     user_id_base = email.split("@")[0]
     user_id = f"{user_id_base}_{int(datetime.utcnow().timestamp())}"
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE email = ?", (email,))
-    if cur.fetchone():
-        conn.close()
+    if store.email_exists(email):
         return jsonify({"success": False, "message": "Email already registered."}), 400
 
     try:
         photo_path = save_photo_file(photo, user_id)
     except Exception as e:
-        conn.close()
         return jsonify({"success": False, "message": f"Failed to save photo: {e}"}), 500
 
     encoding_path, err = compute_and_save_encoding(photo_path, user_id)
     if err:
-        try:
-            os.remove(photo_path)
-        except Exception:
-            pass
-        conn.close()
+        discard_photo(photo_path)
         if err == "no-face":
             return jsonify({"success": False, "message": "No face detected in the uploaded photo."}), 400
         if err == "multiple-faces":
             return jsonify({"success": False, "message": "Multiple faces detected. Please upload a single-person photo."}), 400
         return jsonify({"success": False, "message": "Failed to compute face encoding: " + err}), 500
 
-    password_hash = generate_password_hash(password)
+    try:
+        password_hash = hash_password(password)
+    except PasswordPoolBusy:
+        discard_photo(photo_path)
+        try:
+            os.remove(encoding_path)
+        except Exception:
+            pass
+        return busy_response("Registration service is busy. Please try again shortly.", 5), 503
     created_at = datetime.utcnow().isoformat() + "Z"
 
     try:
-        cur.execute("""
-            INSERT INTO users (user_id, full_name, student_id, email, phone, course, role, password_hash, photo_path, encoding_path, notes, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (user_id, full_name, student_id, email, phone, course, role, password_hash, photo_path, encoding_path, notes, created_at))
-        conn.commit()
+        store.create_user({
+            "user_id": user_id, "full_name": full_name, "student_id": student_id, "email": email,
+            "phone": phone, "course": course, "role": role, "password_hash": password_hash,
+            "photo_path": photo_path, "encoding_path": encoding_path, "notes": notes,
+            "created_at": created_at,
+        })
     except Exception as e:
-        conn.rollback()
+        discard_photo(photo_path)
         try:
-            os.remove(photo_path)
             os.remove(encoding_path)
         except Exception:
             pass
-        conn.close()
         return jsonify({"success": False, "message": "DB error: " + str(e)}), 500
+    invalidate_user(user_id)
+    try:
+        keep_photo_file(photo_path, photo)
+    except Exception as e:
+        print("Photo rewrite error:", e)
 
-    conn.close()
     return jsonify({"success": True, "message": "Registered successfully", "userId": user_id})
 
 # ----------------- API: LOGIN -----------------
@@ -1393,14 +2700,22 @@ def api_login():
     if not email or not password:
         return jsonify({"success": False, "message": "Email and password required."}), 400
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, user_id, password_hash, full_name FROM users WHERE email = ?", (email,))
-    row = cur.fetchone()
-    conn.close()
-    if not row or not check_password_hash(row["password_hash"], password):
-        return jsonify({"success": False, "message": "Invalid credentials."}), 401
+    ip = request.remote_addr or "unknown"
+    wait = login_throttle(email, ip)
+    if wait:
+        return busy_response("Too many login attempts. Please try again later.", wait), 429
 
+    row = store.get_user_by_email(email)
+    try:
+        valid = bool(row) and run_password_task("check", check_password_hash, row["password_hash"], password)
+    except PasswordPoolBusy:
+        return busy_response("Login service is busy. Please try again shortly.", 5), 503
+    if not valid:
+        login_failures.incr(login_failure_key(email, ip))
+        return jsonify({"success": False, "message": "Invalid credentials."}), 401
+    login_failures.pop(login_failure_key(email, ip))
+    if password_hash_outdated(row["password_hash"]):
+        rehash_in_background(row["user_id"], password)
 
     payload = {
         "sub": row["user_id"],
@@ -1411,6 +2726,21 @@ def api_login():
     token = make_jwt(payload)
     return jsonify({"success": True, "message": "Login successful", "token": token})
 
+# ----------------- API: LOGOUT -----------------
+@app.route("/api/logout", methods=["POST"])
+def api_logout():
+    token = bearer_token()
+    if not token:
+        return jsonify({"success": False, "message": "Missing or invalid Authorization header"}), 401
+    try:
+        payload = decode_jwt(token)
+    except jwt.ExpiredSignatureError:
+        return jsonify({"success": True, "message": "Token already expired"})
+    except Exception as e:
+        return jsonify({"success": False, "message": "Invalid token: " + str(e)}), 401
+    revoke_token(token, payload.get("exp") or time.time() + JWT_EXP_DAYS * 86400)
+    return jsonify({"success": True, "message": "Logged out"})
+
 # ----------------- API: VERIFY (face compare) -----------------
 @app.route("/api/verify", methods=["POST"])
 def api_verify():
@@ -1433,20 +2763,24 @@ def api_verify():
         return jsonify({"success": False, "message": "Uploaded photo too large (max 4 MB)"}), 400
 
     try:
-        img_bytes = photo.read()
-        img_array = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        with tracer.span("decode"):
+            img_bytes = photo.read()
+            img_array = np.frombuffer(img_bytes, np.uint8)
+            img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
         if img is None:
             return jsonify({"success": False, "message": "Could not decode uploaded image"}), 400
 
         rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        boxes = face_recognition.face_locations(rgb, model="hog")
+        face_recognition = get_face_recognition()
+        with tracer.span("face_locations"):
+            boxes = face_recognition.face_locations(rgb, model="hog")
         if len(boxes) == 0:
             return jsonify({"success": False, "message": "No face detected in the uploaded image"}), 400
         if len(boxes) > 1:
             return jsonify({"success": False, "message": "Multiple faces detected. Present only yourself."}), 400
 
-        encodings = face_recognition.face_encodings(rgb, boxes)
+        with tracer.span("face_encodings"):
+            encodings = face_recognition.face_encodings(rgb, boxes)
         if not encodings:
             return jsonify({"success": False, "message": "Failed to compute face encoding from uploaded image"}), 500
         live_encoding = encodings[0]
@@ -1455,9 +2789,8 @@ def api_verify():
         if not enc_path.exists():
             return jsonify({"success": False, "message": "No registered encoding found for user"}), 404
 
-        with open(enc_path, "rb") as f:
-            data = pickle.load(f)
-        registered_encoding = data.get("encoding")
+        with tracer.span("load_encoding"):
+            registered_encoding = load_registered_encoding(user_id)
         if registered_encoding is None:
             return jsonify({"success": False, "message": "Corrupt encoding file"}), 500
 
@@ -1466,8 +2799,9 @@ def api_verify():
         except Exception:
             threshold = 0.55
 
-        distance = float(face_recognition.face_distance([registered_encoding], live_encoding)[0])
-        matched = bool(face_recognition.compare_faces([registered_encoding], live_encoding, tolerance=threshold)[0])
+        with tracer.span("compare"):
+            distance = float(face_recognition.face_distance([registered_encoding], live_encoding)[0])
+            matched = bool(face_recognition.compare_faces([registered_encoding], live_encoding, tolerance=threshold)[0])
 
         status_code = 200 if matched else 401
         return jsonify({
@@ -1480,6 +2814,90 @@ def api_verify():
     except Exception as e:
         return jsonify({"success": False, "message": "Server error during verification: " + str(e)}), 500
 
+# ----------------- API: LIVE MONITORING -----------------
+def make_live_token(exam_id, user_id, ttl=LIVE_TOKEN_TTL_S):
+    """"<exam_id>.<exp>.<mac>.<user_id>": opens the live feed of one exam, for a short time"""
+    exp = int(time.time()) + ttl
+    return f"{int(exam_id)}.{exp}.{_proctor_mac(f'live.{int(exam_id)}.{exp}.{user_id}')}.{user_id}"
+
+def check_live_token(exam_id):
+    """(user_id, None) from ?stream_token= (or an Authorization header), else (None, error)"""
+    token = request.args.get("stream_token")
+    if not token:
+        return get_user_id_from_auth_header()
+    return verify_live_token(exam_id, token)
+
+def verify_live_token(exam_id, token):
+    """(user_id, None) if token opens the live feed of exam_id, else (None, error)"""
+    parts = token.split(".", 3)
+    if len(parts) != 4 or not parts[1].isdigit():
+        return None, "Invalid stream token"
+    exam, exp, mac, user_id = parts
+    if not hmac.compare_digest(mac, _proctor_mac(f"live.{exam}.{exp}.{user_id}")):
+        return None, "Invalid stream token"
+    if int(exp) < time.time():
+        return None, "Stream token expired"
+    if exam != str(exam_id):
+        return None, "Stream token does not match exam"
+    return user_id, None
+
+@app.route("/api/exam/<int:exam_id>/live/token", methods=["POST"])
+def exam_live_token(exam_id):
+    """Short-lived token for opening the exam's live feed with EventSource"""
+    user_id, err = get_user_id_from_auth_header()
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    row = get_user_cached(user_id)
+    if not row or row["role"] != "staff":
+        return jsonify({"success": False, "message": "Staff only"}), 403
+    return jsonify({"success": True, "stream_token": make_live_token(exam_id, user_id),
+                    "expires_in": LIVE_TOKEN_TTL_S})
+
+@app.route("/api/exam/<int:exam_id>/live", methods=["GET"])
+def exam_live_feed(exam_id):
+    """Server-Sent Events for staff: a snapshot of the exam's sessions, then status/violation/session events"""
+    user_id, err = check_live_token(exam_id)
+    if err:
+        return jsonify({"success": False, "message": err}), 401
+    row = get_user_cached(user_id)
+    if not row or row["role"] != "staff":
+        return jsonify({"success": False, "message": "Staff only"}), 403
+    if not LIVE_FEED_ENABLED:
+        return jsonify({"success": False, "message": "Live feed is disabled"}), 404
+    sub = live_feed.subscribe(exam_id, LIVE_FEED_MAX_SUBSCRIBERS)
+    if sub is None:
+        return busy_response("Too many live watchers, retry later", 30), 503
+    resp = app.response_class(live_feed.stream(sub, LIVE_FEED_HEARTBEAT_S), mimetype="text/event-stream")
+    # also when the client leaves before the first event is written
+    resp.call_on_close(lambda: live_feed.unsubscribe(sub))
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # nginx: do not buffer the stream
+    return resp
+
+def live_stream_refusal(exam_id, token):
+    """LiveServer's check: None to open the stream, else (status, message) as exam_live_feed answers"""
+    user_id, err = verify_live_token(exam_id, token) if token else (None, "Stream token required")
+    if err:
+        return 401, err
+    row = get_user_cached(user_id)
+    if not row or row["role"] != "staff":
+        return 403, "Staff only"
+    if not LIVE_FEED_ENABLED:
+        return 404, "Live feed is disabled"
+    return None
+
+def serve_live_feed(bind=LIVE_FEED_BIND):
+    """Serve /api/exam/<id>/live from this process on bind, without Flask, until interrupted.
+    The gunicorn workers reach it through the shared live_feed channel."""
+    if live_feed.channel is None:
+        sys.exit("live-feed needs a shared SESSION_STATE_URL (shm or redis) to see the workers' sessions")
+    server = LiveServer(live_feed, live_stream_refusal, LIVE_SERVER_MAX_SUBSCRIBERS, LIVE_FEED_HEARTBEAT_S)
+    print(f"Serving live feed streams at http://{bind}")
+    try:
+        server.serve_forever(listen(bind))
+    except KeyboardInterrupt:
+        pass
+
 # ----------------- API: ME -----------------
 @app.route("/api/me", methods=["GET"])
 def api_me():
@@ -1487,11 +2905,7 @@ def api_me():
     if err:
         return jsonify({"success": False, "message": err}), 401
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, full_name, email, role FROM users WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    row = get_user_cached(user_id)
     if not row:
         return jsonify({"success": False, "message": "User not found"}), 404
 
@@ -1506,24 +2920,89 @@ def api_me():
 # ----------------- API: PHOTO (serve stored photo) -----------------
 @app.route("/api/photo/<user_id>", methods=["GET"])
 def get_user_photo(user_id):
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT photo_path FROM users WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()    
-    conn.close()
+    """Registered photo (?size=thumb for the thumbnail); ETag is the content hash, so revalidation is a 304"""
+    row = get_user_cached(user_id)
     if not row:
         return jsonify({"success": False, "message": "User not found"}), 404
     path = row["photo_path"]
     if not path or not os.path.exists(path):
         return jsonify({"success": False, "message": "Photo not found"}), 404
-    return send_file(path)
+    digest = photo_digest(path)
+    if request.args.get("size") == "thumb":
+        try:
+            path = make_thumbnail(path, digest)
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Failed to make thumbnail: {e}"}), 500
+        etag = f"{digest}-t{THUMB_SIZE}"
+    else:
+        etag = digest
+    # send_file streams from disk (sendfile / X-Sendfile where available) and answers If-None-Match
+    resp = send_file(path, etag=etag, max_age=PHOTO_MAX_AGE_S, conditional=True)
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
 
 # ----------------- HEALTH -----------------
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"ok": True})
+    """Liveness: the process is up and serving"""
+    return jsonify({"ok": True, "ready": warmup_state["status"] == "done", "db": store.stats()})
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness: models warm and not overloaded; load balancers should route on this"""
+    state = readiness()
+    return jsonify(state), 200 if state["ready"] else 503
+
+# ----------------- METRICS ENDPOINT -----------------
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return REGISTRY.render(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+# ----------------- ADMIN: SAMPLING PROFILER -----------------
+profiler = SamplingProfiler()
+
+@app.route("/api/admin/profile", methods=["POST"])
+def admin_profile():
+    """Profile this worker for N seconds and return collapsed stacks (flamegraph.pl / speedscope input)"""
+    err = check_admin_token()
+    if err:
+        return jsonify({"success": False, "message": err}), 403
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval_ms", 5)) / 1000.0
+    except ValueError:
+        return jsonify({"success": False, "message": "seconds and interval_ms must be numbers"}), 400
+    include_idle = request.args.get("idle", "0") == "1"
+    with_lines = request.args.get("lines", "0") == "1"
+    try:
+        collapsed, info = profiler.profile(seconds, interval, include_idle, with_lines)
+    except ProfilerBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+    filename = f"profile-{info['pid']}-{int(datetime.utcnow().timestamp())}.collapsed"
+    return collapsed, 200, {
+        "Content-Type": "text/plain; charset=utf-8",
+        "Content-Disposition": f"attachment; filename={filename}",
+        "X-Profile-Samples": str(info["samples"]),
+        "X-Profile-Seconds": str(info["seconds"]),
+    }
+
+# ----------------- ADMIN: REGRADE -----------------
+@app.route("/api/admin/regrade/<int:exam_id>", methods=["POST"])
+def admin_regrade(exam_id):
+    """Rescore all stored submissions of an exam against its current answer key (?dry_run=1 to preview)"""
+    err = check_admin_token()
+    if err:
+        return jsonify({"success": False, "message": err}), 403
+    if not store.get_active_exam(exam_id):
+        return jsonify({"success": False, "message": "Exam not found or inactive"}), 404
+    summary = grading.regrade_exam(store, exam_id, dry_run=request.args.get("dry_run", "0") == "1")
+    return jsonify({"success": True, **summary})
 
 # ----------------- RUN -----------------
 if __name__ == "__main__":
-    print("Starting Flask server at http://127.0.0.1:5000")
-    app.run(debug=True)
+    if sys.argv[1:] == ["live-feed"]:
+        serve_live_feed()
+    else:
+        print("Starting Flask server at http://127.0.0.1:5000")
+        app.run(debug=True)
@@ -0,0 +1,88 @@
+# profiler.py
+# Statistical profiler for a running worker: a background thread samples
+# every thread's Python stack via sys._current_frames() and aggregates the
+# samples into collapsed stacks ("frame;frame;frame count"), the input
+# format of flamegraph.pl / speedscope / inferno.
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Leaf functions of threads that are parked rather than doing work
+IDLE_LEAVES = {
+    "wait", "select", "poll", "accept", "get", "sleep", "_wait_for_tstate_lock",
+    "serve_forever", "handle_request", "readinto", "recv_into", "_worker",
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """One profile at a time per process; sampling runs off the request threads."""
+
+    def __init__(self, max_seconds=120.0):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    def profile(self, seconds, interval=0.005, include_idle=False, with_lines=False):
+        """Sample all threads for `seconds`; returns (collapsed_text, info)"""
+        seconds = max(0.1, min(float(seconds), self.max_seconds))
+        interval = max(0.001, float(interval))
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("a profile is already running in this worker")
+        try:
+            counts = Counter()
+            result = {}
+            sampler = threading.Thread(
+                target=self._sample, name="sampling-profiler",
+                args=(counts, seconds, interval, include_idle, with_lines, threading.get_ident(), result),
+                daemon=True)
+            sampler.start()
+            sampler.join()
+        finally:
+            self._lock.release()
+        lines = [f"{stack} {n}" for stack, n in counts.most_common()]
+        info = {"seconds": seconds, "interval": interval, "samples": result.get("samples", 0),
+                "stacks": len(counts), "pid": os.getpid()}
+        return "\n".join(lines) + ("\n" if lines else ""), info
+
+    def _sample(self, counts, seconds, interval, include_idle, with_lines, requester, result):
+        me = threading.get_ident()
+        names = {}
+        deadline = time.perf_counter() + seconds
+        samples = 0
+        next_tick = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                # skip the sampler itself and the request thread blocked waiting for it
+                if ident == me or ident == requester:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_LEAVES:
+                    continue
+                stack = []
+                f = frame
+                while f is not None:
+                    code = f.f_code
+                    label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                    if with_lines and f is frame:
+                        label += f":{f.f_lineno}"
+                    stack.append(label.replace(";", ":").replace(" ", "_"))
+                    f = f.f_back
+                stack.append(names.get(ident, f"thread-{ident}").replace(";", ":").replace(" ", "_"))
+                counts[";".join(reversed(stack))] += 1
+            samples += 1
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()
+        result["samples"] = samples
@@ -0,0 +1,86 @@
+# ratelimit.py
+# Token-bucket request limits. A limiter keeps its buckets in two
+# preallocated float arrays (tokens, time of the last refill) indexed through
+# a key -> slot dict, so a check is one dict lookup and a few arithmetic
+# operations, and a bucket costs 16 bytes plus its key. When the arrays are
+# full, slots of buckets that have refilled completely are reclaimed (they
+# would behave exactly like a new bucket); if none has, the least recently
+# used half goes, so a key that keeps hammering keeps its (empty) bucket.
+import itertools
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+_PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+_SPEC = re.compile(r"^(\d+(?:\.\d+)?)/(\d*(?:\.\d+)?)([smh]?)(?::(\d+(?:\.\d+)?))?$")
+
+
+def parse_limit(spec):
+    """'10/s', '30/m:10' (burst 10), '5/10s' -> (tokens per second, burst); None for 'off' or '0'"""
+    spec = spec.replace(" ", "").lower()
+    if spec in ("", "0", "off", "none"):
+        return None
+    m = _SPEC.match(spec)
+    if not m or not (m.group(2) or m.group(3)):
+        raise ValueError(f"bad rate limit {spec!r}, expected e.g. 10/s, 30/m:10 or 5/10s")
+    count = float(m.group(1))
+    period = float(m.group(2) or 1) * _PERIODS[m.group(3) or "s"]
+    burst = float(m.group(4)) if m.group(4) else count
+    if count <= 0 or period <= 0 or burst < 1:
+        raise ValueError(f"bad rate limit {spec!r}")
+    return count / period, burst
+
+
+class TokenBucketLimiter:
+    """Buckets of `burst` tokens refilled at `rate` tokens per second, one per key."""
+
+    def __init__(self, rate, burst, capacity=65536):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.evicted = 0  # buckets dropped before refilling because every slot was busy
+        self._slots = OrderedDict()  # key -> slot, least recently used first
+        self._tokens = array("d", bytes(8 * capacity))
+        self._stamp = array("d", bytes(8 * capacity))
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def take(self, key, cost=1.0):
+        """0.0 if the request may proceed, else the seconds until it would"""
+        now = time.monotonic()
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._allocate(key)
+                tokens = self.burst
+            else:
+                self._slots.move_to_end(key)
+                tokens = min(self.burst, self._tokens[slot] + (now - self._stamp[slot]) * self.rate)
+            self._stamp[slot] = now
+            if tokens >= cost:
+                self._tokens[slot] = tokens - cost
+                return 0.0
+            self._tokens[slot] = tokens
+        return (cost - tokens) / self.rate
+
+    def _allocate(self, key):
+        if not self._free:
+            self._reclaim(time.monotonic())
+        slot = self._free.pop()
+        self._slots[key] = slot
+        return slot
+
+    def _reclaim(self, now):
+        """Free the slots of full buckets; if there are none, of the least recently used half"""
+        tokens, stamp, rate, burst = self._tokens, self._stamp, self.rate, self.burst
+        idle = [k for k, s in self._slots.items() if tokens[s] + (now - stamp[s]) * rate >= burst]
+        if not idle:
+            idle = list(itertools.islice(self._slots, max(1, len(self._slots) // 2)))
+            self.evicted += len(idle)
+        for key in idle:
+            self._free.append(self._slots.pop(key))
+
+    def __len__(self):
+        return len(self._slots)
@@ -0,0 +1,380 @@
+# sessionstate.py
+# Where per-session proctoring state lives. Request handlers keep working on
+# plain module dicts (roi_state, predetect_sessions, ...); a SessionState
+# loads one session's entries of every registered dict from the backend in a
+# single batched read before the request, and writes back only the entries
+# that changed in a single batched write (with a TTL) after it. Requests of
+# one session that overlap in a process share the loaded entries: only the
+# first loads, each one writes what changed, and the entries leave the dicts
+# when the last one is saved. Fixed-window counters (login throttling) are
+# shared the same way, and channels carry short-lived messages (the live
+# feed's updates) from every process to every other.
+#
+# Backends, picked by SESSION_STATE_URL:
+#   local (default)            the dicts themselves; one process only
+#   shm[:///dev/shm/file.db]   SQLite on tmpfs, shared by the processes of one node
+#   redis://host:6379/0        any Redis-protocol server (Redis, Valkey, KeyDB, ...);
+#                              needs the redis package
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from cache import TTLCache
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"not JSON serializable: {type(value).__name__}")
+
+
+def encode(value):
+    return json.dumps(value, separators=(",", ":"), default=_json_default)
+
+
+class _InFlight:
+    """Requests of one session currently between load() and save() in this process."""
+
+    def __init__(self):
+        self.count = 1
+        self.seen = {}  # name -> raw value last read from or written to the backend
+        self.ready = threading.Event()  # set once the first load() has filled the dicts
+        self.write_lock = threading.Lock()
+
+
+class SessionState:
+    """Syncs registered per-session dicts with a backend around each request."""
+
+    def __init__(self, backend=None, ttl=6 * 3600, prefix="proctor:"):
+        self.backend = backend  # None: the dicts are the only copy
+        self.ttl = ttl
+        self.prefix = prefix
+        self._maps = {}  # name -> (dict, lock, decode)
+        self._inflight = {}  # session_id -> _InFlight
+        self._inflight_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return self.backend is not None
+
+    def bind(self, name, mapping, lock, decode=None):
+        """Register a dict keyed by session id (decode turns a JSON value back into the dict's form)"""
+        self._maps[name] = (mapping, lock, decode)
+
+    def _key(self, name, session_id):
+        return f"{self.prefix}{name}:{session_id}"
+
+    def load(self, session_id):
+        """Replace the local entries of session_id with the backend's (one batched read),
+        unless another request of the session in this process has them loaded already"""
+        if not self.shared:
+            return
+        with self._inflight_lock:
+            entry = self._inflight.get(session_id)
+            first = entry is None
+            if first:
+                entry = self._inflight[session_id] = _InFlight()
+            else:
+                entry.count += 1
+        if not first:
+            entry.ready.wait()
+            return
+        try:
+            names = list(self._maps)
+            values = self.backend.get_many([self._key(n, session_id) for n in names])
+            for name, raw in zip(names, values):
+                mapping, lock, decode = self._maps[name]
+                with lock:
+                    if raw is None:
+                        mapping.pop(session_id, None)
+                    else:
+                        value = json.loads(raw)
+                        mapping[session_id] = decode(value) if decode else value
+                entry.seen[name] = raw
+        finally:
+            entry.ready.set()
+
+    def save(self, session_id):
+        """Write back the entries of session_id that changed since they were loaded or last
+        written (one batched write); the last request of the session drops them locally"""
+        if not self.shared:
+            return
+        with self._inflight_lock:
+            entry = self._inflight.get(session_id)
+        if entry is None:
+            return
+        try:
+            with entry.write_lock:
+                sets, deletes, raws = {}, [], {}
+                for name, (mapping, lock, _) in self._maps.items():
+                    with lock:
+                        value = mapping.get(session_id)
+                        raw = None if value is None else encode(value)
+                    if raw == entry.seen.get(name):
+                        continue
+                    raws[name] = raw
+                    if raw is None:
+                        deletes.append(self._key(name, session_id))
+                    else:
+                        sets[self._key(name, session_id)] = raw
+                if sets or deletes:
+                    self.backend.apply(sets, deletes, self.ttl)
+                    entry.seen.update(raws)
+        finally:
+            with self._inflight_lock:
+                entry.count -= 1
+                if entry.count == 0 and self._inflight.get(session_id) is entry:
+                    del self._inflight[session_id]
+                    for mapping, lock, _ in self._maps.values():
+                        with lock:
+                            mapping.pop(session_id, None)
+
+    def forget(self, session_id):
+        """Drop every entry of a finished session"""
+        for mapping, lock, _ in self._maps.values():
+            with lock:
+                mapping.pop(session_id, None)
+        if self.shared:
+            self.backend.apply({}, [self._key(n, session_id) for n in self._maps], self.ttl)
+
+    def counter(self, name, window, maxsize=100000):
+        """Fixed-window counters with TTLCache's incr/peek/pop interface"""
+        if not self.shared:
+            return TTLCache(maxsize, window)
+        return SharedCounter(self.backend, f"{self.prefix}{name}:", window)
+
+
+    def channel(self, name, keep=60.0):
+        """A SharedChannel all processes on the backend publish to and read from, or None if
+        the state is not shared (the process then only sees its own messages)"""
+        if not self.shared:
+            return None
+        return SharedChannel(self.backend, f"{self.prefix}{name}", keep)
+
+
+class SharedChannel:
+    """Append-only message log; each reader follows it from where it started reading."""
+
+    def __init__(self, backend, name, keep):
+        self.backend = backend
+        self.name = name
+        self.keep = keep  # seconds messages stay readable
+        self._cursor = None  # last message read by this process
+
+    def publish(self, payload):
+        self.backend.append(self.name, payload, self.keep)
+
+    def read(self):
+        """Messages published since the last read (the first read only sets the starting point)"""
+        self._cursor, payloads = self.backend.read_after(self.name, self._cursor)
+        return payloads
+
+
+class SharedCounter:
+    def __init__(self, backend, prefix, window):
+        self.backend = backend
+        self.prefix = prefix
+        self.window = window
+
+    def incr(self, key, amount=1):
+        """(count, seconds_left); the window starts at the first increment"""
+        return self.backend.incr(self.prefix + str(key), amount, self.window)
+
+    def peek(self, key):
+        return self.backend.peek(self.prefix + str(key))
+
+    def pop(self, key):
+        self.backend.apply({}, [self.prefix + str(key)], self.window)
+
+
+class SharedMemoryBackend:
+    """Key/value table in a SQLite file on tmpfs: shared by the worker processes of one node."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS channel (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created REAL NOT NULL
+                )
+            """)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE expires > ? AND key IN ({})".format(",".join("?" * len(keys))),
+            (time.time(), *keys)).fetchall()
+        found = dict(rows)
+        return [found.get(k) for k in keys]
+
+    def apply(self, sets, deletes, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if sets:
+                conn.executemany("""
+                    INSERT INTO kv (key, value, expires) VALUES (?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires
+                """, [(k, v, now + ttl) for k, v in sets.items()])
+            if deletes:
+                conn.executemany("DELETE FROM kv WHERE key = ?", [(k,) for k in deletes])
+            if random.random() < 0.01:
+                conn.execute("DELETE FROM kv WHERE expires <= ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def incr(self, key, amount, window):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= now:
+                count, expires = amount, now + window
+            else:
+                count, expires = int(row[0]) + amount, row[1]
+            conn.execute("""
+                INSERT INTO kv (key, value, expires) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires
+            """, (key, str(count), expires))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return count, expires - now
+
+    def peek(self, key):
+        now = time.time()
+        row = self._conn().execute("SELECT value, expires FROM kv WHERE key = ? AND expires > ?",
+                                   (key, now)).fetchone()
+        if row is None:
+            return None, 0.0
+        return int(row[0]), row[1] - now
+
+
+    def append(self, name, payload, keep):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO channel (name, payload, created) VALUES (?, ?, ?)",
+                         (name, payload, now))
+            if random.random() < 0.01:
+                conn.execute("DELETE FROM channel WHERE created < ?", (now - keep,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def read_after(self, name, cursor):
+        """(new cursor, payloads after cursor); cursor None starts after the newest message"""
+        conn = self._conn()
+        if cursor is None:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM channel").fetchone()[0], []
+        rows = conn.execute("SELECT id, payload FROM channel WHERE id > ? AND name = ? ORDER BY id",
+                            (cursor, name)).fetchall()
+        if not rows:
+            return cursor, []
+        return rows[-1][0], [payload for _, payload in rows]
+
+
+class RedisBackend:
+    """Redis-protocol server; every operation is one pipelined round trip."""
+
+    def __init__(self, url, client=None):
+        if client is None:
+            # redis is only needed when SESSION_STATE_URL points at a Redis server
+            import redis
+            client = redis.Redis.from_url(url, decode_responses=True,
+                                          socket_timeout=1.0, socket_connect_timeout=1.0)
+        self.client = client
+
+    def get_many(self, keys):
+        return self.client.mget(keys) if keys else []
+
+    def apply(self, sets, deletes, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        ttl_ms = int(ttl * 1000)
+        for k, v in sets.items():
+            pipe.set(k, v, px=ttl_ms)
+        if deletes:
+            pipe.delete(*deletes)
+        pipe.execute()
+
+    def incr(self, key, amount, window):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(key, 0, px=int(window * 1000), nx=True)  # opens the window
+        pipe.incrby(key, amount)
+        pipe.pttl(key)
+        _, count, ttl_ms = pipe.execute()
+        return int(count), max(0, ttl_ms) / 1000.0
+
+    def peek(self, key):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        value, ttl_ms = pipe.execute()
+        if value is None:
+            return None, 0.0
+        return int(value), max(0, ttl_ms) / 1000.0
+
+
+    def append(self, name, payload, keep):
+        # a stream trimmed by length: readers that keep up never miss a message
+        self.client.xadd(name, {"p": payload}, maxlen=10000, approximate=True)
+
+    def read_after(self, name, cursor):
+        if cursor is None:
+            newest = self.client.xrevrange(name, count=1)
+            return (newest[0][0] if newest else "0-0"), []
+        found = self.client.xread({name: cursor}, count=10000)
+        if not found:
+            return cursor, []
+        entries = found[0][1]
+        return entries[-1][0], [fields["p"] for _, fields in entries]
+
+
+def session_state_from_env():
+    url = os.environ.get("SESSION_STATE_URL", "local").strip()
+    ttl = float(os.environ.get("SESSION_STATE_TTL_S", str(6 * 3600)))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return SessionState(RedisBackend(url), ttl)
+    if url.startswith("shm"):
+        path = url[len("shm://"):] if url.startswith("shm://") else ""
+        if not path:
+            shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+            path = os.path.join(shm_dir, "proctor-session-state.db")
+        return SessionState(SharedMemoryBackend(path), ttl)
+    return SessionState(None, ttl)
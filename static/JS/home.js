@@ -27,7 +27,15 @@ if (!token) {
 }
 
 // Logout button
-document.getElementById('logout').addEventListener('click', () => {
+document.getElementById('logout').addEventListener('click', async () => {
+  try {
+    await fetch('/api/logout', {
+      method: 'POST',
+      headers: { 'Authorization': 'Bearer ' + token }
+    });
+  } catch (err) {
+    console.warn('logout failed', err);
+  }
   localStorage.removeItem('authToken');
   window.location.href = '/login.html';
 });
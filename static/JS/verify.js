@@ -116,6 +116,7 @@ capture.addEventListener('click', async () => {
           if (sessionData.success) {
             // Store session_id for use in exam page
             localStorage.setItem('currentSessionId', sessionData.session_id);
+            localStorage.setItem('currentProctorToken', sessionData.proctor_token);
             localStorage.setItem('currentExamId', examId);
             // Proceed to exam
             setTimeout(() => window.location.href = `/index.html?examId=${examId}&sessionId=${sessionData.session_id}`, 1000);
@@ -353,6 +353,7 @@ let progressPercentEl = document.getElementById("progressPercent");
 let statusText = document.getElementById("statusText");
 let faceCountSpan = document.getElementById("faceCount");
 let voiceStatus = document.getElementById("voiceStatus");
+let detectModeEl = document.getElementById("detectMode");
 
 // --- VIDEO/MIC STREAM ---
 let stream = null;
@@ -369,6 +370,20 @@ let voiceThreshold = 0.08;
 // --- STATE ---
 let sending = false;
 let sendTimer = null;
+// Adaptive frame pacing; the server's "recommended" block overrides these
+const FRAME_INTERVAL_MIN_MS = 300;
+const FRAME_INTERVAL_MAX_MS = 3000;
+const FRAME_TIMEOUT_MS = 5000;
+let frameIntervalMs = FRAME_INTERVAL_MIN_MS;
+let frameMaxWidth = 1280;
+let frameQuality = 0.6;
+// On-device pre-detection: only used when the browser has a FaceDetector and the
+// server enables it; frames are then attached only when the server asks for one
+// or the local result would be a violation
+let faceDetector = null;
+let predetectEnabled = false;
+let verifyNext = true;
+let lastLocalFaceCount = -1;
 let timerInterval = null;
 let timeRemainingSeconds = 0;
 
@@ -386,6 +401,14 @@ let headDetectedStart = 0;
 let voiceStartTs = 0;
 let voiceWarningCount = 0;
 let answeredQuestionIds = new Set();
+// answer changes not yet autosaved: {questionId: optionIndex}, and the sequence
+// number of each change (a millisecond clock that never repeats or goes back),
+// so the server keeps the latest change whichever request arrives last
+const AUTOSAVE_DELAY_MS = 2000;
+let pendingAnswers = {};
+let pendingSeqs = {};
+let lastAnswerSeq = 0;
+let autosaveTimer = null;
 // add near top with other trackers
 let noFaceStart = 0;
 let multipleFaceStart = 0;
@@ -565,6 +588,8 @@ function friendly(msg) {
     msg = msg.toLowerCase();
     if (msg.includes("left")) return "Looking left — keep your head straight";
     if (msg.includes("right")) return "Looking right — keep your head straight";
+    if (msg.includes("looking up")) return "Looking up — keep your eyes on the screen";
+    if (msg.includes("looking down")) return "Looking down — keep your eyes on the screen";
     if (msg.includes("no person")) return "Person not present";
     if (msg.includes("multiple")) return "Multiple persons detected";
     if (msg.includes("voice") || msg.includes("silent")) return "Please remain silent";
@@ -628,8 +653,63 @@ function handleAnswerSelection(inputEl) {
     if (!questionId) return;
     answeredQuestionIds.add(questionId);
     updateQuestionStats();
+    pendingAnswers[questionId] = parseInt(inputEl.value);
+    lastAnswerSeq = Math.max(Date.now(), lastAnswerSeq + 1);
+    pendingSeqs[questionId] = lastAnswerSeq;
+    scheduleAutosave();
 }
 
+// ==========================================================
+// ANSWER AUTOSAVE
+// ==========================================================
+function scheduleAutosave() {
+    if (autosaveTimer) return;
+    autosaveTimer = setTimeout(() => {
+        autosaveTimer = null;
+        autosaveAnswers();
+    }, AUTOSAVE_DELAY_MS);
+}
+
+async function autosaveAnswers(keepalive = false) {
+    if (!currentSessionId || !token || Object.keys(pendingAnswers).length === 0) return;
+    const batch = pendingAnswers, seqs = pendingSeqs;
+    pendingAnswers = {};
+    pendingSeqs = {};
+    try {
+        const res = await fetch('/api/session/autosave', {
+            method: 'POST',
+            keepalive: keepalive,
+            headers: {
+                'Authorization': 'Bearer ' + token,
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ session_id: parseInt(currentSessionId), answers: batch, seqs: seqs })
+        });
+        if (!res.ok && res.status !== 404) throw new Error('autosave failed: ' + res.status);
+    } catch (err) {
+        // keep the changes (newer selections win) and try again later
+        pendingAnswers = Object.assign(batch, pendingAnswers);
+        pendingSeqs = Object.assign(seqs, pendingSeqs);
+        if (!keepalive) scheduleAutosave();
+    }
+}
+
+async function loadSavedAnswers() {
+    if (!currentSessionId) return {};
+    try {
+        const res = await fetch(`/api/session/${currentSessionId}/answers`, {
+            headers: { 'Authorization': 'Bearer ' + token }
+        });
+        if (!res.ok) return {};
+        const data = await res.json();
+        return data.answers || {};
+    } catch (err) {
+        return {};
+    }
+}
+
+window.addEventListener('pagehide', () => autosaveAnswers(true));
+
 function incrementVoiceWarnings() {
     voiceWarningCount += 1;
     updateViolationDisplay();
@@ -781,6 +861,10 @@ async function submitExam(autoTriggered = false) {
 
     sending = false;
     if (sendTimer) clearTimeout(sendTimer);
+    if (autosaveTimer) clearTimeout(autosaveTimer);
+    autosaveTimer = null;
+    pendingAnswers = {};
+    pendingSeqs = {};
     if (audioContext) audioContext.close();
     if (timerInterval) {
         clearInterval(timerInterval);
@@ -883,6 +967,7 @@ async function startProctoring() {
 
     logEvent(`Calibration done. Threshold ≈ ${voiceThreshold.toFixed(4)}`);
 
+    initFaceDetector();
     sending = true;
     monitorVoice();
     scheduleSend();
@@ -894,6 +979,7 @@ async function startProctoring() {
 // ==========================================================
 let currentExamId = null;
 let currentSessionId = null;
+let proctorToken = null;
 let examQuestions = [];
 let token = null;
 
@@ -904,6 +990,7 @@ async function loadQuestions() {
         currentExamId = urlParams.get('examId') || localStorage.getItem('currentExamId');
         currentSessionId = urlParams.get('sessionId') || localStorage.getItem('currentSessionId');
         token = localStorage.getItem('authToken');
+        proctorToken = localStorage.getItem('currentProctorToken');
         
         if (!currentExamId) {
             questionPanel.innerHTML = "<p>No exam ID provided. Please select an exam from the home page.</p>";
@@ -928,8 +1015,20 @@ async function loadQuestions() {
             return;
         }
         
+        if (!proctorToken || localStorage.getItem('currentSessionId') !== String(currentSessionId)) {
+            if (!(await refreshProctorToken())) {
+                questionPanel.innerHTML = "<p>This exam session is no longer active. Please start the exam again from the home page.</p>";
+                return;
+            }
+        }
+
         const data = await res.json();
         examQuestions = data.questions || [];
+        // restore answers autosaved before a reload or crash
+        const saved = await loadSavedAnswers();
+        examQuestions.forEach(q => {
+            if (saved[q.question_id] !== undefined) q.selected_option = saved[q.question_id];
+        });
         answeredQuestionIds.clear();
         updateQuestionStats();
         renderQuestions(examQuestions);
@@ -946,6 +1045,21 @@ async function loadQuestions() {
     }
 }
 
+async function refreshProctorToken() {
+    // a new proctor token for the session already open; never starts a session
+    if (!currentSessionId) return false;
+    const res = await fetch(`/api/session/${parseInt(currentSessionId)}/proctor-token`, {
+        method: 'POST',
+        headers: { 'Authorization': 'Bearer ' + token }
+    });
+    if (!res.ok) return false;
+    const data = await res.json();
+    proctorToken = data.proctor_token;
+    localStorage.setItem('currentSessionId', String(currentSessionId));
+    localStorage.setItem('currentProctorToken', data.proctor_token);
+    return true;
+}
+
 function renderQuestions(qs) {
     questionPanel.innerHTML = "";
     qs.forEach((q, i) => {
@@ -1042,7 +1156,7 @@ function sendVoiceEvent(eventType, extra = {}) {
     };
     fetch("/voice_event", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: { "Content-Type": "application/json", "X-Proctor-Token": proctorToken || "" },
         body: JSON.stringify(payload)
     }).catch(e => console.warn("voice_event error:", e));
 }
@@ -1056,32 +1170,118 @@ function scheduleSend() {
     sendTimer = setTimeout(async () => {
         await sendFrame();
         scheduleSend();
-    }, 300);
+    }, frameIntervalMs);
+}
+
+function applyFrameRecommendation(rec) {
+    if (!rec) return;
+    if (rec.interval_ms) frameIntervalMs = Math.min(FRAME_INTERVAL_MAX_MS, Math.max(FRAME_INTERVAL_MIN_MS, rec.interval_ms));
+    if (rec.max_width) frameMaxWidth = rec.max_width;
+    if (rec.jpeg_quality) frameQuality = rec.jpeg_quality;
+}
+
+function backOffFrames(retryAfterSeconds) {
+    // server overloaded or unreachable: slow down instead of piling up requests
+    let next = retryAfterSeconds ? retryAfterSeconds * 1000 : frameIntervalMs * 2;
+    frameIntervalMs = Math.min(FRAME_INTERVAL_MAX_MS, Math.max(FRAME_INTERVAL_MIN_MS, next));
 }
 
 async function sendFrame() {
     if (!video || video.readyState < 2) return;
     if (!currentSessionId) return; // Don't send if no session
 
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
+    let scale = Math.min(1, frameMaxWidth / video.videoWidth);
+    canvas.width = Math.round(video.videoWidth * scale);
+    canvas.height = Math.round(video.videoHeight * scale);
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-    let data = canvas.toDataURL("image/jpeg", 0.6);
+    let local = (predetectEnabled && faceDetector) ? await detectFacesLocally() : null;
+    let payload = { session_id: parseInt(currentSessionId) };
+    if (local) payload.client = local;
+    if (!local || verifyNext || local.faces !== 1 || local.faces !== lastLocalFaceCount) {
+        payload.image = canvas.toDataURL("image/jpeg", frameQuality);
+    }
+    if (local) lastLocalFaceCount = local.faces;
 
+    let controller = new AbortController();
+    let timeout = setTimeout(() => controller.abort(), FRAME_TIMEOUT_MS);
     try {
         let res = await fetch("/analyze_frame", {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ 
-                image: data,
-                session_id: parseInt(currentSessionId)
-            })
+            headers: { "Content-Type": "application/json", "X-Proctor-Token": proctorToken || "" },
+            body: JSON.stringify(payload),
+            signal: controller.signal
         });
+        if (res.status === 429 || res.status === 503) {
+            backOffFrames(parseInt(res.headers.get("Retry-After")) || 0);
+            return;
+        }
         let json = await res.json();
+        if (res.status === 409 && json.verify_next) {
+            // the server wants a real frame before it accepts more reports
+            verifyNext = true;
+            return;
+        }
+        if (!res.ok) {
+            // a failed analysis is not evidence of an empty frame
+            backOffFrames(0);
+            return;
+        }
+        applyFrameRecommendation(json.recommended);
+        applyPredetectHint(json);
         processDetection(json);
     } catch (e) {
         console.warn("sendFrame error", e);
+        backOffFrames(0);
+    } finally {
+        clearTimeout(timeout);
+    }
+}
+
+
+function initFaceDetector() {
+    if (faceDetector || !("FaceDetector" in window)) return;
+    try {
+        faceDetector = new FaceDetector({ fastMode: true, maxDetectedFaces: 5 });
+    } catch (e) {
+        faceDetector = null;
+    }
+}
+
+function applyPredetectHint(res) {
+    let hint = res.client_predetect;
+    predetectEnabled = !!(hint && hint.enabled && faceDetector);
+    verifyNext = !!res.verify_next;
+    if (detectModeEl) detectModeEl.innerText = "Detection: " + (predetectEnabled ? "On-device" : "Server");
+}
+
+async function detectFacesLocally() {
+    // compact report in canvas coordinates: face count, boxes and, for a single
+    // face, [right eye, left eye, nose] in the server's landmark order
+    try {
+        let found = await faceDetector.detect(canvas);
+        let report = {
+            faces: found.length,
+            boxes: found.map(f => ({
+                x: Math.round(f.boundingBox.x), y: Math.round(f.boundingBox.y),
+                w: Math.round(f.boundingBox.width), h: Math.round(f.boundingBox.height)
+            }))
+        };
+        if (found.length === 1 && found[0].landmarks) {
+            let lm = found[0].landmarks;
+            let eyes = lm.filter(l => l.type === "eye").map(l => l.locations[0]).sort((a, b) => a.x - b.x);
+            let nose = lm.find(l => l.type === "nose");
+            if (eyes.length === 2 && nose) {
+                report.landmarks = [[eyes[0].x, eyes[0].y], [eyes[1].x, eyes[1].y],
+                                    [nose.locations[0].x, nose.locations[0].y]];
+            }
+        }
+        return report;
+    } catch (e) {
+        // fall back to sending the frame
+        faceDetector = null;
+        predetectEnabled = false;
+        return null;
     }
 }
 
@@ -1132,14 +1332,17 @@ function processDetection(res) {
     let detected = "Center";
     if (res.head_pose && res.head_pose.direction)
         detected = res.head_pose.direction;
+    // horizontal turns take precedence; otherwise report looking up/down
+    if (detected === "Center" && res.head_pose && res.head_pose.vertical)
+        detected = res.head_pose.vertical;
 
     if (detected !== lastHeadDetected) {
         lastHeadDetected = detected;
         headDetectedStart = now;
     } else {
-        if ((detected === "Left" || detected === "Right")) {
+        if (detected !== "Center") {
             if (now - headDetectedStart >= HEAD_HOLD_MS) {
-                const text = detected === "Left" ? "Looking left" : "Looking right";
+                const text = "Looking " + detected.toLowerCase();
                 if (!lastShownTime[text] || now - lastShownTime[text] >= VIOLATION_COOLDOWN_MS) {
                     pushWarning(friendly(text));
                     logEvent(friendly(text));
@@ -1160,7 +1363,7 @@ function processDetection(res) {
 
     let showBoxes = false;
     if (faces.length === 0 || faces.length > 1) showBoxes = true;
-    if ((lastHeadDetected === "Left" || lastHeadDetected === "Right") &&
+    if (lastHeadDetected !== "Center" &&
         (now - headDetectedStart >= HEAD_HOLD_MS)) showBoxes = true;
 
     if (showBoxes && faces.length > 0) {
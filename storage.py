@@ -0,0 +1,683 @@
+# storage.py
+# Thin repository layer over the proctoring database (SQLite or PostgreSQL).
+import os
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Table definitions shared by both backends; {pk} is the backend's
+# auto-increment primary key type, {blob} its binary column type and {float}
+# its 8-byte float type (PostgreSQL's REAL is 4 bytes: too coarse for unix times).
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id {pk},
+        user_id TEXT UNIQUE,
+        full_name TEXT,
+        student_id TEXT,
+        email TEXT UNIQUE,
+        phone TEXT,
+        course TEXT,
+        role TEXT,
+        password_hash TEXT,
+        photo_path TEXT,
+        encoding_path TEXT,
+        notes TEXT,
+        created_at TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exams (
+        exam_id {pk},
+        exam_title TEXT NOT NULL,
+        description TEXT,
+        domain TEXT,
+        difficulty TEXT,
+        duration INTEGER DEFAULT 60,
+        total_questions INTEGER DEFAULT 0,
+        is_active INTEGER DEFAULT 1,
+        created_at TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exam_questions (
+        question_id {pk},
+        exam_id INTEGER NOT NULL,
+        question TEXT NOT NULL,
+        options TEXT NOT NULL,
+        correct_answer INTEGER NOT NULL,
+        question_order INTEGER DEFAULT 0,
+        FOREIGN KEY (exam_id) REFERENCES exams(exam_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id {pk},
+        user_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time TEXT,
+        status TEXT DEFAULT 'active',
+        created_at TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (exam_id) REFERENCES exams(exam_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reports (
+        report_id {pk},
+        session_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        exam_id INTEGER NOT NULL,
+        total_questions INTEGER DEFAULT 0,
+        correct_answers INTEGER DEFAULT 0,
+        marks REAL DEFAULT 0.0,
+        percentage REAL DEFAULT 0.0,
+        submitted_at TEXT,
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (exam_id) REFERENCES exams(exam_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS session_answers (
+        session_id INTEGER PRIMARY KEY,
+        exam_id INTEGER NOT NULL,
+        answers {blob} NOT NULL,
+        answer_stamps {blob},
+        updated_at TEXT,
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS violation_logs (
+        violation_id {pk},
+        session_id INTEGER NOT NULL,
+        violation_type TEXT NOT NULL,
+        violation_details TEXT,
+        timestamp TEXT NOT NULL,
+        severity TEXT DEFAULT 'medium',
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id) ON DELETE CASCADE
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS app_meta (
+        meta_key TEXT PRIMARY KEY,
+        meta_value TEXT
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS revoked_tokens (
+        token_hash TEXT PRIMARY KEY,
+        expires_at {float} NOT NULL
+    );
+    """,
+]
+
+# columns added to tables that older databases already have: (table, column, type)
+ADDED_COLUMNS = [
+    ("session_answers", "answer_stamps", "{blob}"),
+]
+
+
+class BaseStore:
+    """Queries shared by every backend. SQL is written with '?' placeholders."""
+
+    pk_type = None
+    blob_type = "BLOB"
+    float_type = "REAL"
+    upgrades = []  # statements bringing tables created by older versions up to date
+    placeholder = "?"
+    for_update = ""
+
+    # ---- backend hooks ----
+    @contextmanager
+    def connection(self):
+        raise NotImplementedError
+
+    def _cursor(self, conn):
+        return conn.cursor()
+
+    def _insert(self, cur, sql, params, pk):
+        raise NotImplementedError
+
+    def _executemany(self, cur, sql, rows):
+        cur.executemany(self._sql(sql), rows)
+
+    def _begin_write(self, cur):
+        """Start a transaction that will read then write (read-modify-write)"""
+
+    def _sql(self, sql):
+        if self.placeholder == "?":
+            return sql
+        return sql.replace("?", self.placeholder)
+
+    # ---- small helpers ----
+    def _run(self, fn):
+        """Run fn(cursor) inside one transaction and return its result"""
+        with self.connection() as conn:
+            return fn(self._cursor(conn))
+
+    def _fetchone(self, sql, params=()):
+        def q(cur):
+            cur.execute(self._sql(sql), params)
+            return cur.fetchone()
+        row = self._run(q)
+        return dict(row) if row else None
+
+    def _fetchall(self, sql, params=()):
+        def q(cur):
+            cur.execute(self._sql(sql), params)
+            return cur.fetchall()
+        return [dict(row) for row in self._run(q)]
+
+    def stats(self):
+        return {}
+
+    # ---- schema / seed ----
+    def init_schema(self):
+        def q(cur):
+            types = {"pk": self.pk_type, "blob": self.blob_type, "float": self.float_type}
+            for ddl in SCHEMA + self.upgrades:
+                cur.execute(ddl.format(**types))
+            for table, column, kind in ADDED_COLUMNS:
+                cur.execute(f"SELECT * FROM {table} LIMIT 0")
+                if column not in [d[0] for d in cur.description]:
+                    cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind.format(**types)}")
+        self._run(q)
+
+    def get_meta(self, key):
+        row = self._fetchone("SELECT meta_value FROM app_meta WHERE meta_key = ?", (key,))
+        return row["meta_value"] if row else None
+
+    def set_meta(self, key, value):
+        self._run(lambda cur: cur.execute(self._sql("""
+            INSERT INTO app_meta (meta_key, meta_value) VALUES (?, ?)
+            ON CONFLICT (meta_key) DO UPDATE SET meta_value = excluded.meta_value
+        """), (key, value)))
+
+    def seed_exams(self, exams_data, domain_questions, created_at):
+        """Insert or update exams and replace their question bank"""
+        def seed(cur):
+            cur.execute("SELECT COUNT(*) AS count FROM exams")
+            count = dict(cur.fetchone())["count"]
+
+            # If exams exist, clear existing questions to repopulate with domain-specific ones
+            if count > 0:
+                print("Exams already exist. Clearing existing questions to repopulate with domain-specific questions...")
+                cur.execute("DELETE FROM exam_questions")
+                cur.execute("UPDATE exams SET total_questions = 0")
+
+            question_rows = []
+            for exam in exams_data:
+                exam_id = exam["id"]
+                questions = domain_questions.get(exam_id, [])
+
+                cur.execute(self._sql("SELECT exam_id FROM exams WHERE exam_id = ?"), (exam_id,))
+                if cur.fetchone():
+                    cur.execute(self._sql("""
+                        UPDATE exams
+                        SET exam_title = ?, description = ?, domain = ?, difficulty = ?,
+                            duration = ?, total_questions = ?, is_active = ?
+                        WHERE exam_id = ?
+                    """), (exam["title"], exam["description"], exam["domain"], exam["difficulty"],
+                           60, len(questions), 1, exam_id))
+                else:
+                    cur.execute(self._sql("""
+                        INSERT INTO exams (exam_id, exam_title, description, domain, difficulty, duration, total_questions, is_active, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """), (exam_id, exam["title"], exam["description"], exam["domain"], exam["difficulty"],
+                           60, len(questions), 1, created_at))
+
+                for idx, q in enumerate(questions):
+                    question_rows.append((exam_id, q.get("question", ""), json.dumps(q.get("options", [])),
+                                          q.get("answer", 0), idx))
+
+            self._executemany(cur, """
+                INSERT INTO exam_questions (exam_id, question, options, correct_answer, question_order)
+                VALUES (?, ?, ?, ?, ?)
+            """, question_rows)
+        self._run(seed)
+
+    # ---- users ----
+    def get_user_by_email(self, email):
+        return self._fetchone(
+            "SELECT id, user_id, password_hash, full_name FROM users WHERE email = ?", (email,))
+
+    def email_exists(self, email):
+        return self._fetchone("SELECT id FROM users WHERE email = ?", (email,)) is not None
+
+    def photo_in_use(self, photo_path):
+        return self._fetchone("SELECT id FROM users WHERE photo_path = ?", (photo_path,)) is not None
+
+    def get_user(self, user_id):
+        return self._fetchone(
+            "SELECT user_id, full_name, email, role, photo_path FROM users WHERE user_id = ?", (user_id,))
+
+    def create_user(self, user):
+        cols = ("user_id", "full_name", "student_id", "email", "phone", "course", "role",
+                "password_hash", "photo_path", "encoding_path", "notes", "created_at")
+        sql = """
+            INSERT INTO users ({})
+            VALUES ({})
+        """.format(", ".join(cols), ", ".join("?" for _ in cols))
+        return self._run(lambda cur: self._insert(cur, sql, tuple(user.get(c) for c in cols), "id"))
+
+    def update_password_hash(self, user_id, password_hash):
+        self._run(lambda cur: cur.execute(self._sql("UPDATE users SET password_hash = ? WHERE user_id = ?"),
+                                          (password_hash, user_id)))
+
+    # ---- token revocation ----
+    def revoke_token(self, token_hash, expires_at):
+        """Record a revoked token until its own expiry (unix seconds); drops lapsed entries"""
+        def q(cur):
+            cur.execute(self._sql("DELETE FROM revoked_tokens WHERE expires_at < ?"), (time.time(),))
+            cur.execute(self._sql("""
+                INSERT INTO revoked_tokens (token_hash, expires_at) VALUES (?, ?)
+                ON CONFLICT (token_hash) DO NOTHING
+            """), (token_hash, expires_at))
+        self._run(q)
+
+    def is_token_revoked(self, token_hash):
+        return self._fetchone("SELECT 1 AS revoked FROM revoked_tokens WHERE token_hash = ?",
+                              (token_hash,)) is not None
+
+    # ---- exams ----
+    def list_exams(self, domain=None):
+        if domain:
+            return self._fetchall("""
+                SELECT exam_id as id, exam_title as title, description, domain, difficulty, duration, total_questions
+                FROM exams
+                WHERE is_active = 1 AND LOWER(domain) = ?
+                ORDER BY exam_id
+            """, (domain,))
+        return self._fetchall("""
+            SELECT exam_id as id, exam_title as title, description, domain, difficulty, duration, total_questions
+            FROM exams
+            WHERE is_active = 1
+            ORDER BY exam_id
+        """)
+
+    def list_domains(self):
+        rows = self._fetchall("SELECT DISTINCT domain FROM exams WHERE is_active = 1 ORDER BY domain")
+        return [row["domain"] for row in rows]
+
+    def get_active_exam(self, exam_id):
+        return self._fetchone(
+            "SELECT exam_id, exam_title, duration FROM exams WHERE exam_id = ? AND is_active = 1", (exam_id,))
+
+    def get_questions(self, exam_id):
+        return self._fetchall("""
+            SELECT question_id, question, options, correct_answer, question_order
+            FROM exam_questions
+            WHERE exam_id = ?
+            ORDER BY question_order
+        """, (exam_id,))
+
+    def get_answer_key(self, exam_id):
+        rows = self._fetchall("""
+            SELECT question_id, correct_answer
+            FROM exam_questions
+            WHERE exam_id = ?
+        """, (exam_id,))
+        return {row["question_id"]: row["correct_answer"] for row in rows}
+
+    def get_ordered_answer_key(self, exam_id):
+        """[(question_id, correct_answer)] in question order (the layout of stored answers)"""
+        rows = self._fetchall("""
+            SELECT question_id, correct_answer
+            FROM exam_questions
+            WHERE exam_id = ?
+            ORDER BY question_order, question_id
+        """, (exam_id,))
+        return [(row["question_id"], row["correct_answer"]) for row in rows]
+
+    # ---- sessions ----
+    def find_active_session(self, user_id, exam_id):
+        return self._fetchone("""
+            SELECT session_id FROM sessions
+            WHERE user_id = ? AND exam_id = ? AND status = 'active'
+        """, (user_id, exam_id))
+
+    def count_active_sessions(self):
+        row = self._fetchone("SELECT COUNT(*) AS count FROM sessions WHERE status = 'active'")
+        return row["count"] if row else 0
+
+    def get_active_session(self, session_id, user_id):
+        return self._fetchone("""
+            SELECT session_id, user_id, exam_id, start_time
+            FROM sessions
+            WHERE session_id = ? AND user_id = ? AND status = 'active'
+        """, (session_id, user_id))
+
+    def get_session_owner(self, session_id):
+        """user_id of an active session, or None"""
+        row = self._fetchone("""
+            SELECT user_id FROM sessions WHERE session_id = ? AND status = 'active'
+        """, (session_id,))
+        return row["user_id"] if row else None
+
+    def get_live_session(self, session_id):
+        """exam and examinee of an active session, or None"""
+        return self._fetchone("""
+            SELECT s.exam_id, s.user_id, s.start_time, u.full_name AS name, u.student_id
+            FROM sessions s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.session_id = ? AND s.status = 'active'
+        """, (session_id,))
+
+    def create_session(self, user_id, exam_id, start_time):
+        return self._run(lambda cur: self._insert(cur, """
+            INSERT INTO sessions (user_id, exam_id, start_time, status, created_at)
+            VALUES (?, ?, ?, 'active', ?)
+        """, (user_id, exam_id, start_time, start_time), "session_id"))
+
+    def complete_session(self, session_id, user_id, exam_id, end_time,
+                         total_questions, correct_answers, marks, percentage, answers=None):
+        """Close the session, store its answers and create its report in one transaction; returns report_id"""
+        def q(cur):
+            cur.execute(self._sql("""
+                UPDATE sessions
+                SET end_time = ?, status = 'completed'
+                WHERE session_id = ?
+            """), (end_time, session_id))
+            if answers is not None:
+                self._save_answers(cur, session_id, exam_id, answers, end_time)
+            return self._insert(cur, """
+                INSERT INTO reports (session_id, user_id, exam_id, total_questions, correct_answers, marks, percentage, submitted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (session_id, user_id, exam_id, total_questions, correct_answers, marks, percentage, end_time),
+                "report_id")
+        return self._run(q)
+
+    # ---- answers ----
+    def _save_answers(self, cur, session_id, exam_id, answers, updated_at, stamps=None):
+        cur.execute(self._sql("""
+            INSERT INTO session_answers (session_id, exam_id, answers, answer_stamps, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (session_id) DO UPDATE
+            SET answers = excluded.answers, updated_at = excluded.updated_at,
+                answer_stamps = COALESCE(excluded.answer_stamps, session_answers.answer_stamps)
+        """), (session_id, exam_id, answers, stamps, updated_at))
+
+    def save_answers(self, session_id, exam_id, answers, updated_at):
+        """Upsert the packed answers (grading.encode_answers) of a session"""
+        self._run(lambda cur: self._save_answers(cur, session_id, exam_id, answers, updated_at))
+
+    def get_answers(self, session_id):
+        """Packed answers of a session, or None"""
+        row = self._fetchone("SELECT answers FROM session_answers WHERE session_id = ?", (session_id,))
+        return bytes(row["answers"]) if row else None
+
+    def merge_answers(self, updates, apply, updated_at):
+        """Apply answer deltas of active sessions in one transaction.
+
+        updates: [(session_id, exam_id, delta)]; apply(stored answers, stored stamps, delta)
+        -> (new answers, new stamps), where the stored values are bytes or None and stamps
+        record when each answer was given (see grading.apply_stamped_delta).
+        Returns {session_id: merged answers}; sessions that are no longer active are skipped.
+        """
+        def q(cur):
+            self._begin_write(cur)
+            merged = {}
+            for session_id, exam_id, delta in updates:
+                cur.execute(self._sql("SELECT status FROM sessions WHERE session_id = ?" + self.for_update),
+                            (session_id,))
+                row = cur.fetchone()
+                if not row or row["status"] != "active":
+                    continue
+                cur.execute(self._sql("SELECT answers, answer_stamps FROM session_answers WHERE session_id = ?"),
+                            (session_id,))
+                row = cur.fetchone()
+                answers = bytes(row["answers"]) if row else None
+                stamps = bytes(row["answer_stamps"]) if row and row["answer_stamps"] is not None else None
+                merged[session_id], stamps = apply(answers, stamps, delta)
+                self._save_answers(cur, session_id, exam_id, merged[session_id], updated_at, stamps)
+            return merged
+        return self._run(q)
+
+    def list_exam_submissions(self, exam_id):
+        """Reports of an exam that have stored answers: [(report_id, total, correct, answers bytes)]"""
+        rows = self._fetchall("""
+            SELECT r.report_id, r.total_questions, r.correct_answers, a.answers
+            FROM reports r
+            JOIN session_answers a ON a.session_id = r.session_id
+            WHERE r.exam_id = ?
+            ORDER BY r.report_id
+        """, (exam_id,))
+        return [(row["report_id"], row["total_questions"], row["correct_answers"], bytes(row["answers"]))
+                for row in rows]
+
+    def count_exam_reports(self, exam_id):
+        row = self._fetchone("SELECT COUNT(*) AS count FROM reports WHERE exam_id = ?", (exam_id,))
+        return row["count"] if row else 0
+
+    def update_report_scores(self, rows):
+        """Batch update of (total_questions, correct_answers, marks, percentage, report_id) in one transaction"""
+        if not rows:
+            return
+        self._run(lambda cur: self._executemany(cur, """
+            UPDATE reports
+            SET total_questions = ?, correct_answers = ?, marks = ?, percentage = ?
+            WHERE report_id = ?
+        """, rows))
+
+    # ---- reports ----
+    def get_report(self, session_id, user_id):
+        return self._fetchone("""
+            SELECT r.report_id, r.session_id, r.user_id, r.exam_id, r.total_questions,
+                   r.correct_answers, r.marks, r.percentage, r.submitted_at,
+                   e.exam_title, e.domain, s.start_time, s.end_time
+            FROM reports r
+            JOIN exams e ON r.exam_id = e.exam_id
+            JOIN sessions s ON r.session_id = s.session_id
+            WHERE r.session_id = ? AND r.user_id = ?
+        """, (session_id, user_id))
+
+    def get_report_detail(self, session_id, user_id):
+        return self._fetchone("""
+            SELECT r.*, e.exam_title, e.domain, u.full_name, u.student_id, u.email,
+                   s.start_time, s.end_time
+            FROM reports r
+            JOIN exams e ON r.exam_id = e.exam_id
+            JOIN users u ON r.user_id = u.user_id
+            JOIN sessions s ON r.session_id = s.session_id
+            WHERE r.session_id = ? AND r.user_id = ?
+        """, (session_id, user_id))
+
+    # ---- violation logs ----
+    def add_violation(self, session_id, violation_type, violation_details, timestamp, severity="medium"):
+        return self._run(lambda cur: self._insert(cur, """
+            INSERT INTO violation_logs (session_id, violation_type, violation_details, timestamp, severity)
+            VALUES (?, ?, ?, ?, ?)
+        """, (session_id, violation_type, violation_details, timestamp, severity), "violation_id"))
+
+    def add_violations(self, rows):
+        """Batch insert of (session_id, type, details, timestamp, severity) tuples"""
+        if not rows:
+            return
+        self._run(lambda cur: self._executemany(cur, """
+            INSERT INTO violation_logs (session_id, violation_type, violation_details, timestamp, severity)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows))
+
+    def list_violations(self, session_id):
+        return self._fetchall("""
+            SELECT violation_id, violation_type, violation_details, timestamp, severity
+            FROM violation_logs
+            WHERE session_id = ?
+            ORDER BY timestamp
+        """, (session_id,))
+
+
+class SQLiteStore(BaseStore):
+    """Single-file SQLite backend; one short-lived connection per call.
+
+    The driver-level busy timeout is kept short and lock waits are retried
+    here instead, so contention on the database file can be counted.
+    """
+
+    pk_type = "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    def __init__(self, path, busy_timeout=0.1, max_busy_wait=5.0):
+        self.path = str(path)
+        self.busy_timeout = busy_timeout
+        self.max_busy_wait = max_busy_wait
+        self._stats_lock = threading.Lock()
+        self._busy = {"busy_retries": 0, "busy_wait_seconds": 0.0, "busy_failures": 0}
+
+    def get_conn(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _run(self, fn):
+        started = time.perf_counter()
+        delay = 0.01
+        while True:
+            attempt = time.perf_counter()
+            try:
+                return super()._run(fn)
+            except sqlite3.OperationalError as e:
+                msg = str(e).lower()
+                if "locked" not in msg and "busy" not in msg:
+                    raise
+                if time.perf_counter() - started >= self.max_busy_wait:
+                    self._record_busy(0, time.perf_counter() - attempt, failed=True)
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.2)
+                # time spent blocked on the lock plus the backoff sleep
+                self._record_busy(1, time.perf_counter() - attempt)
+
+    def _record_busy(self, retries, waited, failed=False):
+        with self._stats_lock:
+            self._busy["busy_retries"] += retries
+            self._busy["busy_wait_seconds"] += waited
+            if failed:
+                self._busy["busy_failures"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._busy)
+        out["backend"] = "sqlite"
+        return out
+
+    @contextmanager
+    def connection(self):
+        conn = self.get_conn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _insert(self, cur, sql, params, pk):
+        cur.execute(sql, params)
+        return cur.lastrowid
+
+    def _begin_write(self, cur):
+        # take the write lock before reading, so the read cannot go stale
+        cur.execute("BEGIN IMMEDIATE")
+
+
+class PostgresStore(BaseStore):
+    """PostgreSQL backend with a thread-safe connection pool and batched writes.
+
+    The pool is opened lazily in each process: connections must not be shared
+    across fork (gunicorn preloads the app in the master, which uses the store
+    for schema setup before forking workers).
+    """
+
+    pk_type = "SERIAL PRIMARY KEY"
+    blob_type = "BYTEA"
+    float_type = "DOUBLE PRECISION"
+    upgrades = [
+        "ALTER TABLE revoked_tokens ALTER COLUMN expires_at TYPE {float}",
+    ]
+    placeholder = "%s"
+    for_update = " FOR UPDATE"
+
+    def __init__(self, dsn, minconn=1, maxconn=10, page_size=200):
+        # psycopg2 is only needed when DATABASE_URL points at PostgreSQL
+        import psycopg2.extras
+        import psycopg2.pool
+        self._extras = psycopg2.extras
+        self._pool_class = psycopg2.pool.ThreadedConnectionPool
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._inherited = []  # pools of the parent process, see pool
+
+    @property
+    def pool(self):
+        """This process's connection pool, opened on first use"""
+        pool = self._pool
+        if pool is not None and self._pool_pid == os.getpid():
+            return pool
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                if self._pool is not None:
+                    # Inherited over fork: closing (or garbage-collecting) these
+                    # connections would end the parent's server sessions, so
+                    # they are left untouched.
+                    self._inherited.append(self._pool)
+                self._pool = self._pool_class(self.minconn, self.maxconn, self.dsn)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    @contextmanager
+    def connection(self):
+        conn = self.pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def _cursor(self, conn):
+        return conn.cursor(cursor_factory=self._extras.RealDictCursor)
+
+    def _insert(self, cur, sql, params, pk):
+        cur.execute(self._sql(sql).rstrip() + f" RETURNING {pk}", params)
+        return cur.fetchone()[pk]
+
+    def _executemany(self, cur, sql, rows):
+        self._extras.execute_batch(cur, self._sql(sql), rows, page_size=self.page_size)
+
+    def close(self):
+        """Close this process's pool (e.g. in the gunicorn master before forking); reopened on next use"""
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+            self._pool_pid = None
+
+    def stats(self):
+        return {"backend": "postgresql", "pool_max": self.maxconn}
+
+
+def create_store(default_sqlite_path):
+    """Pick a backend from DATABASE_URL (postgres://...) or fall back to SQLite"""
+    url = os.environ.get("DATABASE_URL", "").strip()
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresStore(
+            url,
+            minconn=int(os.environ.get("DB_POOL_MIN", "1")),
+            maxconn=int(os.environ.get("DB_POOL_MAX", "10")),
+        )
+    busy_timeout = float(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "100")) / 1000.0
+    path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else default_sqlite_path
+    return SQLiteStore(path, busy_timeout=busy_timeout)
@@ -0,0 +1,107 @@
+# Storage conformance fixtures: every test taking `store` runs once against
+# SQLiteStore (a temporary file) and once against PostgresStore. PostgreSQL is
+# TEST_DATABASE_URL if set, else an embedded server started with pgserver;
+# without either (or without psycopg2) the PostgreSQL runs are skipped.
+#
+# `app` is next.py imported once per test run against a scratch SQLite database
+# and scratch evidence/timeline directories; `client` is its Flask test client
+# `new_user` / `new_session` create accounts and exam sessions in it and `auth`
+# makes a user's Authorization header.
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import PostgresStore, SQLiteStore  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def postgres_dsn(tmp_path_factory):
+    pytest.importorskip("psycopg2")
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver", reason="set TEST_DATABASE_URL or install pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+    yield server.get_uri()
+    server.cleanup()
+
+
+def _reset_postgres(dsn):
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for table in ("violation_logs", "session_answers", "reports", "sessions", "exam_questions",
+                      "exams", "users", "app_meta", "revoked_tokens"):
+            cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+    conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        s = SQLiteStore(tmp_path / "test.db")
+    else:
+        dsn = request.getfixturevalue("postgres_dsn")
+        _reset_postgres(dsn)
+        s = PostgresStore(dsn, minconn=1, maxconn=4)
+    s.init_schema()
+    yield s
+    if hasattr(s, "close"):
+        s.close()
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    for module in ("cv2", "flask", "jwt", "PIL"):
+        pytest.importorskip(module)
+    root = tmp_path_factory.mktemp("app")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{root / 'app.db'}",
+        "EVIDENCE_DIR": str(root / "evidence"),
+        "TIMELINE_DIR": str(root / "timelines"),
+        "JWT_SECRET": "test-secret-" + "0" * 32,
+        "AUTOSAVE_FLUSH_S": "3600",  # tests flush explicitly
+        "SESSION_STATE_URL": "local",
+        "WARMUP_ON_START": "0",
+        "PRELOAD_MODELS": "0",
+    })
+    import next
+    return next
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.fixture
+def new_user(app):
+    def create(role="student", password_hash="x", photo_path=None):
+        user_id = "t" + uuid.uuid4().hex[:10]
+        app.store.create_user({"user_id": user_id, "full_name": "Test User", "student_id": "S1",
+                               "email": f"{user_id}@example.com", "phone": "", "course": "CS", "role": role,
+                               "password_hash": password_hash, "photo_path": photo_path, "encoding_path": None,
+                               "notes": "", "created_at": "2026-01-01T00:00:00Z"})
+        return user_id
+    return create
+
+
+@pytest.fixture
+def new_session(app, new_user):
+    def create(user_id=None):
+        user_id = user_id or new_user()
+        exam_id = app.store.list_exams()[0]["id"]
+        return user_id, exam_id, app.store.create_session(user_id, exam_id, "2026-01-01T00:00:00Z")
+    return create
+
+
+@pytest.fixture
+def auth(app):
+    """Authorization header of a user"""
+    return lambda user_id: {"Authorization": "Bearer " + app.make_jwt({"sub": user_id})}
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from admission import ADMITTED, FrameGate, worker_limits
+
+
+def test_slots_freed_together_admit_every_waiter():
+    for _ in range(20):
+        gate = FrameGate(slots=2, max_queue=4, max_wait=2.0)
+        assert gate.acquire("a") == gate.acquire("b") == ADMITTED
+        results = {}
+
+        def wait(key):
+            t0 = time.monotonic()
+            results[key] = (gate.acquire(key), time.monotonic() - t0)
+
+        waiters = [threading.Thread(target=wait, args=(k,)) for k in ("c", "d")]
+        for t in waiters:
+            t.start()
+        while gate.depth() < 2:
+            time.sleep(0.001)
+        with gate._cond:  # both running frames finish at the same moment
+            gate._active -= 2
+            gate._cond.notify_all()
+        for t in waiters:
+            t.join()
+        assert all(state == ADMITTED and waited < 1.0 for state, waited in results.values()), results
+
+
+def test_worker_limits_split_the_node_budget():
+    env = {"WEB_CONCURRENCY": "4", "ANALYZE_CONCURRENCY": "8", "ANALYZE_QUEUE_MAX": "64"}
+    assert worker_limits(env) == (2, 16)
+    env = {"WEB_CONCURRENCY": "4", "ANALYZE_CONCURRENCY": "2", "ANALYZE_QUEUE_MAX": "10"}
+    assert worker_limits(env) == (1, 3)  # every worker can still run a frame
+    assert worker_limits({"ANALYZE_CONCURRENCY": "3", "ANALYZE_QUEUE_MAX": "5"}) == (3, 5)
+
+
+def test_full_gate_answers_429_through_the_app(app, client, new_session, monkeypatch):
+    gate = FrameGate(slots=1, max_queue=1, max_wait=5.0)
+    monkeypatch.setattr(app, "frame_gate", gate)
+    monkeypatch.setitem(app.warmup_state, "status", "done")  # only the full queue keeps /ready down
+    assert gate.acquire("running") == ADMITTED
+    waiter = threading.Thread(target=gate.acquire, args=("waiting",))
+    waiter.start()
+    while gate.depth() < 1:
+        time.sleep(0.001)
+    assert gate.full()
+    try:
+        _, _, sid = new_session()
+        shed_before = app.FRAMES_SHED_TOTAL.value(reason="queue_full")
+        resp = client.post("/analyze_frame", json={"session_id": sid, "image": "data:image/jpeg;base64,AA=="},
+                           headers={"X-Proctor-Token": app.make_proctor_token(sid)})
+        assert resp.status_code == 429
+        assert int(resp.headers["Retry-After"]) >= 1
+        assert resp.get_json()["shed"] == "queue_full"
+        assert app.FRAMES_SHED_TOTAL.value(reason="queue_full") == shed_before + 1
+        ready = client.get("/ready")
+        assert ready.status_code == 503 and ready.get_json()["frame_queue"] == 1
+    finally:
+        gate.release()
+        waiter.join()
+        gate.release()
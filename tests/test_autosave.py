@@ -0,0 +1,32 @@
+import grading
+
+
+def test_answer_positions_accepts_integral_numbers():
+    positions = grading.answer_positions({"1": 1.0, "2": 1.5, "3": True, "4": "1", "5": 2}, [1, 2, 3, 4, 5])
+    assert positions == {0: 1, 4: 2}
+
+
+def test_string_and_int_session_ids_share_one_pending_entry(app, client, new_session, auth):
+    user_id, exam_id, sid = new_session()
+    qids, _ = app.exam_layout(exam_id)
+    for session_id, seq in ((sid, 10), (str(sid), 20)):
+        r = client.post("/api/session/autosave", headers=auth(user_id),
+                        json={"session_id": session_id, "answers": {str(qids[0]): seq // 10}, "seqs": {str(qids[0]): seq}})
+        assert r.status_code == 200
+    assert str(sid) not in app._autosave_pending
+    assert app._autosave_pending[sid][2] == {0: (2, 20.0)}
+    app.flush_autosaves()
+    assert grading.decode_answers(app.store.get_answers(sid))[0] == 2
+
+
+def test_changes_pending_when_the_session_ends_are_counted_as_discarded(app, client, new_session, auth):
+    user_id, exam_id, sid = new_session()
+    qids, _ = app.exam_layout(exam_id)
+    client.post("/api/session/autosave", headers=auth(user_id),
+                json={"session_id": sid, "answers": {str(qids[0]): 1, str(qids[1]): 0}})
+    # submitted through another worker: this one still holds the changes
+    app.store.complete_session(sid, user_id, exam_id, "2026-01-01T01:00:00Z", len(qids), 0, 0.0, 0.0, None)
+    before = app.AUTOSAVE_DISCARDED_TOTAL.value()
+    app.flush_autosaves()
+    assert app.AUTOSAVE_DISCARDED_TOTAL.value() == before + 2
+    assert sid not in app._autosave_pending
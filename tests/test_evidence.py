@@ -0,0 +1,27 @@
+from evidence import EvidenceStore
+
+
+def test_session_index_follows_appends(tmp_path):
+    ev = EvidenceStore(tmp_path, session_budget=1 << 20)
+    ev.append(1, 10, b"a" * 5)
+    ev.append(2, 20, b"bb")
+    assert ev.session_index(1)["violation_id"].tolist() == [10]
+    ev.append(1, 11, b"ccc")
+    ev.append(3, 30, b"d")
+    ev.append(1, 12, b"e")
+    assert ev.session_index(1)["violation_id"].tolist() == [10, 11, 12]
+    assert ev.session_index(2)["length"].tolist() == [2]
+    assert len(ev.session_index(4)) == 0
+    assert bytes(ev.read(1, 11)) == b"ccc"
+    assert ev.read(2, 11) is None
+
+
+def test_session_index_sees_other_writers(tmp_path):
+    reader = EvidenceStore(tmp_path, session_budget=1 << 20)
+    assert len(reader.session_index(1)) == 0
+    writer = EvidenceStore(tmp_path, session_budget=1 << 20)  # e.g. another worker process
+    writer.append(1, 10, b"frame")
+    assert reader.session_index(1)["violation_id"].tolist() == [10]
+    assert bytes(reader.read(1, 10)) == b"frame"
+    assert reader.admit(1, "NO_FACE", (1 << 20) - 5) is None
+    assert reader.admit(1, "HEAD_POSE", 1) == "budget"
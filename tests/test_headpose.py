@@ -0,0 +1,34 @@
+import numpy as np
+
+import headpose
+
+
+def project(yaw, pitch, roll, scale=2.0, offset=(320.0, 240.0)):
+    """Weak-perspective image of MODEL_POINTS under the module's angle conventions"""
+    a, b, r = np.radians(pitch), np.radians(-yaw), np.radians(roll)
+    rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    rz = np.array([[np.cos(r), -np.sin(r), 0], [np.sin(r), np.cos(r), 0], [0, 0, 1]])
+    rotated = headpose.MODEL_POINTS @ (rz @ ry @ rx).T
+    return scale * rotated[:, :2] + offset
+
+
+def test_solve_pose_recovers_the_angles_of_a_projection():
+    poses = [(0, 0, 0), (25, 0, 0), (-30, 10, 0), (0, -20, 15), (40, 25, -10)]
+    yaw, pitch, roll, scale = headpose.solve_pose(np.stack([project(*p) for p in poses]))
+    np.testing.assert_allclose(np.stack([yaw, pitch, roll], axis=1), poses, atol=1e-6)
+    np.testing.assert_allclose(scale, 2.0)
+
+
+def test_positive_yaw_turns_the_nose_towards_image_right():
+    points = project(30, 0, 0)
+    assert points[2, 0] > points[:2, 0].mean()
+    yaw, _, _, _ = headpose.solve_pose(points)  # a single (5, 2) face
+    assert yaw.shape == (1,) and yaw[0] > 29
+
+
+def test_classify_labels_and_severity():
+    horizontal, vertical, severity = headpose.classify([30, -30, 5], [0, -25, 5], 20, 20)
+    assert horizontal.tolist() == ["Left", "Right", "Center"]
+    assert vertical.tolist() == ["Center", "Up", "Center"]
+    np.testing.assert_allclose(severity, [1.5, 1.5, 0.25])
@@ -0,0 +1,118 @@
+import json
+import socket
+import threading
+
+from livefeed import RESYNC, LiveFeed, LiveServer, listen
+from sessionstate import SessionState, SharedMemoryBackend
+
+
+def resolve(session_id):
+    return {"exam_id": 7, "name": f"student {session_id}"}
+
+
+def make_feed(**kwargs):
+    return LiveFeed(resolve, interval=3600, **kwargs)  # flushed by hand, not by the thread
+
+
+def events(data):
+    """[(event, data)] of an SSE byte string"""
+    out = []
+    for block in data.decode("utf-8").split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if lines:
+            out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+def test_updates_between_flushes_are_coalesced():
+    feed = make_feed()
+    sub = feed.subscribe(7, 10)
+    feed.publish_status(1, {"faces": 2})
+    feed.publish_status(1, {"faces": 1, "looking": "left"})
+    feed.publish_status(2, {"faces": 1})
+    assert feed.flush() == 1
+    got = events(sub.take())
+    assert [e for e, _ in got] == ["session", "session", "status"]
+    assert got[-1][1]["sessions"] == {"1": {"faces": 1, "looking": "left"}, "2": {"faces": 1}}
+    feed.publish_status(1, {"faces": 1})  # unchanged: nothing to send
+    assert feed.flush() == 0 and sub.take() is None
+
+
+def test_subscriber_that_falls_behind_is_resent_a_snapshot():
+    feed = make_feed(max_chunks=2)
+    sub = feed.subscribe(7, 10)
+    stream = feed.stream(sub, heartbeat=0.01)
+    assert events(next(stream))[0][0] == "snapshot"
+    for faces in range(3):  # one batch more than the buffer holds
+        feed.publish_status(1, {"faces": faces})
+        feed.flush()
+    assert len(sub._chunks) == 0  # the backlog was dropped, not kept growing
+    (event, snapshot), = events(next(stream))
+    assert event == "snapshot" and snapshot["sessions"]["1"]["faces"] == 2
+    assert feed.resyncs == 1
+    assert next(stream) == b": ping\n\n"
+    stream.close()
+    assert feed.subscriber_count() == 0
+
+
+def test_feeds_share_updates_through_the_channel(tmp_path):
+    state = SessionState(SharedMemoryBackend(tmp_path / "state.db"))
+    worker, watcher = make_feed(channel=state.channel("live")), make_feed(channel=state.channel("live"))
+    worker.flush(), watcher.flush()  # both start reading here
+    sub = watcher.subscribe(7, 10)
+    worker.publish_status(3, {"faces": 1})
+    worker.publish_event("violation", 3, {"type": "NO_FACE"})
+    worker.flush()
+    assert watcher.flush() == 1
+    got = dict(events(sub.take()))
+    assert got["status"]["sessions"] == {"3": {"faces": 1}}
+    assert got["violation"] == {"session_id": 3, "type": "NO_FACE"}
+    assert "3" in events(watcher.snapshot(7))[0][1]["sessions"]
+
+
+def read_until(sock, marker):
+    data = b""
+    while marker not in data:
+        chunk = sock.recv(65536)
+        assert chunk, data
+        data += chunk
+    return data
+
+
+def test_server_streams_without_a_thread_per_watcher():
+    threads_before = threading.active_count()
+    feed = make_feed()
+    server = LiveServer(feed, lambda exam_id, token: None if token == "ok" else (401, "Invalid stream token"))
+    listener = listen("127.0.0.1:0")
+    port = listener.getsockname()[1]
+    loop = threading.Thread(target=server.serve_forever, args=(listener,))
+    loop.start()
+    try:
+        watchers = [socket.create_connection(("127.0.0.1", port), timeout=5) for _ in range(20)]
+        for sock in watchers:
+            sock.sendall(b"GET /api/exam/7/live?stream_token=ok HTTP/1.1\r\nHost: x\r\n\r\n")
+            head = read_until(sock, b"event: snapshot")
+            assert head.startswith(b"HTTP/1.1 200 OK") and b"text/event-stream" in head
+        assert threading.active_count() - threads_before == 2  # the server loop and the publisher
+        feed.publish_status(1, {"faces": 1})
+        feed.flush()
+        for sock in watchers:
+            assert b'"faces":1' in read_until(sock, b"event: status")
+        watchers[0].close()
+        refused = socket.create_connection(("127.0.0.1", port), timeout=5)
+        refused.sendall(b"GET /api/exam/7/live?stream_token=bad HTTP/1.1\r\n\r\n")
+        assert read_until(refused, b"}").startswith(b"HTTP/1.1 401")
+        refused.close()
+    finally:
+        server.stop()
+        loop.join(5)
+        listener.close()
+    assert feed.subscriber_count() == 0
+
+
+def test_server_checks_stream_tokens_like_the_app_route(app, new_user):
+    staff, student = new_user(role="staff"), new_user()
+    assert app.live_stream_refusal(7, app.make_live_token(7, staff)) is None
+    assert app.live_stream_refusal(8, app.make_live_token(7, staff)) == (401, "Stream token does not match exam")
+    assert app.live_stream_refusal(7, app.make_live_token(7, student)) == (403, "Staff only")
+    assert app.live_stream_refusal(7, "")[0] == 401
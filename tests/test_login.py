@@ -0,0 +1,52 @@
+import threading
+
+from werkzeug.security import generate_password_hash
+
+FAST_HASH = "pbkdf2:sha256:1000"
+
+
+def login(client, email, password, ip="127.0.0.1"):
+    return client.post("/api/login", json={"email": email, "password": password},
+                       environ_base={"REMOTE_ADDR": ip})
+
+
+def test_failed_logins_lock_out_one_address_only(app, client, new_user):
+    email = new_user(password_hash=generate_password_hash("right", FAST_HASH)) + "@example.com"
+    for _ in range(app.LOGIN_ACCOUNT_MAX_FAILURES):
+        assert login(client, email, "wrong", ip="10.0.0.1").status_code == 401
+    locked = login(client, email, "right", ip="10.0.0.1")
+    assert locked.status_code == 429 and int(locked.headers["Retry-After"]) > 0
+    # the examinee, elsewhere, is not locked out by someone else's guesses
+    assert login(client, email, "right", ip="10.0.0.2").status_code == 200
+
+
+def test_successful_login_clears_failures(app, client, new_user):
+    email = new_user(password_hash=generate_password_hash("right", FAST_HASH)) + "@example.com"
+    for _ in range(app.LOGIN_ACCOUNT_MAX_FAILURES - 1):
+        login(client, email, "wrong", ip="10.0.1.1")
+    assert login(client, email, "right", ip="10.0.1.1").status_code == 200
+    assert login(client, email, "wrong", ip="10.0.1.1").status_code == 401
+
+
+def test_full_password_pool_answers_503(app, client, new_user, monkeypatch):
+    email = new_user(password_hash=generate_password_hash("right", FAST_HASH)) + "@example.com"
+    monkeypatch.setattr(app, "_password_slots", threading.BoundedSemaphore(1))
+    release = threading.Event()
+    app.run_password_task("check", release.wait, wait=False)  # takes the only slot
+    try:
+        busy = login(client, email, "right", ip="10.0.2.1")
+        assert busy.status_code == 503 and busy.headers["Retry-After"] == "5"
+    finally:
+        release.set()
+
+
+def test_only_weaker_hashes_are_upgraded(app, monkeypatch):
+    monkeypatch.setattr(app, "_password_target", (2, 32768 * 8 * 1))  # scrypt:32768:8:1
+    assert not app.password_hash_outdated("scrypt:32768:8:1$salt$hash")
+    assert not app.password_hash_outdated("scrypt:65536:8:1$salt$hash")
+    assert app.password_hash_outdated("scrypt:16384:8:1$salt$hash")
+    assert app.password_hash_outdated("pbkdf2:sha256:600000$salt$hash")
+    monkeypatch.setattr(app, "_password_target", (1, 260000))  # pbkdf2:sha256:260000
+    assert not app.password_hash_outdated("scrypt:32768:8:1$salt$hash")  # never downgraded
+    assert app.password_hash_outdated("pbkdf2:sha256:150000$salt$hash")
+    assert app.password_hash_outdated("pbkdf2:sha1:900000$salt$hash")
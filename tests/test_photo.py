@@ -0,0 +1,47 @@
+import hashlib
+import io
+
+from PIL import Image
+
+
+def stored_photo(app, tmp_path, monkeypatch, name=None):
+    """A registered photo file under a temporary upload dir; returns (path, sha256)"""
+    monkeypatch.setattr(app, "THUMB_DIR", tmp_path / "thumbs")
+    (tmp_path / "thumbs").mkdir(exist_ok=True)
+    buf = io.BytesIO()
+    Image.new("RGB", (320, 240), (200, 120, 40)).save(buf, "JPEG")
+    digest = hashlib.sha256(buf.getvalue()).hexdigest()
+    path = tmp_path / (name or f"{digest}.jpg")
+    path.write_bytes(buf.getvalue())
+    return str(path), digest
+
+
+def test_photo_revalidates_with_a_304(app, client, new_user, tmp_path, monkeypatch):
+    path, digest = stored_photo(app, tmp_path, monkeypatch)
+    user_id = new_user(photo_path=path)
+    first = client.get(f"/api/photo/{user_id}")
+    assert first.status_code == 200 and first.headers["ETag"] == f'"{digest}"'
+    assert "private" in first.headers["Cache-Control"] and "public" not in first.headers["Cache-Control"]
+    again = client.get(f"/api/photo/{user_id}", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+    changed = client.get(f"/api/photo/{user_id}", headers={"If-None-Match": '"other"'})
+    assert changed.status_code == 200 and changed.data == first.data
+
+
+def test_thumbnail_has_its_own_etag(app, client, new_user, tmp_path, monkeypatch):
+    path, digest = stored_photo(app, tmp_path, monkeypatch)
+    user_id = new_user(photo_path=path)
+    thumb = client.get(f"/api/photo/{user_id}?size=thumb")
+    assert thumb.status_code == 200 and thumb.headers["ETag"] == f'"{digest}-t{app.THUMB_SIZE}"'
+    assert max(Image.open(io.BytesIO(thumb.data)).size) <= app.THUMB_SIZE
+    assert (tmp_path / "thumbs" / f"{digest}.jpg").exists()
+    again = client.get(f"/api/photo/{user_id}?size=thumb", headers={"If-None-Match": thumb.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_photos_saved_before_content_addressing_are_hashed(app, client, new_user, tmp_path, monkeypatch):
+    path, digest = stored_photo(app, tmp_path, monkeypatch, name="legacy.jpg")
+    user_id = new_user(photo_path=path)
+    first = client.get(f"/api/photo/{user_id}")
+    assert first.headers["ETag"] == f'"{digest}"'
+    assert client.get(f"/api/photo/{user_id}", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
@@ -0,0 +1,67 @@
+import pytest
+
+import ratelimit
+from ratelimit import TokenBucketLimiter, parse_limit
+
+
+def test_parse_limit():
+    assert parse_limit("10/s") == (10.0, 10.0)
+    assert parse_limit("30/m:10") == (0.5, 10.0)
+    assert parse_limit("5/10s") == (0.5, 5.0)
+    assert parse_limit(" 2 / h ") == (2 / 3600.0, 2.0)
+    for off in ("off", "0", "", "None"):
+        assert parse_limit(off) is None
+    for bad in ("ten/s", "10", "10/x", "0/s", "10/s:0", "10/0s"):
+        with pytest.raises(ValueError):
+            parse_limit(bad)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_rate(clock):
+    limiter = TokenBucketLimiter(rate=2.0, burst=3)
+    assert [limiter.take("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.take("a") == pytest.approx(0.5)
+    assert limiter.take("b") == 0.0  # buckets are per key
+    clock[0] += 0.5
+    assert limiter.take("a") == 0.0
+    assert limiter.take("a") == pytest.approx(0.5)
+    clock[0] += 60
+    assert [limiter.take("a") for _ in range(4)][-1] > 0  # refilled to burst, not beyond
+
+
+def test_full_buckets_are_reclaimed_first(clock):
+    limiter = TokenBucketLimiter(rate=1.0, burst=2, capacity=4)
+    for key in "abcd":
+        limiter.take(key)
+    clock[0] += 10  # every bucket has refilled
+    limiter.take("e")
+    assert len(limiter) == 1 and limiter.evicted == 0
+
+
+def test_eviction_keeps_recently_used_buckets(clock):
+    limiter = TokenBucketLimiter(rate=0.001, burst=2, capacity=4)
+    for _ in range(2):
+        limiter.take("abuser")  # created first, drained
+    for key in "bcd":
+        limiter.take(key)
+        clock[0] += 1
+        limiter.take("abuser")  # keeps hammering
+    limiter.take("e")  # arrays full, nothing refilled: the least recently used half goes
+    assert limiter.evicted == 2
+    assert "abuser" in limiter._slots
+    assert limiter.take("abuser") > 0  # still empty, not reset to a full bucket
+
+
+def test_malformed_env_limit_falls_back_to_the_default(app, monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_ANALYZE_FRAME", "lots/s")
+    monkeypatch.setenv("RATE_LIMIT_API_VERIFY", "off")
+    limits = app._rate_limits_from_env()
+    key, limiter = limits["analyze_frame"]
+    assert (key, limiter.rate, limiter.burst) == ("session", 10.0, 20.0)
+    assert "api_verify" not in limits
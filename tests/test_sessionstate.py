@@ -0,0 +1,54 @@
+import threading
+
+from sessionstate import SessionState, SharedMemoryBackend
+
+
+def make_state(tmp_path):
+    state = SessionState(SharedMemoryBackend(tmp_path / "state.db"))
+    counts, lock = {}, threading.Lock()
+    state.bind("counts", counts, lock)
+    return state, counts
+
+
+def test_state_round_trips_through_the_backend(tmp_path):
+    state, counts = make_state(tmp_path)
+    state.load(1)
+    counts[1] = {"frames": 1}
+    state.save(1)
+    assert 1 not in counts  # dropped locally after the last request
+    state.load(1)
+    assert counts[1] == {"frames": 1}
+    state.save(1)
+
+
+def test_overlapping_requests_share_entries_until_the_last_save(tmp_path):
+    state, counts = make_state(tmp_path)
+    writes = []
+    apply = state.backend.apply
+    state.backend.apply = lambda sets, deletes, ttl: (writes.append((dict(sets), list(deletes))),
+                                                      apply(sets, deletes, ttl))
+    state.load(1)
+    counts[1] = {"frames": 1}
+    state.load(1)  # a second request of the session arrives meanwhile
+    assert counts[1] == {"frames": 1}  # not replaced by the backend's (empty) copy
+    state.save(1)  # the first one finishes
+    assert counts[1] == {"frames": 1}  # still held by the second
+    counts[1]["frames"] += 1
+    state.save(1)
+    assert 1 not in counts
+    assert all(not deletes for _, deletes in writes)  # no spurious DELETE
+    state.load(1)
+    assert counts[1] == {"frames": 2}
+    state.save(1)
+
+
+def test_unchanged_entries_are_not_written(tmp_path):
+    state, counts = make_state(tmp_path)
+    state.load(1)
+    counts[1] = {"frames": 1}
+    state.save(1)
+    writes = []
+    state.backend.apply = lambda sets, deletes, ttl: writes.append((sets, deletes))
+    state.load(1)
+    state.save(1)
+    assert writes == []
@@ -0,0 +1,290 @@
+# Conformance suite for the storage backends (see conftest.py): every
+# BaseStore method must behave the same on SQLite and PostgreSQL.
+import json
+import time
+
+import pytest
+
+import grading
+
+EXAMS = [
+    {"id": 1, "title": "Python Basics", "description": "d1", "domain": "Programming", "difficulty": "Easy"},
+    {"id": 2, "title": "Networks", "description": "d2", "domain": "Networking", "difficulty": "Medium"},
+]
+QUESTIONS = {
+    1: [{"question": "q1", "options": ["a", "b", "c"], "answer": 1},
+        {"question": "q2", "options": ["a", "b"], "answer": 0},
+        {"question": "q3", "options": ["a", "b", "c", "d"], "answer": 3}],
+    2: [{"question": "n1", "options": ["x", "y"], "answer": 1}],
+}
+NOW = "2026-01-01T00:00:00Z"
+
+
+def seed(store):
+    store.seed_exams(EXAMS, QUESTIONS, NOW)
+
+
+def add_user(store, user_id="u1", email=None, photo_path=None, role="student"):
+    store.create_user({"user_id": user_id, "full_name": f"User {user_id}", "student_id": f"S-{user_id}",
+                       "email": email or f"{user_id}@example.com", "phone": "", "course": "CS",
+                       "role": role, "password_hash": "hash-" + user_id, "photo_path": photo_path,
+                       "encoding_path": None, "notes": "", "created_at": NOW})
+    return user_id
+
+
+def finished_session(store, user_id, exam_id, answers=None, correct=0):
+    sid = store.create_session(user_id, exam_id, NOW)
+    total = len(QUESTIONS[exam_id])
+    report_id = store.complete_session(sid, user_id, exam_id, NOW, total, correct, float(correct),
+                                       correct * 100.0 / total, answers)
+    return sid, report_id
+
+
+# ---- schema / meta ----
+def test_init_schema_is_idempotent(store):
+    store.init_schema()
+    assert store.list_exams() == []
+
+
+def test_meta_roundtrip_and_overwrite(store):
+    assert store.get_meta("version") is None
+    store.set_meta("version", "1")
+    store.set_meta("version", "2")
+    assert store.get_meta("version") == "2"
+
+
+def test_stats_names_backend(store):
+    assert store.stats()["backend"] in ("sqlite", "postgresql")
+
+
+# ---- exams ----
+def test_seed_exams_and_reseed_replaces_questions(store):
+    seed(store)
+    assert [e["id"] for e in store.list_exams()] == [1, 2]
+    seed(store)
+    questions = store.get_questions(1)
+    assert [q["question"] for q in questions] == ["q1", "q2", "q3"]
+    assert json.loads(questions[0]["options"]) == ["a", "b", "c"]
+    assert store.list_exams()[0]["total_questions"] == 3
+
+
+def test_exam_lookups(store):
+    seed(store)
+    assert [e["title"] for e in store.list_exams("networking")] == ["Networks"]
+    assert store.list_domains() == ["Networking", "Programming"]
+    assert store.get_active_exam(2)["exam_title"] == "Networks"
+    assert store.get_active_exam(99) is None
+
+
+def test_answer_keys(store):
+    seed(store)
+    ordered = store.get_ordered_answer_key(1)
+    assert [correct for _, correct in ordered] == [1, 0, 3]
+    assert store.get_answer_key(1) == dict(ordered)
+
+
+# ---- users ----
+def test_users(store):
+    add_user(store, "u1", photo_path="uploads/abc.jpg", role="staff")
+    assert store.email_exists("u1@example.com")
+    assert not store.email_exists("nobody@example.com")
+    assert store.photo_in_use("uploads/abc.jpg")
+    assert not store.photo_in_use("uploads/other.jpg")
+    user = store.get_user("u1")
+    assert (user["full_name"], user["role"], user["photo_path"]) == ("User u1", "staff", "uploads/abc.jpg")
+    assert store.get_user("missing") is None
+    assert store.get_user_by_email("u1@example.com")["password_hash"] == "hash-u1"
+    store.update_password_hash("u1", "new-hash")
+    assert store.get_user_by_email("u1@example.com")["password_hash"] == "new-hash"
+
+
+def test_create_user_returns_id_and_enforces_unique_email(store):
+    first = store.create_user({"user_id": "a", "email": "same@example.com"})
+    assert isinstance(first, int)
+    with pytest.raises(Exception):
+        store.create_user({"user_id": "b", "email": "same@example.com"})
+    assert not store.email_exists("b@example.com")
+
+
+# ---- token revocation ----
+def test_revoked_tokens(store):
+    store.revoke_token("h1", time.time() + 60)
+    store.revoke_token("h1", time.time() + 60)  # revoking twice is harmless
+    assert store.is_token_revoked("h1")
+    assert not store.is_token_revoked("h2")
+
+
+def test_lapsed_revocations_are_dropped(store):
+    store.revoke_token("old", time.time() - 1)
+    store.revoke_token("new", time.time() + 60)
+    assert not store.is_token_revoked("old")
+    assert store.is_token_revoked("new")
+
+
+# ---- sessions ----
+def test_session_lifecycle(store):
+    seed(store)
+    add_user(store, "u1")
+    sid = store.create_session("u1", 1, NOW)
+    assert store.find_active_session("u1", 1)["session_id"] == sid
+    assert store.count_active_sessions() == 1
+    assert store.get_active_session(sid, "u1")["exam_id"] == 1
+    assert store.get_active_session(sid, "someone-else") is None
+    assert store.get_session_owner(sid) == "u1"
+    live = store.get_live_session(sid)
+    assert (live["exam_id"], live["user_id"], live["name"], live["student_id"]) == (1, "u1", "User u1", "S-u1")
+
+    report_id = store.complete_session(sid, "u1", 1, NOW, 3, 2, 2.0, 66.67, b"\x01\x00\xff")
+    assert isinstance(report_id, int)
+    assert store.find_active_session("u1", 1) is None
+    assert store.count_active_sessions() == 0
+    assert store.get_session_owner(sid) is None
+    assert store.get_live_session(sid) is None
+    assert store.get_answers(sid) == b"\x01\x00\xff"
+
+
+def test_complete_session_without_answers(store):
+    seed(store)
+    add_user(store, "u1")
+    sid, _ = finished_session(store, "u1", 1)
+    assert store.get_answers(sid) is None
+
+
+# ---- reports ----
+def test_reports(store):
+    seed(store)
+    add_user(store, "u1")
+    sid, report_id = finished_session(store, "u1", 1, correct=2)
+    report = store.get_report(sid, "u1")
+    assert (report["report_id"], report["correct_answers"], report["exam_title"]) == (report_id, 2, "Python Basics")
+    assert report["end_time"] == NOW
+    assert store.get_report(sid, "u2") is None
+    detail = store.get_report_detail(sid, "u1")
+    assert (detail["full_name"], detail["email"], detail["domain"]) == ("User u1", "u1@example.com", "Programming")
+
+
+# ---- answers ----
+def test_save_and_get_answers(store):
+    seed(store)
+    add_user(store, "u1")
+    sid = store.create_session("u1", 1, NOW)
+    assert store.get_answers(sid) is None
+    store.save_answers(sid, 1, b"\x00\x01\x02", NOW)
+    store.save_answers(sid, 1, b"\x02\x01\x00", NOW)
+    assert store.get_answers(sid) == b"\x02\x01\x00"
+
+
+def test_merge_answers_applies_deltas_to_active_sessions_only(store):
+    seed(store)
+    add_user(store, "u1")
+    add_user(store, "u2")
+    active = store.create_session("u1", 1, NOW)
+    ended, _ = finished_session(store, "u2", 1, answers=b"\x01\x01\x01")
+
+    def apply(blob, stamps, delta):
+        return grading.apply_stamped_delta(blob, stamps, 3, delta)
+
+    merged = store.merge_answers([(active, 1, {0: (2, 10.0)}), (ended, 1, {0: (0, 10.0)})], apply, NOW)
+    assert merged == {active: bytes([2, 255, 255])}
+    merged = store.merge_answers([(active, 1, {2: (1, 20.0)})], apply, NOW)
+    assert merged[active] == bytes([2, 255, 1])
+    assert store.get_answers(active) == bytes([2, 255, 1])
+    assert store.get_answers(ended) == b"\x01\x01\x01"
+
+
+def test_merge_answers_keeps_the_latest_change(store):
+    seed(store)
+    add_user(store, "u1")
+    sid = store.create_session("u1", 1, NOW)
+
+    def apply(blob, stamps, delta):
+        return grading.apply_stamped_delta(blob, stamps, 3, delta)
+
+    store.merge_answers([(sid, 1, {0: (2, 200.0), 1: (1, 200.0)})], apply, NOW)
+    # an older delta flushed later (e.g. by another worker) does not overwrite
+    merged = store.merge_answers([(sid, 1, {0: (0, 100.0), 2: (0, 100.0)})], apply, NOW)
+    assert merged[sid] == bytes([2, 1, 0])
+    store.save_answers(sid, 1, bytes([2, 1, 0]), NOW)  # keeps the stamps
+    merged = store.merge_answers([(sid, 1, {1: (0, 150.0), 2: (3, 300.0)})], apply, NOW)
+    assert merged[sid] == bytes([2, 1, 3])
+
+
+def test_merge_answers_unknown_session(store):
+    assert store.merge_answers([(12345, 1, {0: (1, 1.0)})], lambda blob, stamps, delta: (b"", None), NOW) == {}
+
+
+def test_init_schema_adds_new_columns_to_old_tables(store):
+    def downgrade(cur):
+        cur.execute("DROP TABLE session_answers")
+        cur.execute("""CREATE TABLE session_answers (session_id INTEGER PRIMARY KEY, exam_id INTEGER NOT NULL,
+                       answers {blob} NOT NULL, updated_at TEXT)""".format(blob=store.blob_type))
+    store._run(downgrade)
+    store.init_schema()
+    seed(store)
+    add_user(store, "u1")
+    sid = store.create_session("u1", 1, NOW)
+    store.merge_answers([(sid, 1, {0: (1, 1.0)})], lambda blob, stamps, delta: (b"\x01", b"\x00" * 8), NOW)
+    assert store.get_answers(sid) == b"\x01"
+
+
+# ---- regrading ----
+def test_exam_submissions_and_report_scores(store):
+    seed(store)
+    for uid in ("u1", "u2", "u3"):
+        add_user(store, uid)
+    s1, r1 = finished_session(store, "u1", 1, answers=bytes([1, 0, 3]), correct=3)
+    _, r2 = finished_session(store, "u2", 1, answers=bytes([0, 0, 255]), correct=1)
+    finished_session(store, "u3", 1, correct=0)  # submitted before answers were stored
+    finished_session(store, "u1", 2, answers=b"\x01", correct=1)
+
+    assert store.count_exam_reports(1) == 3
+    submissions = store.list_exam_submissions(1)
+    assert submissions == [(r1, 3, 3, bytes([1, 0, 3])), (r2, 3, 1, bytes([0, 0, 255]))]
+
+    store.update_report_scores([(3, 2, 2.0, 66.5, r1)])
+    store.update_report_scores([])
+    assert store.list_exam_submissions(1)[0][:3] == (r1, 3, 2)
+    report = store.get_report(s1, "u1")
+    assert (report["marks"], report["percentage"]) == (2.0, 66.5)
+
+
+def test_regrade_exam_end_to_end(store):
+    seed(store)
+    add_user(store, "u1")
+    _, report_id = finished_session(store, "u1", 1, answers=bytes([1, 0, 0]), correct=0)
+    summary = grading.regrade_exam(store, 1)
+    assert (summary["submissions"], summary["changed"], summary["without_answers"]) == (1, 1, 0)
+    assert store.list_exam_submissions(1)[0][2] == 2
+
+
+# ---- violation logs ----
+def test_violations(store):
+    seed(store)
+    add_user(store, "u1")
+    sid = store.create_session("u1", 1, NOW)
+    vid = store.add_violation(sid, "NO_FACE", "gone", "2026-01-01T00:00:02Z", "high")
+    assert isinstance(vid, int)
+    store.add_violations([(sid, "VOICE", "loud", "2026-01-01T00:00:01Z", "low"),
+                          (sid, "TAB_SWITCH", "left", "2026-01-01T00:00:03Z", "medium")])
+    store.add_violations([])
+    rows = store.list_violations(sid)
+    assert [r["violation_type"] for r in rows] == ["VOICE", "NO_FACE", "TAB_SWITCH"]
+    assert rows[1]["violation_id"] == vid and rows[1]["severity"] == "high"
+    assert store.list_violations(sid + 1) == []
+
+
+# ---- process safety ----
+def test_postgres_pool_is_per_process(store, monkeypatch):
+    if store.stats()["backend"] != "postgresql":
+        pytest.skip("SQLite opens a connection per call")
+    import os
+    parent_pool = store.pool
+    assert store.pool is parent_pool
+    monkeypatch.setattr(os, "getpid", lambda: -1)  # as seen from a forked child
+    assert store.pool is not parent_pool
+    assert parent_pool in store._inherited and not parent_pool.closed
+    assert store.count_active_sessions() == 0
+    store.close()
+    assert store.count_active_sessions() == 0  # reopened on demand
+    monkeypatch.undo()
+    parent_pool.closeall()
@@ -0,0 +1,79 @@
+import numpy as np
+
+import timeline as tl
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def recorded(tmp_path, monkeypatch, samples):
+    """Timeline with session 1 holding (seconds, kind, faces, flags, value) samples"""
+    clock = Clock(1000.0)
+    monkeypatch.setattr(tl.time, "time", clock)
+    timeline = tl.Timeline(tmp_path)
+    for at, kind, faces, flags, value in samples:
+        clock.now = 1000.0 + at
+        timeline.append(1, kind, faces=faces, flags=flags, value=value)
+    return timeline
+
+
+def test_appends_are_read_back(tmp_path, monkeypatch):
+    timeline = recorded(tmp_path, monkeypatch, [(0, tl.KIND_FRAME, 1, 0, 0.1),
+                                                 (1.5, tl.KIND_VOICE, 255, tl.FLAG_VOICE, 0.3),
+                                                 (3, tl.KIND_FRAME, 0, tl.FLAG_NO_FACE, np.nan)])
+    start, samples = timeline.read(1)
+    assert start == 1000.0
+    assert samples["t_ms"].tolist() == [0, 1500, 3000]
+    assert samples["faces"].tolist() == [1, 255, 0]
+    start, samples = timeline.read(2)
+    assert start is None and len(samples) == 0
+    timeline.close(1)
+    reopened = tl.Timeline(tmp_path)  # e.g. another worker: keeps the session's start
+    monkeypatch.setattr(tl.time, "time", Clock(1004.0))
+    reopened.append(1, tl.KIND_FRAME, faces=1)
+    assert reopened.read(1)[1]["t_ms"].tolist() == [0, 1500, 3000, 4000]
+
+
+def test_range_is_half_open_and_in_time_order(tmp_path, monkeypatch):
+    # workers append concurrently, so samples can land slightly out of order
+    timeline = recorded(tmp_path, monkeypatch, [(t, tl.KIND_FRAME, 1, 0, 0.0) for t in (0, 2, 1, 3, 5, 4)])
+    _, samples = timeline.range(1, 1, 4)
+    assert samples["t_ms"].tolist() == [1000, 2000, 3000]
+    assert len(timeline.range(1, 10)[1]) == 0
+
+
+def test_downsample_buckets(tmp_path, monkeypatch):
+    timeline = recorded(tmp_path, monkeypatch, [
+        (0, tl.KIND_FRAME, 1, 0, 0.2),
+        (1, tl.KIND_FRAME, 2, tl.FLAG_MULTIPLE_FACES, 0.5),
+        (2, tl.KIND_VOICE, 255, tl.FLAG_VOICE, 0.7),
+        (6, tl.KIND_FRAME, 0, tl.FLAG_NO_FACE, 1.4),
+    ])
+    summary = timeline.downsample(1, 4, 0, 8)  # 2 s buckets
+    assert summary["bucket_s"] == 2.0 and summary["t"] == [0.0, 2.0, 4.0, 6.0]
+    assert summary["frames"] == [2, 0, 0, 1]
+    assert summary["faces_min"] == [1, None, None, 0]
+    assert summary["faces_max"] == [2, None, None, 0]
+    assert summary["pose_max"] == [0.5, None, None, 1.4]
+    assert summary["rms_max"] == [None, 0.7, None, None]
+    assert summary["multiple_faces"] == [1, 0, 0, 0]
+    assert summary["voice"] == [0, 1, 0, 0]
+    assert summary["no_face"] == [0, 0, 0, 1]
+
+
+def test_raw_samples_are_capped(app, client, new_session, auth, monkeypatch):
+    user_id, exam_id, sid = new_session()
+    app.store.complete_session(sid, user_id, exam_id, "2026-01-01T01:00:00Z", 0, 0, 0.0, 0.0, None)
+    for faces in range(5):
+        app.timeline.append(sid, tl.KIND_FRAME, faces=faces)
+    monkeypatch.setattr(app, "TIMELINE_RAW_MAX", 3)
+    body = client.get(f"/api/report/{sid}/timeline?raw=1", headers=auth(user_id)).get_json()
+    assert body["truncated"] and body["faces"] == [0, 1, 2]
+    monkeypatch.setattr(app, "TIMELINE_RAW_MAX", 5)
+    body = client.get(f"/api/report/{sid}/timeline?raw=1", headers=auth(user_id)).get_json()
+    assert body["faces"] == [0, 1, 2, 3, 4]
@@ -0,0 +1,66 @@
+import time
+
+import jwt
+
+
+def bearer(token):
+    return {"Authorization": "Bearer " + token}
+
+
+def test_cached_token_lapses_at_its_exp(app, client, new_user):
+    user_id = new_user()
+    token = jwt.encode({"sub": user_id, "exp": int(time.time()) + 2}, app.JWT_SECRET, algorithm=app.JWT_ALGORITHM)
+    assert client.get("/api/me", headers=bearer(token)).status_code == 200
+    assert app.token_cache.get(token) == user_id  # verified once, then served from the cache
+    while time.time() < jwt.decode(token, options={"verify_signature": False})["exp"]:
+        time.sleep(0.05)
+    resp = client.get("/api/me", headers=bearer(token))
+    assert resp.status_code == 401 and resp.get_json()["message"] == "Token expired"
+
+
+def test_logout_revokes_at_once_and_elsewhere_within_the_cache_ttl(app, client, new_user, auth, monkeypatch):
+    token = auth(new_user())["Authorization"].split(" ", 1)[1]
+    assert client.get("/api/me", headers=bearer(token)).status_code == 200
+    assert client.post("/api/logout", headers=bearer(token)).status_code == 200
+    resp = client.get("/api/me", headers=bearer(token))
+    assert resp.status_code == 401 and resp.get_json()["message"] == "Token revoked"
+
+    # revoked by another worker: this one notices once its cache entry expires
+    monkeypatch.setattr(app.token_cache, "ttl", 0.2)
+    token = auth(new_user())["Authorization"].split(" ", 1)[1]
+    assert client.get("/api/me", headers=bearer(token)).status_code == 200
+    app.store.revoke_token(app.token_hash(token), time.time() + 3600)
+    assert client.get("/api/me", headers=bearer(token)).status_code == 200
+    time.sleep(0.25)
+    assert client.get("/api/me", headers=bearer(token)).status_code == 401
+
+
+def test_proctor_token_is_rejected_once_the_session_ends(app, client, new_session, auth):
+    user_id, _, sid = new_session()
+    renewed = client.post(f"/api/session/{sid}/proctor-token", headers=auth(user_id))
+    assert renewed.status_code == 200
+    token = renewed.get_json()["proctor_token"]
+    assert app._verify_proctor_token(token) == (sid, None)
+    assert client.post("/api/session/end", headers=auth(user_id), json={"session_id": sid}).status_code == 200
+    resp = client.post("/analyze_frame", headers={"X-Proctor-Token": token},
+                       json={"session_id": sid, "image": "data:image/jpeg;base64,AA=="})
+    assert resp.status_code == 401 and resp.get_json()["error"] == "Session is not active"
+    assert client.post(f"/api/session/{sid}/proctor-token", headers=auth(user_id)).status_code == 404
+
+
+def test_session_ended_elsewhere_is_noticed_within_the_active_cache(app, new_session, monkeypatch):
+    user_id, exam_id, sid = new_session()
+    monkeypatch.setattr(app.proctor_sessions, "ttl", 0.2)
+    token = app.make_proctor_token(sid)
+    assert app._verify_proctor_token(token) == (sid, None)
+    app.store.complete_session(sid, user_id, exam_id, "2026-01-01T01:00:00Z", 0, 0, 0.0, 0.0, None)
+    assert app._verify_proctor_token(token) == (sid, None)  # still cached as active
+    time.sleep(0.25)
+    assert app._verify_proctor_token(token) == (None, "Session is not active")
+
+
+def test_forged_and_expired_proctor_tokens(app, new_session):
+    _, _, sid = new_session()
+    sid_part, exp, mac = app.make_proctor_token(sid).split(".")
+    assert app._verify_proctor_token(f"{int(sid_part) + 1}.{exp}.{mac}") == (None, "Invalid proctor token")
+    assert app._verify_proctor_token(app.make_proctor_token(sid, ttl=-1)) == (None, "Proctor token expired")
@@ -0,0 +1,190 @@
+# timeline.py
+# Per-session detection timeline: every /analyze_frame and /voice_event
+# result is appended as one fixed-width 16-byte sample to
+# <root>/<session_id>.tl, behind a 16-byte header holding the session's
+# start time. Appends are a single O_APPEND write; reads map the file and
+# view it as a structured array, so range queries and downsampling of a
+# multi-hour session are a few vectorised NumPy operations.
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+MAGIC = b"PTL1"
+HEADER = struct.Struct("<4s4xd")  # magic, start time (unix seconds)
+
+SAMPLE_DTYPE = np.dtype([
+    ("t_ms", "<u4"),      # milliseconds since the session's first sample
+    ("kind", "u1"),       # KIND_FRAME / KIND_VOICE
+    ("faces", "u1"),      # faces in the frame (255 = unknown)
+    ("flags", "u1"),      # FLAG_* bits
+    ("_pad", "u1"),
+    ("yaw", "<f2"),       # degrees, NaN when not measured
+    ("pitch", "<f2"),
+    ("value", "<f4"),     # frame: head pose severity (>= 1 is turned away); voice: RMS
+])
+assert SAMPLE_DTYPE.itemsize == 16 and HEADER.size == 16
+
+KIND_FRAME = 0
+KIND_VOICE = 1
+
+FLAG_NO_FACE = 1
+FLAG_MULTIPLE_FACES = 2
+FLAG_HEAD_POSE = 4
+FLAG_VOICE = 8
+FLAG_CLIENT = 16  # reported by on-device pre-detection, not verified on a frame
+
+
+class Timeline:
+    """Append-only per-session sample files with mmap range/downsample reads."""
+
+    def __init__(self, root, max_open=256):
+        self.root = str(root)
+        self.max_open = max_open
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._fds = OrderedDict()  # session_id -> (fd, start), least recently used first
+        self._pid = os.getpid()
+
+    def _path(self, session_id):
+        return os.path.join(self.root, f"{int(session_id)}.tl")
+
+    # ---- writing ----
+    def _open(self, session_id, now):
+        if self._pid != os.getpid():
+            # descriptors inherited over fork are shared with the parent; start afresh
+            self._fds = OrderedDict()
+            self._pid = os.getpid()
+        entry = self._fds.get(session_id)
+        if entry is not None:
+            self._fds.move_to_end(session_id)
+            return entry
+        path = self._path(session_id)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o640)
+            os.write(fd, HEADER.pack(MAGIC, now))
+            start = now
+        except FileExistsError:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+            start = self._read_start(path, now)
+        self._fds[session_id] = (fd, start)
+        while len(self._fds) > self.max_open:
+            os.close(self._fds.popitem(last=False)[1][0])
+        return fd, start
+
+    def _read_start(self, path, default):
+        # another worker may have created the file and not yet written the header
+        for _ in range(50):
+            with open(path, "rb") as f:
+                head = f.read(HEADER.size)
+            if len(head) == HEADER.size:
+                return HEADER.unpack(head)[1]
+            time.sleep(0.001)
+        return default
+
+    def append(self, session_id, kind, faces=255, flags=0, yaw=np.nan, pitch=np.nan, value=np.nan):
+        now = time.time()
+        sample = np.zeros(1, dtype=SAMPLE_DTYPE)
+        with self._lock:
+            fd, start = self._open(session_id, now)
+            sample[0] = (max(0, int((now - start) * 1000)), kind, min(int(faces), 255), flags, 0, yaw, pitch, value)
+            os.write(fd, sample.tobytes())
+
+    def close(self, session_id):
+        with self._lock:
+            entry = self._fds.pop(session_id, None)
+        if entry is not None:
+            os.close(entry[0])
+
+    # ---- reading ----
+    def read(self, session_id):
+        """(start, samples) with samples a read-only array over the mapped file; (None, empty) if absent"""
+        empty = np.zeros(0, dtype=SAMPLE_DTYPE)
+        try:
+            with open(self._path(session_id), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < HEADER.size:
+                    return None, empty
+                mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        except OSError:
+            return None, empty
+        magic, start = HEADER.unpack_from(mm)
+        if magic != MAGIC:
+            return None, empty
+        count = (size - HEADER.size) // SAMPLE_DTYPE.itemsize
+        return start, np.frombuffer(mm, dtype=SAMPLE_DTYPE, count=count, offset=HEADER.size)
+
+    def range(self, session_id, t0=None, t1=None):
+        """Samples with t0 <= seconds-since-start < t1, in time order"""
+        start, samples = self.read(session_id)
+        t = samples["t_ms"]
+        keep = np.ones(len(samples), dtype=bool)
+        if t0 is not None:
+            keep &= t >= t0 * 1000
+        if t1 is not None:
+            keep &= t < t1 * 1000
+        samples = samples[keep]
+        t = samples["t_ms"]
+        if len(t) > 1 and (t[1:] < t[:-1]).any():
+            # workers append concurrently, so order is only approximately by time
+            samples = samples[np.argsort(t, kind="stable")]
+        return start, samples
+
+    def downsample(self, session_id, buckets, t0=None, t1=None):
+        """Per-bucket summary of [t0, t1) as a dict of equal-length lists"""
+        start, samples = self.range(session_id, t0, t1)
+        buckets = max(1, int(buckets))
+        t_ms = samples["t_ms"].astype(np.float64)
+        lo = t0 * 1000 if t0 is not None else 0.0
+        hi = t1 * 1000 if t1 is not None else (t_ms[-1] + 1 if len(t_ms) else 1.0)
+        width = max(1.0, (hi - lo) / buckets)
+        b = np.minimum(((t_ms - lo) // width).astype(np.int64), buckets - 1)
+
+        frame = samples["kind"] == KIND_FRAME
+        voice = samples["kind"] == KIND_VOICE
+        known = frame & (samples["faces"] != 255)
+        # samples are sorted, so each bucket is a contiguous run: reduce the runs
+        starts = np.searchsorted(b, np.arange(buckets))
+        filled = starts < np.append(starts[1:], len(b))
+
+        def per_bucket(reduce, mask, values):
+            out = np.full(buckets, np.nan)
+            if filled.any():
+                out[filled] = reduce.reduceat(np.where(mask, values, np.nan), starts[filled])
+            return out
+
+        def bucket_max(mask, values):
+            return per_bucket(np.fmax, mask, values)
+
+        def bucket_min(mask, values):
+            return per_bucket(np.fmin, mask, values)
+
+        faces = samples["faces"].astype(np.float64)
+        flags = samples["flags"]
+
+        def flag_count(bit):
+            return np.bincount(b[(flags & bit) != 0], minlength=buckets)
+
+        def listed(a):
+            return [None if x != x else round(x, 3) for x in a.tolist()]
+
+        return {
+            "start": start,
+            "bucket_s": width / 1000.0,
+            "t": [round((lo + i * width) / 1000.0, 3) for i in range(buckets)],
+            "frames": np.bincount(b[frame], minlength=buckets).tolist(),
+            "faces_min": listed(bucket_min(known, faces)),
+            "faces_max": listed(bucket_max(known, faces)),
+            "yaw_max": listed(bucket_max(frame, np.abs(samples["yaw"].astype(np.float64)))),
+            "pitch_max": listed(bucket_max(frame, np.abs(samples["pitch"].astype(np.float64)))),
+            "pose_max": listed(bucket_max(frame, samples["value"].astype(np.float64))),
+            "rms_max": listed(bucket_max(voice, samples["value"].astype(np.float64))),
+            "no_face": flag_count(FLAG_NO_FACE).tolist(),
+            "multiple_faces": flag_count(FLAG_MULTIPLE_FACES).tolist(),
+            "head_pose": flag_count(FLAG_HEAD_POSE).tolist(),
+            "voice": flag_count(FLAG_VOICE).tolist(),
+        }
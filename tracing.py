@@ -0,0 +1,218 @@
+# tracing.py
+# Lightweight per-request span recording with head sampling and a
+# "keep slow requests" rule, exported off the request path to a local
+# JSONL file (one trace per line) or OTLP/JSON (one ExportTraceServiceRequest
+# per line, readable by the OpenTelemetry file receiver).
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+_current = ContextVar("current_trace", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start_ns", "end_ns", "attrs")
+
+    def __init__(self, trace, name, parent_id, attrs):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = 0
+        self.end_ns = 0
+        self.attrs = attrs
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self.trace._stack.append(self.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        self.trace._stack.pop()
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.trace.spans.append(self)
+        return False
+
+
+class Trace:
+    def __init__(self, name, sampled, attrs):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.root = Span(self, name, None, dict(attrs or {}))
+        self.spans = []
+        self._stack = []
+
+
+class Tracer:
+    """Records spans for the current request and hands finished traces to an exporter thread.
+
+    sample_rate: fraction of requests always exported (0 disables head sampling)
+    slow_ms:     requests slower than this are exported even if not sampled (0 disables)
+    """
+
+    def __init__(self, path, sample_rate=0.0, slow_ms=0.0, fmt="jsonl", service="exam-proctoring", max_queue=1000):
+        self.path = str(path)
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.slow_ms = slow_ms
+        self.fmt = fmt
+        self.service = service
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._writer = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    # ---- recording ----
+    def start(self, name, **attrs):
+        if not self.enabled:
+            return None
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        if not sampled and not self.slow_ms:
+            return None
+        trace = Trace(name, sampled, attrs)
+        trace.root.__enter__()
+        _current.set(trace)
+        return trace
+
+    def span(self, name, **attrs):
+        trace = _current.get()
+        if trace is None:
+            return NOOP_SPAN
+        return Span(trace, name, trace._stack[-1] if trace._stack else None, attrs)
+
+    def annotate(self, key, value):
+        trace = _current.get()
+        if trace is not None:
+            trace.root.attrs[key] = value
+
+    def finish(self, **attrs):
+        trace = _current.get()
+        if trace is None:
+            return
+        _current.set(None)
+        trace.root.attrs.update(attrs)
+        trace.root.__exit__(None, None, None)
+        duration_ms = (trace.root.end_ns - trace.root.start_ns) / 1e6
+        if not trace.sampled and not (self.slow_ms and duration_ms >= self.slow_ms):
+            return
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    # ---- export ----
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            encode = self._otlp if self.fmt == "otlp" else self._jsonl
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for trace in batch:
+                        f.write(json.dumps(encode(trace), separators=(",", ":")) + "\n")
+            except Exception as e:
+                print(f"trace export error: {e}")
+
+    def _jsonl(self, trace):
+        root = trace.root
+        return {
+            "trace_id": trace.trace_id,
+            "span_id": root.span_id,
+            "name": root.name,
+            "start": root.start_ns / 1e9,
+            "duration_ms": round((root.end_ns - root.start_ns) / 1e6, 3),
+            "sampled": trace.sampled,
+            "attrs": root.attrs,
+            "spans": [{
+                "name": s.name,
+                "span_id": s.span_id,
+                "parent_id": s.parent_id,
+                "offset_ms": round((s.start_ns - root.start_ns) / 1e6, 3),
+                "duration_ms": round((s.end_ns - s.start_ns) / 1e6, 3),
+                "attrs": s.attrs,
+            } for s in trace.spans if s is not root],
+        }
+
+    def _otlp(self, trace):
+        def attrs(d):
+            out = []
+            for k, v in d.items():
+                if isinstance(v, bool):
+                    val = {"boolValue": v}
+                elif isinstance(v, int):
+                    val = {"intValue": str(v)}
+                elif isinstance(v, float):
+                    val = {"doubleValue": v}
+                else:
+                    val = {"stringValue": str(v)}
+                out.append({"key": k, "value": val})
+            return out
+
+        spans = []
+        for s in [trace.root] + [s for s in trace.spans if s is not trace.root]:
+            span = {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 2 if s is trace.root else 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": attrs(s.attrs),
+            }
+            if s.parent_id:
+                span["parentSpanId"] = s.parent_id
+            if "error" in s.attrs:
+                span["status"] = {"code": 2, "message": s.attrs["error"]}
+            spans.append(span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": attrs({"service.name": self.service})},
+            "scopeSpans": [{"scope": {"name": "tracing.py"}, "spans": spans}],
+        }]}
+
+
+def tracer_from_env(default_path):
+    return Tracer(
+        os.environ.get("TRACE_FILE", str(default_path)),
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "0")),
+        slow_ms=float(os.environ.get("TRACE_SLOW_MS", "0")),
+        fmt=os.environ.get("TRACE_FORMAT", "jsonl").lower(),
+    )